@@ -0,0 +1,355 @@
+# Benchmarks the transpiler on generated pulp projects.
+#
+#   python3 benchmark.py                                    (the sizes in SIZES)
+#   python3 benchmark.py --rooms 200 --tiles 600 --scripts 400 --output results.json
+#   python3 benchmark.py --compare before.json after.json
+#   python3 benchmark.py --variables                        (variable access, with lupa)
+#
+# Each project is transpiled in-process `--repeat` times, and the phases of the
+# fastest build are reported (see pulplua.PhaseTimer), along with throughput and
+# the peak memory of one more build, which is traced separately.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pulplua
+
+SIZES = {
+    "small": dict(rooms=10, tiles=40, scripts=20, depth=3, song_ticks=64, frames=80),
+    "medium": dict(rooms=100, tiles=300, scripts=200, depth=4, song_ticks=256, frames=600),
+    "large": dict(rooms=400, tiles=1200, scripts=800, depth=5, song_ticks=1024, frames=2400),
+}
+
+PHASES = ["parse", "images", "tiles", "rooms", "audio", "scripts", "variables", "output"]
+
+# generates a pulp project. scripts have events nested up to `depth` blocks deep;
+# each song has song_ticks notes on each of its 5 voices.
+def generate(rooms, tiles, scripts, depth, song_ticks, frames, seed=0):
+    r = random.Random(seed)
+
+    # frames (some duplicated, some with transparency, some false)
+    framelist = []
+    for i in range(frames):
+        if i % 8 == 7:
+            framelist.append(dict(r.choice([frame for frame in framelist if frame]), id=i))
+        elif i % 29 == 13:
+            framelist.append(False)
+        else:
+            values = [0, 1, 2, 3] if i % 17 == 0 else [0, 1]
+            framelist.append({"id": i, "data": [r.choice(values) for _ in range(64)]})
+    realframes = [i for i, frame in enumerate(framelist) if frame]
+
+    tilelist = []
+    for i in range(tiles):
+        tile = {
+            "id": i, "name": "white" if i == 0 else f"tile{i}",
+            "fps": r.choice([0, 0, 1, 4]), "type": r.randrange(5), "btype": -1,
+            "solid": r.random() < 0.3,
+            "frames": [r.choice(realframes) for _ in range(r.choice([1, 1, 2, 4]))],
+        }
+        if i % 5 == 1:
+            tile["says"] = f"I am \"tile {i}\".\nHello!"
+        tilelist.append(tile)
+
+    roomlist = []
+    for i in range(rooms):
+        roomlist.append({
+            "id": i, "name": f"room{i}", "song": r.choice([-1, -2, 0]),
+            "tiles": [r.randrange(tiles) for _ in range(375)],
+            "exits": [
+                {"x": 24, "y": 7, "tx": 0, "ty": 7, "room": (i + 1) % rooms},
+                {"x": 0, "y": 0, "edge": 3, "fin": "the end"},
+            ],
+        })
+
+    sounds = []
+    for i in range(8):
+        sounds.append({
+            "id": i, "name": f"sound{i}", "bpm": 120, "type": i % 5, "ticks": 16,
+            "notes": [r.randrange(12) if k % 3 == 0 else r.randrange(4) for k in range(16 * 3)],
+            "envelope": {"attack": 0.01, "decay": 0.1, "sustain": 0.5, "release": 0.2, "volume": 0.8},
+        })
+    songs = []
+    for i in range(max(1, rooms // 20)):
+        songs.append({
+            "id": i, "name": f"song{i}", "bpm": 110, "ticks": song_ticks, "loopFrom": 0,
+            "notes": [[r.randrange(13) if k % 3 == 0 else r.randrange(4) for k in range(song_ticks * 3)] for _ in range(5)],
+            "voices": [{"attack": 0.1, "decay": 0.2, "volume": 1}, {}, {"volume": 0.5}, {}, {}],
+        })
+
+    def expr():
+        c = r.randrange(6)
+        if c == 0:
+            return r.randrange(10)
+        if c == 1:
+            return ["get", r.choice(["a", "b", "event.x", "event.px", f"v{r.randrange(200)}"])]
+        if c == 2:
+            return ["format", "score: ", ["get", "a"]]
+        if c == 3:
+            return ["random", 1, 6]
+        if c == 4:
+            return ["name", ["xy", r.randrange(25), r.randrange(15)]]
+        return "text"
+
+    def script_data():
+        blocks = []
+        comments = ["a comment"]
+        def block(level):
+            idx = len(blocks)
+            blocks.append(None)
+            cmds = [["_", 1]]
+            for _ in range(r.randrange(2, 7)):
+                c = r.randrange(14)
+                nest = level < depth
+                if c == 0 and nest:
+                    cmd = ["if", [r.choice(["eq", "lt", "gte"]), "a", expr()], ["block", block(level + 1)]]
+                    if r.random() < 0.5:
+                        cmd.append(["elseif", ["eq", "b", 2], ["block", block(level + 1)]])
+                    if r.random() < 0.5:
+                        cmd.append(["else", ["block", block(level + 1)]])
+                    cmds.append(cmd)
+                elif c == 1 and nest:
+                    cmds.append(["while", ["lt", "a", 10], ["block", block(level + 1)]])
+                elif c == 2 and nest:
+                    target = r.choice([["xy", r.randrange(25), r.randrange(15)], f"tile{r.randrange(1, tiles)}"])
+                    cmds.append(["tell", target, ["block", block(level + 1)]])
+                elif c == 3:
+                    cmds.append(["set", r.choice(["a", "b", f"v{r.randrange(200)}"]), expr()])
+                elif c == 4:
+                    cmds.append(["add", "a", expr()])
+                elif c == 5:
+                    cmds.append(["call", r.choice(["update", "interact", "custom"])])
+                elif c == 6:
+                    cmds.append(["swap", f"tile{r.randrange(1, tiles)}"])
+                elif c == 7:
+                    cmds.append(["fill", r.choice(["black", "white"]), ["rect", 0, 0, 8, 8]])
+                elif c == 8:
+                    cmds.append(["label", "hello", ["xy", 1, 1]])
+                elif c == 9:
+                    cmds.append(["say", "Some dialog which is long enough that it wraps onto another line."])
+                elif c == 10:
+                    cmds.append(["sound", f"sound{r.randrange(8)}"])
+                elif c == 11:
+                    cmds.append(["#", 0])
+                elif c == 12:
+                    cmds.append(["mimic", f"tile{r.randrange(1, tiles)}"])
+                else:
+                    cmds.append(["inc", "a"])
+            blocks[idx] = cmds
+            return idx
+        data = {"__blocks": blocks, "__comments": comments}
+        for event in r.sample(["load", "enter", "update", "interact", "collect", "custom", "draw"], r.randrange(1, 5)):
+            data[event] = ["block", block(0)]
+        return data
+
+    scriptlist = [{"id": 0, "type": 0, "data": script_data()}]
+    for i in range(scripts):
+        if i % 4 == 0 and i // 4 < rooms:
+            scriptlist.append({"id": i // 4, "type": 1, "data": script_data()})
+        else:
+            scriptlist.append({"id": 1 + i % (tiles - 1), "type": 2, "data": script_data()})
+
+    return {
+        "name": "Benchmark", "author": "benchmark.py", "intro": "generated", "version": 1,
+        "card": 0, "player": {"id": 1, "room": 0, "x": 12, "y": 7},
+        "font": {
+            "type": 1,
+            "chars": [[r.randrange(2) for _ in range(64)] for _ in range(95)],
+            "pipe": [[r.randrange(2) for _ in range(64)] for _ in range(15)],
+        },
+        "frames": framelist, "tiles": tilelist, "rooms": roomlist,
+        "sounds": sounds, "songs": songs, "scripts": scriptlist,
+    }
+
+def count_events(project):
+    return sum(len([key for key in script["data"] if not key.startswith("__")])
+        for script in project["scripts"] if script and script.get("data"))
+
+# parses, transpiles and saves the project; returns the artifacts and the time of each phase.
+def build(text, outpath, jobs):
+    start = time.perf_counter()
+    project = json.loads(text)
+    parse = time.perf_counter() - start
+    with contextlib.redirect_stdout(io.StringIO()):
+        artifacts = pulplua.transpile(project, jobs=jobs)
+        start = time.perf_counter()
+        artifacts.save(outpath)
+    phases = {"parse": parse, **artifacts.phases, "output": time.perf_counter() - start}
+    return artifacts, phases
+
+def run(name, config, repeat, jobs):
+    project = generate(**config)
+    text = json.dumps(project)
+    events = count_events(project)
+
+    with tempfile.TemporaryDirectory() as outpath:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            artifacts, phases = build(text, outpath, jobs)
+            total = time.perf_counter() - start
+            if best is None or total < best[0]:
+                best = (total, phases, len(artifacts.main_lua.encode()))
+
+        tracemalloc.start()
+        build(text, outpath, jobs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    total, phases, lua_bytes = best
+    return {
+        "name": name,
+        "config": config,
+        "input_bytes": len(text.encode()),
+        "events": events,
+        "main_lua_bytes": lua_bytes,
+        "total": total,
+        "phases": {phase: phases.get(phase, 0) for phase in PHASES},
+        "throughput": {
+            "input_mb_per_s": len(text.encode()) / total / 1e6,
+            "events_per_s": events / phases["scripts"] if phases.get("scripts") else None,
+            "lua_mb_per_s": lua_bytes / total / 1e6,
+        },
+        "peak_memory_bytes": peak,
+    }
+
+# lua for a handler which adds 1 to `count` variables, each stored the way write_vars
+# in pulplua.py stores them: "local" (upvalues of the handler), "slot" (in the __VARS
+# array, for variables past LOCVARMAX, which handlers alias) or "global". returns the seconds taken to
+# call the handler `iterations` times.
+def variable_access_lua(storage, count, iterations):
+    names = [f"v{i}" for i in range(count)]
+    if storage == "local":
+        declare = "".join(f"local {name} = 0\n" for name in names)
+        refs = names
+    elif storage == "slot":
+        declare = "local __VARS <const> = {" + "0, " * count + "}\n"
+        refs = [f"__VARS[{i + 1}]" for i in range(count)]
+    else:
+        declare = "".join(f"{name} = 0\n" for name in names)
+        refs = names
+    alias = "  local __VARS <const> = __VARS\n" if storage == "slot" else ""
+    return declare \
+        + "local function handler()\n" + alias + "".join(f"  {ref} = {ref} + 1\n" for ref in refs) + "end\n" \
+        + f"local start = os.clock()\nfor _ = 1, {iterations} do handler() end\nreturn os.clock() - start\n"
+
+# nanoseconds per variable read and write, for each way of storing variables,
+# or None if lupa (https://pypi.org/project/lupa/) isn't installed to run the lua.
+def variable_access(count=100, iterations=20000, repeat=3):
+    try:
+        from lupa import lua54
+    except ImportError:
+        return None
+    results = dict()
+    for storage in ["local", "slot", "global"]:
+        lua = variable_access_lua(storage, count, iterations)
+        seconds = min(lua54.LuaRuntime().execute(lua) for _ in range(repeat))
+        results[storage] = seconds / (count * iterations) * 1e9
+    return results
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def report(result):
+    print(f"{result['name']}: {result['input_bytes'] / 1e6:.2f} MB in, {result['main_lua_bytes'] / 1e6:.2f} MB lua out, "
+        + f"{result['events']} events")
+    for phase in PHASES:
+        print(f"  {phase:10} {result['phases'][phase] * 1000:9.1f} ms")
+    print(f"  {'total':10} {result['total'] * 1000:9.1f} ms  ({result['throughput']['input_mb_per_s']:.2f} MB/s)")
+    print(f"  peak memory {result['peak_memory_bytes'] / 1e6:.1f} MB")
+
+# prints the change in each phase between two results files.
+def compare(before, after):
+    with open(before) as f:
+        before = {result["name"]: result for result in json.load(f)["results"]}
+    with open(after) as f:
+        after = {result["name"]: result for result in json.load(f)["results"]}
+    for name in after:
+        if name not in before:
+            continue
+        print(f"{name}:")
+        for key in PHASES + ["total"]:
+            a = before[name]["phases"].get(key, 0) if key != "total" else before[name]["total"]
+            b = after[name]["phases"].get(key, 0) if key != "total" else after[name]["total"]
+            change = f"{(b - a) / a * 100:+.1f}%" if a else ""
+            print(f"  {key:10} {a * 1000:9.1f} ms -> {b * 1000:9.1f} ms  {change}")
+        a = before[name]["peak_memory_bytes"]
+        b = after[name]["peak_memory_bytes"]
+        print(f"  {'memory':10} {a / 1e6:9.1f} MB -> {b / 1e6:9.1f} MB  {(b - a) / a * 100:+.1f}%")
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="python3 " + args[0])
+    parser.add_argument("--size", choices=list(SIZES), action="append",
+        help="run one of the preset sizes (may be repeated; default: all of them)")
+    parser.add_argument("--rooms", type=int, help="run a custom size with this many rooms")
+    parser.add_argument("--tiles", type=int, default=300)
+    parser.add_argument("--scripts", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=4, help="how deeply blocks are nested")
+    parser.add_argument("--song-ticks", type=int, default=256)
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--repeat", type=int, default=3, help="builds per size; the fastest is reported (default: 3)")
+    parser.add_argument("--jobs", "-j", type=int, default=1)
+    parser.add_argument("--output", "-o", metavar="FILE", help="write the results to FILE as JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two results files")
+    parser.add_argument("--variables", action="store_true",
+        help="instead, time reading and writing variables in each of the ways main.lua stores them (needs lupa)")
+    opts = parser.parse_args(args[1:])
+
+    if opts.compare:
+        compare(*opts.compare)
+        return
+
+    if opts.variables:
+        access = variable_access(repeat=opts.repeat)
+        if access is None:
+            print("the variable access benchmark runs lua with lupa: python3 -m pip install lupa")
+            return
+        print("variable access (ns per read and write):")
+        for storage, ns in access.items():
+            print(f"  {storage:10} {ns:9.2f} ns")
+        if opts.output:
+            with open(opts.output, "w") as f:
+                json.dump({"revision": revision(), "python": platform.python_version(),
+                    "platform": platform.platform(), "variable_access_ns": access}, f, indent=2)
+            print(f"results written to {opts.output}")
+        return
+
+    if opts.rooms is not None:
+        configs = {"custom": dict(rooms=opts.rooms, tiles=opts.tiles, scripts=opts.scripts,
+            depth=opts.depth, song_ticks=opts.song_ticks, frames=opts.frames)}
+    else:
+        configs = {name: SIZES[name] for name in (opts.size or SIZES)}
+
+    results = []
+    for name, config in configs.items():
+        result = run(name, config, opts.repeat, opts.jobs)
+        report(result)
+        results.append(result)
+
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump({
+                "revision": revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "jobs": opts.jobs,
+                "results": results,
+            }, f, indent=2)
+        print(f"results written to {opts.output}")
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,127 @@
+# Persistent on-disk cache of transpiled events, so that rebuilding a large
+# project after a small edit only re-transpiles the events which changed.
+#
+# Each event is keyed by a hash of its block subtree, the comments it refers to,
+# and the global inputs which affect how it transpiles (tile ids and the names
+# of the other events in its script). The cache stores the generated lua along
+# with the side effects the event had on the PulpScriptContext (variables,
+# script tags, [PTL]/[PDXINFO] configuration...), which are replayed on a hit.
+
+import hashlib
+import json
+import os
+from pulpscript import transpile_event, CodeWriter
+
+# any change to the transpiler invalidates the whole cache.
+def source_digest():
+    h = hashlib.sha256()
+    for module in ["pulpscript.py", "eventcache.py"]:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), sort_keys=True)
+
+# returns the blocks reachable from blocks[blockidx] as a sorted list of (idx, block),
+# and the sorted indices of the comments they refer to.
+def event_subtree(blocks, blockidx):
+    visited = dict()
+    comments = set()
+    pending = [blockidx]
+
+    def visit(node):
+        if type(node) != list or len(node) == 0:
+            return
+        if len(node) >= 2 and type(node[1]) == int:
+            if node[0] == "block":
+                pending.append(node[1])
+            elif node[0] in ["#", "#$"]:
+                comments.add(node[1])
+        for child in node:
+            visit(child)
+
+    while len(pending) > 0:
+        idx = pending.pop()
+        if idx in visited or idx >= len(blocks):
+            continue
+        visited[idx] = blocks[idx]
+        visit(blocks[idx])
+
+    return sorted(visited.items()), sorted(list(comments))
+
+class EventCache:
+    def __init__(self, path, maxsize, tile_ids):
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.globaldigest = hashlib.sha256(dumps([source_digest(), tile_ids]).encode()).hexdigest()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def key(self, evobj, evname, blocks, blockidx, evobjname, comments_block, evnames):
+        subtree, commentidxs = event_subtree(blocks, blockidx)
+        comments = [[i, comments_block[i] if i < len(comments_block) else None] for i in commentidxs]
+        return hashlib.sha256(dumps([
+            self.globaldigest, evobj, evname, evobjname, blockidx,
+            sorted(list(evnames)), subtree, comments
+        ]).encode()).hexdigest()
+
+    def entrypath(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def load(self, key):
+        path = self.entrypath(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # mark as recently used (see prune)
+        os.utime(path)
+        return entry
+
+    def store(self, key, entry):
+        path = self.entrypath(key)
+        tmppath = path + ".tmp"
+        with open(tmppath, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmppath, path)
+
+    # drop the least-recently-used entries until the cache fits in maxsize bytes.
+    def prune(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(self.path, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+                total += stat.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.maxsize:
+                break
+            os.remove(os.path.join(self.path, name))
+            total -= size
+
+    # drop-in replacement for pulpscript.transpile_event.
+    def transpile_event(self, evobj, evname, ctx, blockidx, evobjname, comments_block, evnames, out):
+        key = self.key(evobj, evname, ctx.blocks, blockidx, evobjname, comments_block, evnames)
+        entry = self.load(key)
+        if entry is not None:
+            self.hits += 1
+            out.write(entry["lua"])
+            ctx.apply_effects(entry["effects"])
+            return
+
+        self.misses += 1
+        evout = CodeWriter()
+        saved = ctx.begin_effects()
+        try:
+            transpile_event(evobj, evname, ctx, blockidx, evobjname, comments_block, evnames, evout)
+        finally:
+            effects = ctx.end_effects(saved)
+        lua = evout.getvalue()
+        out.write(lua)
+        self.store(key, {"lua": lua, "effects": effects})
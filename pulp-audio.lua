@@ -84,9 +84,9 @@ local function newVoice(type, a,d,s,r,v)
 	setEnvelope(voice, type, a,d,s,r,v)
 	return voice
 end
-local function playNote(voice, pitch, dur, when)
+local function playNote(voice, note, dur, when)
 	voice.alt = not voice.alt
-	voice.synths[voice.alt and 2 or 1]:playNote(pitch, voice.envelope.volume, dur, when)
+	voice.synths[voice.alt and 2 or 1]:playMIDINote(note, voice.envelope.volume, dur, when)
 end
 local function stopNote(voice)
 	voice.synths[1]:stop()
@@ -105,117 +105,6 @@ local defaultEnvelope = {
 for i=1,5 do
 	voices[i] = newVoice(i-1, defaultEnvelope.attack,defaultEnvelope.decay,defaultEnvelope.sustain,defaultEnvelope.release,defaultEnvelope.volume)
 end
-local Frequency = list {
-	0, -- rest
-	16.351598,
-	17.323914,
-	18.354048,
-	19.445436,
-	20.601722,
-	21.826764,
-	23.124651,
-	24.499715,
-	25.956544,
-	27.5,
-	29.135235,
-	30.867706,
-	32.703196,
-	34.647829,
-	36.708096,
-	38.890873,
-	41.203445,
-	43.653529,
-	46.249303,
-	48.999429,
-	51.913087,
-	55,
-	58.27047,
-	61.735413,
-	65.406391,
-	69.295658,
-	73.416192,
-	77.781746,
-	82.406889,
-	87.307058,
-	92.498606,
-	97.998859,
-	103.826174,
-	110,
-	116.54094,
-	123.470825,
-	130.812783,
-	138.591315,
-	146.832384,
-	155.563492,
-	164.813778,
-	174.614116,
-	184.997211,
-	195.997718,
-	207.652349,
-	220,
-	233.081881,
-	246.941651,
-	261.625565,
-	277.182631,
-	293.664768,
-	311.126984,
-	329.627557,
-	349.228231,
-	369.994423,
-	391.995436,
-	415.304698,
-	440,
-	466.163762,
-	493.883301,
-	523.251131,
-	554.365262,
-	587.329536,
-	622.253967,
-	659.255114,
-	698.456463,
-	739.988845,
-	783.990872,
-	830.609395,
-	880,
-	932.327523,
-	987.766603,
-	1046.502261,
-	1108.730524,
-	1174.659072,
-	1244.507935,
-	1318.510228,
-	1396.912926,
-	1479.977691,
-	1567.981744,
-	1661.21879,
-	1760,
-	1864.655046,
-	1975.533205,
-	2093.004522,
-	2217.461048,
-	2349.318143,
-	2489.01587,
-	2637.020455,
-	2793.825851,
-	2959.955382,
-	3135.963488,
-	3322.437581,
-	3520,
-	3729.310092,
-	3951.06641,
-	4186.009045,
-	4434.922096,
-	4698.636287,
-	4978.03174,
-	5274.040911,
-	5587.651703,
-	5919.910763,
-	6271.926976,
-	6644.875161,
-	7040,
-	7458.620184,
-	7902.13282,
-}
 local streams = list {}
 for i=1,6 do
 	streams[i] = {
@@ -225,6 +114,8 @@ for i=1,6 do
 		bpm = 120,
 		tick = 0,
 		
+		cursors = {}, -- for each voice, the index of its next event
+		
 		-- song-only
 		callback = nil,
 		shiftTime = 0, -- affected by bpm changes
@@ -314,6 +205,7 @@ function playSound(value)
 	stream.stepTime = (60 / sound.bpm) * 0.25
 	stream.bpm = sound.bpm
 	stream.tick = 0
+	stream.cursors[1] = 1
 end
 function startSong(value, once, callback)
 	local song = getSong(value)
@@ -335,6 +227,7 @@ function startSong(value, once, callback)
 	
 	for i=1,#voices do
 		applyEnvelope(voices[i], i-1, song.voices and song.voices[i])
+		stream.cursors[i] = 1
 	end
 	
 	stream.shiftTime = 0
@@ -382,19 +275,17 @@ function stopSong()
 	end
 end
 
-local function scheduleNote(voice, notes, i, stepTime, when)
-	local note = notes[i + 1]
-	if note and note>0 then
-		note -= 1
-		local octave = notes[i + 2]
-		local hold = notes[i + 3]
-		
-		local freqIdx = 1 + (octave * 12) + note + 1
-		local pitch = Frequency[freqIdx]
-		local dur = hold * stepTime
-
-		playNote(voice, pitch, dur, when)
+-- events are {tick, midi note, hold, ...} for each note played, in order of tick,
+-- as precomputed by the transpiler. plays those at `tock` from events[cursor],
+-- and returns the index of the next.
+local function scheduleEvents(voice, events, cursor, tock, stepTime, when)
+	if events then
+		while events[cursor]==tock do
+			playNote(voice, events[cursor + 1], events[cursor + 2] * stepTime, when)
+			cursor += 3
+		end
 	end
+	return cursor
 end
 
 local function killCallbacks()
@@ -436,13 +327,13 @@ local function updateAudio()
 		
 		when += offsetTime
 		
-		local j = tock * 3
+		local cursors = stream.cursors
 		if isSong then
 			for k=1,#voices do
-				scheduleNote(voices[k], source.notes[k], j, stream.stepTime, when)
+				cursors[k] = scheduleEvents(voices[k], source.events[k], cursors[k], tock, stream.stepTime, when)
 			end
 		else
-			scheduleNote(source.voice, source.notes, j, stream.stepTime, when)
+			cursors[1] = scheduleEvents(source.voice, source.events, cursors[1], tock, stream.stepTime, when)
 		end
 		
 		stream.tick += 1
@@ -451,6 +342,9 @@ local function updateAudio()
 			if isSong then
 				if stream.loop then
 					stream.loopFrom = source.loopFrom
+					for k=1,#voices do
+						cursors[k] = source.loopCursors[k]
+					end
 				else
 					stream.id = -1
 					if stream.callback then
@@ -486,6 +380,18 @@ local function loadAudio()
 		else
 			songsByName[song.name] = song
 			song.splits = nil -- unneeded
+			
+			-- where each voice's events start again when the song loops
+			song.loopFrom = song.loopFrom or 0
+			song.loopCursors = {}
+			for k=1,#voices do
+				local events = song.events[k]
+				local cursor = 1
+				while events and events[cursor] and events[cursor]<song.loopFrom do
+					cursor += 3
+				end
+				song.loopCursors[k] = cursor
+			end
 		end
 	end
 end
@@ -160,7 +160,6 @@ local cropl = 0
 local cropr = TILESW-1
 local cropu = 0
 local cropd = TILESH-1
-local iscropped = false
 
 tilemap:setImageTable(tile_img)
 tilemap:setSize(TILESW, TILESH)
@@ -332,6 +331,52 @@ local function paginate(text, w, h)
     return pages
 end
 
+-- the pages of say and ask text, for the w and h given to paginate: those of literal
+-- text were paginated by the transpiler (pulp.prepaginated: w -> h -> text -> pages),
+-- and the PAGES_CACHE_SIZE most recently paginated other texts are kept in
+-- recent_pages, likewise. (recent_text/w/h is a ring of their keys, oldest next.)
+local PAGES_CACHE_SIZE <const> = 32
+local recent_pages = {} -- w -> h -> text -> pages
+local recent_text = {}
+local recent_w = {}
+local recent_h = {}
+local recent_next = 1
+
+local function getPages(text, w, h)
+    local byw = pulp.prepaginated and pulp.prepaginated[w]
+    local pages = byw and byw[h] and byw[h][text]
+    if pages then
+        return pages
+    end
+    byw = recent_pages[w]
+    if not byw then
+        byw = {}
+        recent_pages[w] = byw
+    end
+    local byh = byw[h]
+    if not byh then
+        byh = {}
+        byw[h] = byh
+    end
+    pages = byh[text]
+    if pages then
+        return pages
+    end
+    pages = paginate(text, w, h)
+    
+    -- forget the oldest
+    local i = recent_next
+    recent_next = i % PAGES_CACHE_SIZE + 1
+    if recent_text[i] then
+        recent_pages[recent_w[i]][recent_h[i]][recent_text[i]] = nil
+    end
+    recent_text[i] = text
+    recent_w[i] = w
+    recent_h[i] = h
+    byh[text] = pages
+    return pages
+end
+
 -- https://stackoverflow.com/q/49979017
 local function getStackDepth()
     local depth = 0
@@ -366,32 +411,198 @@ local event_persist = {
     orientation = "standing up"
 }
 
+function event_persist:reset(event)
+    for k in pairs(event) do
+        event[k] = nil
+    end
+    event.aa = self.aa
+    event.ra = self.ra
+    event.ax = self.ax
+    event.ay = self.ay
+    event.az = self.az
+    event.dx = self.dx
+    event.dy = self.dy
+    event.tx = self.tx
+    event.ty = self.ty
+    event.px = pulp.player.x
+    event.py = pulp.player.y
+    event.game = pulp.game
+    event.room = self.room
+    event.orientation = self.orientation
+    event.frame = pulp.frame
+    return event
+end
+
 function event_persist:new()
-    return {
-        aa = self.aa,
-        ra = self.ra,
-        ax = self.ax,
-        ay = self.ay,
-        az = self.az,
-        dx = self.dx,
-        dy = self.dy,
-        tx = self.tx,
-        ty = self.ty,
-        px = pulp.player.x,
-        py = pulp.player.y,
-        game = pulp.game,
-        room = self.room,
-        orientation = self.orientation,
-        frame = pulp.frame
-    }
+    return self:reset({})
+end
+
+-- the events passed to the handlers which run every frame (loop, draw, crank...)
+-- are reused by the next event of the same name, unless something held on to one
+-- for later (see keep_event), in which case it's replaced by a new one.
+local reused_events = {} -- evname -> event
+local kept_events = setmetatable({}, {__mode = "k"})
+
+local function keep_event(event)
+    if event then
+        kept_events[event] = true
+    end
 end
 
-function pulp:newScript(name)
+function event_persist:reuse(evname)
+    local event = reused_events[evname]
+    if not event or kept_events[event] then
+        event = {}
+        reused_events[evname] = event
+    end
+    return self:reset(event)
+end
+
+-- the events each script defines, as given by the transpiler: script -> {evname = true}.
+-- scripts which aren't listed (e.g. those with [LUA] comments) might handle any event.
+local script_events = {}
+
+local function handles_event(script, evname)
+    local events = script_events[script]
+    if events then
+        return events[evname] or events.any
+    end
+    return script ~= EMPTY
+end
+
+function pulp:newScript(name, evnames)
     local script = {}
     pulp.scripts[name] = script
+    if evnames then
+        local events = {}
+        for _, evname in ipairs(evnames) do
+            events[evname] = true
+        end
+        script_events[script] = events
+    end
     return script
 end
 
+-- with --split, some scripts are kept in modules of their own, which are only
+-- loaded when one of their events is first looked up.
+local lazy_scripts = {} -- script -> {path = module, events = {evname = true}}
+local lazy_script_mt = {
+    __index = function(script, evname)
+        local lazy = lazy_scripts[script]
+        if lazy and lazy.events[evname] then
+            pulp:loadScript(script)
+            return rawget(script, evname)
+        end
+    end
+}
+
+function pulp:newLazyScript(name, path, evnames)
+    local script = pulp:newScript(name, evnames)
+    lazy_scripts[script] = {path = path, events = script_events[script]}
+    return setmetatable(script, lazy_script_mt)
+end
+
+function pulp:loadScript(script)
+    local lazy = lazy_scripts[script]
+    if lazy then
+        lazy_scripts[script] = nil
+        setmetatable(script, nil)
+        playdate.file.run(lazy.path)
+        script.any = rawget(script, "any") or EMPTY.any
+    end
+end
+
+-- each room's starting tiles are a string packed by the transpiler (room.tiledata):
+-- one string.unpack value of room.tileformat per tile, or with room.tilerle, a byte
+-- counting how many tiles in a row have the id which follows it. room.tiles is only
+-- unpacked from it when the room is entered, and dropped again on restart.
+local string_unpack <const> = string.unpack
+
+local function unpack_tiles(room)
+    local tiles = {}
+    local data = room.tiledata
+    local format = room.tileformat
+    local n = 0
+    local pos = 1
+    local count = 1
+    local tid
+    while pos <= #data do
+        if room.tilerle then
+            count, pos = string_unpack("B", data, pos)
+        end
+        tid, pos = string_unpack(format, data, pos)
+        for _ = 1, count do
+            n += 1
+            tiles[n] = tid
+        end
+    end
+    return tiles
+end
+
+local unpacked_rooms = {} -- rooms with tiles, since the last restart
+
+-- with --split, the tiles and exits of rooms are kept in modules too, which are
+-- dropped again once more than pulp.roomcache rooms are loaded (if it's set), least
+-- recently entered first; but only for rooms whose tiles haven't changed, since
+-- those must be kept.
+local loaded_rooms = {} -- (least recently entered first)
+
+local function room_unchanged(room)
+    if not room.tiles then
+        return true
+    end
+    for i, tid in ipairs(unpack_tiles(room)) do
+        if room.tiles[i] ~= tid then
+            return false
+        end
+    end
+    return true
+end
+
+function pulp:loadRoom(room)
+    if room.module then
+        if not room.tiledata then
+            local data = playdate.file.run(room.module)
+            room.tiledata = data.tiledata
+            room.tileformat = data.tileformat
+            room.tilerle = data.tilerle
+            room.exits = data.exits
+        end
+        for i, loaded in ipairs(loaded_rooms) do
+            if loaded == room then
+                table.remove(loaded_rooms, i)
+                break
+            end
+        end
+        loaded_rooms[#loaded_rooms + 1] = room
+        local i = 1
+        while pulp.roomcache and pulp.roomcache > 0 and #loaded_rooms > pulp.roomcache and i < #loaded_rooms do
+            local evict = loaded_rooms[i]
+            if room_unchanged(evict) then
+                evict.tiles = nil
+                evict.tiledata = nil
+                evict.exits = nil
+                unpacked_rooms[evict] = nil
+                table.remove(loaded_rooms, i)
+            else
+                i += 1
+            end
+        end
+    end
+    if not room.tiles then
+        room.tiles = unpack_tiles(room)
+        unpacked_rooms[room] = true
+    end
+end
+
+-- (the packed tiles are never modified, so this just forgets the unpacked ones)
+function pulp:resetRooms()
+    for room in pairs(unpacked_rooms) do
+        room.tiles = nil
+    end
+    unpacked_rooms = {}
+end
+
 function pulp:associateScript(name, t, id)
     local script = type(name) == "string" and pulp.scripts[name] or name
     assert(script, "no script found with name '" .. tostring(name) .. "'")
@@ -484,7 +695,7 @@ function playdate.cranked(change, acceleratedChange)
     event_persist.aa = playdate.getCrankPosition()
     event_persist.ra = change
     if script then
-        (script.crank or script.any)(pulp.player, event_persist:new(), "crank")
+        (script.crank or script.any)(pulp.player, event_persist:reuse("crank"), "crank")
     end
 end
 
@@ -699,6 +910,38 @@ local function updateMessage(up, down, left, right, confirm, cancel)
     end
 end
 
+local draw_label -- (see pulp.__fn_label)
+
+-- a message's text box and options box are each drawn into an image (box.img) which
+-- is only redrawn when what's in them changes: the page or how much of it is shown,
+-- or the options and which is selected. the prompt to advance is drawn over them.
+-- there's one image for each size of box, so that later messages reuse it; if two
+-- boxes of the same size are shown at once, each redraws it when it's its turn.
+local box_imgs = {} -- w -> h -> {img, box (which it was last drawn for)}
+
+local function beginBox(box, w, h)
+    local byw = box_imgs[w]
+    if not byw then
+        byw = {}
+        box_imgs[w] = byw
+    end
+    local shared = byw[h]
+    if shared then
+        if shared.box ~= box and shared.box.img == shared.img then
+            shared.box.img = nil
+        end
+        shared.img:clear(playdate.graphics.kColorClear)
+    else
+        shared = {img = playdate.graphics.image.new(max(w, 1) * GRIDX, max(h, 1) * GRIDY)}
+        byw[h] = shared
+    end
+    shared.box = box
+    box.img = shared.img
+    box.w = w
+    box.h = h
+    playdate.graphics.pushContext(box.img)
+end
+
 local function drawMessage(message, submenu)
     if not message or message.dismiss then
         return
@@ -709,9 +952,22 @@ local function drawMessage(message, submenu)
         end
         
         if message.text and message.page and message.text[message.page] then
-            pulp.__fn_window(message.x-1, message.y-1, message.w+2, message.h+2)
-            local text = substr(message.text[message.page], 1, floor(message.textidx))
-            pulp.__fn_label(message.x, message.y, nil, nil, text)
+            local text = message.text[message.page]
+            local shown = min(floor(message.textidx), #text)
+            local box = message.textbox
+            if not box then
+                box = {}
+                message.textbox = box
+            end
+            if box.page ~= message.page or box.shown ~= shown or not box.img then
+                box.page = message.page
+                box.shown = shown
+                beginBox(box, message.w + 2, message.h + 2)
+                pulp.__fn_window(0, 0, message.w + 2, message.h + 2)
+                draw_label(1, 1, shown, nil, text)
+                playdate.graphics.popContext()
+            end
+            box.img:draw((message.x - 1) * GRIDX, (message.y - 1) * GRIDY)
             
             -- prompt to advance
             if message.prompt_timer >= 0 and not message.showoptions then
@@ -730,32 +986,50 @@ local function drawMessage(message, submenu)
         local opth = message.opth or #message.options
         local optx = message.optx or message.x + message.w - 1 - optw
         local opty = message.opty or message.y + message.h
+        local cursor = submenu and 13 or 12
         
-        pulp.__fn_window(optx - 2, opty - 1, optw + 3, opth + 2)
-        
-        local y = 0
-        for i = message.firstopt,#message.options do
-            if y >= opth then
-                break
+        local box = message.optbox
+        if not box then
+            box = {}
+            message.optbox = box
+        end
+        if box.firstopt ~= message.firstopt or box.optselect ~= message.optselect or box.cursor ~= cursor
+                or box.count ~= #message.options or box.w ~= optw + 3 or box.h ~= opth + 2 or not box.img then
+            box.firstopt = message.firstopt
+            box.optselect = message.optselect
+            box.cursor = cursor
+            box.count = #message.options
+            beginBox(box, optw + 3, opth + 2)
+            
+            -- (drawn relative to the box, at optx - 2, opty - 1)
+            pulp.__fn_window(0, 0, optw + 3, opth + 2)
+            
+            local y = 0
+            for i = message.firstopt,#message.options do
+                if y >= opth then
+                    break
+                end
+                local option = message.options[i]
+                local text = option.text
+                if not pulp.halfwidth and #text > optw then
+                    text = substr(text, 1, optw)
+                elseif pulp.halfwidth and #text > optw * 2 then
+                    text = substr(text, 1, optw * 2)
+                end
+                draw_label(2, 1 + y, #text, nil, text)
+                y += 1
             end
-            local option = message.options[i]
-            local text = option.text
-            if not pulp.halfwidth and #text > optw then
-                text = substr(text, 1, optw)
-            elseif pulp.halfwidth and #text > optw * 2 then
-                text = substr(text, 1, optw * 2)
+            
+            -- cursor
+            pulp.pipe_img[cursor]:draw(GRIDX, (1 + message.optselect - message.firstopt) * GRIDY)
+            
+            if #message.options > opth then
+                -- page icon
+                pulp.pipe_img[14]:draw(GRIDX * (optw + 1), GRIDY * (opth + 1))
             end
-            pulp.__fn_label(optx, opty + y, nil, nil, text)
-            y += 1
-        end
-        
-        -- cursor
-        pulp.pipe_img[submenu and 13 or 12]:draw((optx - 1) * GRIDX, (opty + message.optselect - message.firstopt) * GRIDY)
-        
-        if #message.options > opth then
-            -- page icon
-            pulp.pipe_img[14]:draw(GRIDX * (optx + optw - 1), GRIDY * (opty + opth))
+            playdate.graphics.popContext()
         end
+        box.img:draw((optx - 2) * GRIDX, (opty - 1) * GRIDY)
     end
 end
 
@@ -879,10 +1153,10 @@ local function readInput()
         local playerScript = pulp:getPlayerScript()
         if pulp.listen and (pulp.PTLE_SMOOTH_MOVEMENT_SPEED <= 0 or (pulp.player.smooth_x == pulp.player.x and pulp.player.smooth_y == pulp.player.y)) then
             if a_pressed and playerScript then
-                (playerScript.confirm or playerScript.any)(pulp.player, event_persist:new(), "confirm")
+                (playerScript.confirm or playerScript.any)(pulp.player, event_persist:reuse("confirm"), "confirm")
             end
             if b_pressed and playerScript then
-                (playerScript.cancel or playerScript.any)(pulp.player, event_persist:new(), "cancel")
+                (playerScript.cancel or playerScript.any)(pulp.player, event_persist:reuse("cancel"), "cancel")
             end
                 
             local do_exit = false
@@ -939,7 +1213,7 @@ local function readInput()
                                 end
                             else
                                 if playerScript then
-                                    (playerScript.bump or playerScript.any)(player, event_persist:new(), "bump")
+                                    (playerScript.bump or playerScript.any)(player, event_persist:reuse("bump"), "bump")
                                 end
                             end
                             
@@ -961,7 +1235,7 @@ local function readInput()
                         end
                     end
                     if playerScript then
-                        (playerScript.update or playerScript.any)(player, event_persist:new(), "update")
+                        (playerScript.update or playerScript.any)(player, event_persist:reuse("update"), "update")
                     end
                 end
             end
@@ -994,6 +1268,267 @@ local function smoothMovementBegin()
     end
 end
 
+-- pending waits, as a min-heap ordered by the (timer) frame they're due, then by
+-- the order they were started. the timer frame only advances while there's no
+-- message, so waits are paused during messages.
+local timer_frame = 0
+local timer_seq = 0
+local timers <const> = pulp.timers
+local timer_pool = {} -- (finished timers, for reuse)
+local timers_activate <const> = {} -- (cleared every frame)
+local COUNTDOWN_FRAMES <const> = 256 -- (see push_timer)
+
+local function timer_before(a, b)
+    return a.due < b.due or (a.due == b.due and a.seq < b.seq)
+end
+
+local function new_timer(block, event, evname, actor)
+    local n = #timer_pool
+    local timer = timer_pool[n]
+    if timer then
+        timer_pool[n] = nil
+    else
+        timer = {}
+    end
+    timer.block = block
+    timer.event = event
+    timer.evname = evname
+    timer.actor = actor
+    return timer
+end
+
+local function push_timer(timer, duration)
+    -- a wait of d seconds is over once d has been counted down to 0 by SPF each frame.
+    -- short waits are counted down here, in the same float steps, so that e.g. a wait
+    -- of 0.25 still takes 6 frames rather than 5; longer ones (where a frame's drift
+    -- can't be seen) take ceil(d * FPS) frames. (inf and nan never count down.)
+    local frames = math.huge
+    if duration * FPS < COUNTDOWN_FRAMES then
+        frames = 0
+        repeat
+            duration -= SPF
+            frames += 1
+        until duration <= 0
+    elseif duration < frames then
+        frames = ceil(duration * FPS)
+    end
+    timer.due = timer_frame + frames
+    timer_seq += 1
+    timer.seq = timer_seq
+    local i = #timers + 1
+    while i > 1 do
+        local parent = i // 2
+        if not timer_before(timer, timers[parent]) then
+            break
+        end
+        timers[i] = timers[parent]
+        i = parent
+    end
+    timers[i] = timer
+end
+
+local function pop_timer()
+    local top = timers[1]
+    local n = #timers
+    local last = timers[n]
+    timers[n] = nil
+    n -= 1
+    if n > 0 then
+        local i = 1
+        while true do
+            local child = 2 * i
+            if child > n then
+                break
+            end
+            if child < n and timer_before(timers[child + 1], timers[child]) then
+                child += 1
+            end
+            if not timer_before(timers[child], last) then
+                break
+            end
+            timers[i] = timers[child]
+            i = child
+        end
+        timers[i] = last
+    end
+    return top
+end
+
+-- the tiles of the current room which must be updated every frame, in the order
+-- they started: those playing, and those which animate (i.e. aren't tile.static).
+-- tiles which change otherwise (__fn_swap, __fn_frame) are marked dirty, and
+-- updated once. if redraw_tiles is set, every tile is updated instead.
+local active_tiles = {}
+local is_active = {} -- tilei -> true, for those in active_tiles
+local dirty_tiles = {}
+local next_dirty_tiles = {} -- (swapped with dirty_tiles each frame)
+local redraw_tiles = true
+
+-- the tilemap always holds the room as-is, and is drawn moved by the scroll. view*
+-- is the part of the room which is on screen (after crop and scroll); the rest of the
+-- screen shows the overflow tile, in border_rects. these are recomputed only when the
+-- crop or scroll changes.
+local viewl, viewr, viewu, viewd = 0, TILESW - 1, 0, TILESH - 1
+local view_scrollx = 0
+local view_scrolly = 0
+local view_changed = true
+local border_rects = {} -- {x, y, w, h, x, y, w, h...} in tiles, on screen
+local border_rectc = 0 -- (number of entries in border_rects)
+
+local function add_border_rect(n, x, y, w, h)
+    border_rects[n + 1] = x
+    border_rects[n + 2] = y
+    border_rects[n + 3] = w
+    border_rects[n + 4] = h
+    return n + 4
+end
+
+local function update_view(scrollx, scrolly)
+    if not view_changed and scrollx == view_scrollx and scrolly == view_scrolly then
+        return
+    end
+    view_changed = false
+    view_scrollx = scrollx
+    view_scrolly = scrolly
+    
+    -- on screen
+    local l = max(cropl, scrollx)
+    local r = min(cropr, TILESW - 1 + scrollx)
+    local u = max(cropu, scrolly)
+    local d = min(cropd, TILESH - 1 + scrolly)
+    viewl, viewr, viewu, viewd = l - scrollx, r - scrollx, u - scrolly, d - scrolly
+    
+    local n = 0
+    if l > r or u > d then
+        n = add_border_rect(n, 0, 0, TILESW, TILESH)
+    else
+        if u > 0 then
+            n = add_border_rect(n, 0, 0, TILESW, u)
+        end
+        if d < TILESH - 1 then
+            n = add_border_rect(n, 0, d + 1, TILESW, TILESH - 1 - d)
+        end
+        if l > 0 then
+            n = add_border_rect(n, 0, u, l, d - u + 1)
+        end
+        if r < TILESW - 1 then
+            n = add_border_rect(n, r + 1, u, TILESW - 1 - r, d - u + 1)
+        end
+    end
+    border_rectc = n
+    
+    -- (tiles which weren't on screen haven't been kept up to date)
+    redraw_tiles = true
+end
+
+local function is_animating(tilei)
+    if tilei.play then
+        return floor(tilei.frame) < #tilei.tile.frames or tilei.play_block ~= nil
+    end
+    return tilei.fps > 0 and not tilei.tile.static
+end
+
+local function mark_tile(tilei)
+    if not redraw_tiles and not tilei.dirty and roomtiles[tilei.y] and roomtiles[tilei.y][tilei.x] == tilei then
+        tilei.dirty = true
+        dirty_tiles[#dirty_tiles + 1] = tilei
+    end
+end
+
+-- advances the animation of a tile, and sets its frame in the tilemap if it changed.
+local function update_tile(tilei)
+    local frames = tilei.tile.frames
+    local framei
+    if tilei.play then
+        framei = floor(tilei.frame)
+        if framei < #frames then
+            tilei.frame += SPF * tilei.fps
+        elseif tilei.play_block then
+            timers_activate[#timers_activate+1] = new_timer(
+                tilei.play_block, tilei.play_event, tilei.play_evname, tilei.play_actor
+            )
+            tilei.play_block = nil
+            framei = #frames - 1
+        end
+    elseif tilei.fps > 0 then
+        framei = pulp_tile_fps_lookup_floor[tilei.fps_lookup_idx]
+        tilei.frame = framei
+    else
+        framei = tilei.frame
+    end
+    
+    -- checks if changed
+    local frame = frames[framei + 1] or frames[1] or 1
+    if tilei.prev_frame ~= frame then
+        tilei.prev_frame = frame
+        tilemap:setTileAtPosition(tilei.x+1, tilei.y+1, frame)
+    end
+end
+
+local function update_tiles()
+    if redraw_tiles then
+        redraw_tiles = false
+        for i = 1,#dirty_tiles do
+            dirty_tiles[i].dirty = false
+            dirty_tiles[i] = nil
+        end
+        for i = 1,#active_tiles do
+            is_active[active_tiles[i]] = nil
+            active_tiles[i] = nil
+        end
+        for x = viewl,viewr do
+            for y = viewu,viewd do
+                local tilei = roomtiles[y][x]
+                tilei.dirty = false
+                update_tile(tilei)
+                if is_animating(tilei) then
+                    active_tiles[#active_tiles + 1] = tilei
+                    is_active[tilei] = true
+                end
+            end
+        end
+        return
+    end
+    
+    -- (tiles which stop animating are updated once more the next frame, since
+    -- e.g. a finished play shows its first frame again)
+    local dirty = dirty_tiles
+    dirty_tiles = next_dirty_tiles
+    next_dirty_tiles = dirty
+    for i = 1,#dirty do
+        local tilei = dirty[i]
+        dirty[i] = nil
+        tilei.dirty = false
+        if is_active[tilei] then
+            -- (updated below)
+        elseif is_animating(tilei) then
+            active_tiles[#active_tiles + 1] = tilei
+            is_active[tilei] = true
+        elseif tilei.x >= viewl and tilei.x <= viewr and tilei.y >= viewu and tilei.y <= viewd then
+            update_tile(tilei)
+        end
+    end
+    
+    local n = 0
+    for i = 1,#active_tiles do
+        local tilei = active_tiles[i]
+        active_tiles[i] = nil
+        if tilei.x < viewl or tilei.x > viewr or tilei.y < viewu or tilei.y > viewd then
+            n += 1
+            active_tiles[n] = tilei
+        else
+            update_tile(tilei)
+            if is_animating(tilei) then
+                n += 1
+                active_tiles[n] = tilei
+            else
+                is_active[tilei] = nil
+                mark_tile(tilei)
+            end
+        end
+    end
+end
+
 local function smoothMovementEnd()
     local player = pulp.player
     player.x = pulp.smooth_true_x
@@ -1002,6 +1537,8 @@ local function smoothMovementEnd()
     pulp.PTLE_SMOOTH_OFFSET_Y = 0
 end
 
+local prewarmSound -- (see pulp:getSequence)
+
 function playdate.update()
     if not pulp.game_is_loaded then
         return
@@ -1032,20 +1569,24 @@ function playdate.update()
         pulp:enterRoom(pulp.roomQueued)
     end
     
+    -- (with showAllocations, the garbage collector is paused during the frame, so
+    -- that the memory in use afterward counts everything the frame allocated)
+    local alloc_start
+    if pulp.PTLE_SHOW_ALLOC then
+        collectgarbage("stop")
+        alloc_start = collectgarbage("count")
+    end
+    
     readAccelerometer()
     readInput() -- (and do player physics)
         
-    local timers_activate = {}
     if not pulp.message then
-        for i, timer in pairs(pulp.timers) do
-            timer.duration -= SPF
-            if timer.duration <= 0 then
-                pulp.timers[i] = nil
-                timers_activate[#timers_activate+1] = timer
-            end
+        timer_frame += 1
+        while timers[1] and timers[1].due <= timer_frame do
+            timers_activate[#timers_activate+1] = pop_timer()
         end
         
-        (pulp.gameScript.loop or pulp.gameScript.any)(pulp.game, event_persist:new(), "loop")
+        (pulp.gameScript.loop or pulp.gameScript.any)(pulp.game, event_persist:reuse("loop"), "loop")
     end
         
     playdate.display.setInverted(pulp.invert)
@@ -1069,7 +1610,6 @@ function playdate.update()
     -- smooth_scroll* and scroll* differ only when smooth movement is enabled
     local smooth_scrollx = 0
     local smooth_scrolly = 0
-    local scroll = false
     
     if config.follow ~= 0 then
         scrollx = config.followCenterX - pulp.player.x - math.floor(pulp.PTLE_SMOOTH_OFFSET_X)
@@ -1078,129 +1618,52 @@ function playdate.update()
         smooth_scrolly = config.followCenterY - pulp.player.y - pulp.PTLE_SMOOTH_OFFSET_Y
         pulp.PTLE_SMOOTH_OFFSET_FRACX = pulp.PTLE_SMOOTH_OFFSET_X - math.floor(pulp.PTLE_SMOOTH_OFFSET_X)
         pulp.PTLE_SMOOTH_OFFSET_FRACY = pulp.PTLE_SMOOTH_OFFSET_Y - math.floor(pulp.PTLE_SMOOTH_OFFSET_Y)
-        if scrolly == 0 and scrollx == 0 then
-            scroll = false
-        else
-            scroll = true
-        end
     else
         pulp.PTLE_SMOOTH_OFFSET_FRACX = 0
         pulp.PTLE_SMOOTH_OFFSET_FRACY = 0
     end
     
-    local framei = nil
-    
-    -- update tile frames and draw tiles
-    -- WARNING: DUPLICATE CODE! Yes, yes, but it's efficient, and this loop is hot, oh boy.
-    if scroll then
-        for x = cropl,cropr do
-            for y = cropu,cropd do
-                if y - scrolly >= TILESH or y - scrolly < 0 or x - scrollx >= TILESW or x - scrollx < 0 then
-                    -- skip this one
-                else
-                    local tilei = roomtiles[y - scrolly][x - scrollx]
-                    local dsttilei = roomtiles[y][x]
-                    local frames = tilei.frames
-                    
-                    if tilei.play then -- [[CAN STATICALLY OPTIMIZE OUT]]
-                        framei = floor(tilei.frame)
-                        if framei < #frames then
-                            tilei.frame += SPF * tilei.fps
-                        elseif tilei.play_block then
-                            timers_activate[#timers_activate+1] = {
-                                block = tilei.play_block,
-                                self = tilei.play_self,
-                                event = tilei.play_event,
-                                evname = tilei.play_evname,
-                                actor = tilei.play_actor,
-                            }
-                            tilei.play_block = nil
-                            framei = #frames - 1
-                        end
-                    elseif tilei.fps > 0 then -- [[CAN STATICALLY OPTIMIZE OUT]]
-                        framei = pulp_tile_fps_lookup_floor[tilei.fps_lookup_idx]
-                        tilei.frame = framei
-                    else
-                        framei = tilei.frame
-                    end
-                        
-                    
-                    -- checks if changed
-                    local frame = frames[framei + 1] or frames[1] or 1
-                    if dsttilei.prev_frame ~= frame then
-                        dsttilei.prev_frame = frame
-                        tilemap:setTileAtPosition(x+1, y+1, frame)
-                    end
-                end
-            end
-        end
-    else
-        -- no scrolling
-        for x = cropl,cropr do
-            for y = cropu,cropd do
-                local tilei = roomtiles[y][x]
-                local frames = tilei.tile.frames
-                
-                if tilei.play then -- [[CAN STATICALLY OPTIMIZE OUT]]
-                    framei = floor(tilei.frame)
-                    if framei < #frames then
-                        tilei.frame += SPF * tilei.fps
-                    elseif tilei.play_block then
-                        timers_activate[#timers_activate+1] = {
-                            block = tilei.play_block,
-                            self = tilei.play_self,
-                            event = tilei.play_event,
-                            evname = tilei.play_evname,
-                            actor = tilei.play_actor,
-                        }
-                        tilei.play_block = nil
-                        framei = #frames - 1
-                    end
-                elseif tilei.fps > 0 then
-                    framei = pulp_tile_fps_lookup_floor[tilei.fps_lookup_idx]
-                    tilei.frame = framei
-                else
-                    framei = tilei.frame
-                end
-                
-                -- checks if changed
-                local frame = frames[framei + 1] or frames[1] or 1
-                if tilei.prev_frame ~= frame then
-                    tilei.prev_frame = frame
-                    tilemap:setTileAtPosition(x+1, y+1, frame)
-                end
-            end
-        end
-    end
-        
-    if iscropped or scroll then
-        -- draw cropping borders
-        -- FIXME: more efficient implementation of this.
-        local overflowtile = pulp:getTile(config.followOverflowTile) or {frames={1}}
-        local frame = overflowtile.frames[1] or 1
-        for x=0,TILESW-1 do
-            for y=0,TILESH-1 do
-                if x < cropl or x > cropr or y < cropu or y > cropd then
-                    tilemap:setTileAtPosition(x+1,y+1, frame)
-                    roomtiles[y][x].prev_frame = frame
-                elseif scroll and (x - scrollx < 0 or x - scrollx >= TILESW or y - scrolly < 0 or y - scrolly >= TILESH) then
-                    tilemap:setTileAtPosition(x+1,y+1, frame)
-                    roomtiles[y][x].prev_frame = frame
-                end
-            end
-        end
-    end
+    -- update tile frames
+    update_view(scrollx, scrolly)
+    update_tiles()
     
     -- execute elapsed timer events
     for i=1,#timers_activate do
         local timer = timers_activate[i]
+        timers_activate[i] = nil
         assert(timer.actor)
         assert(timer.actor.script)
         timer.block(timer.actor, timer.event, timer.evname)
+        timer.block = nil
+        timer.event = nil
+        timer.evname = nil
+        timer.actor = nil
+        timer_pool[#timer_pool + 1] = timer
     end
     
     -- draw all non-player tiles
-    tilemap:draw(-pulp.PTLE_SMOOTH_OFFSET_FRACX * GRIDX, -pulp.PTLE_SMOOTH_OFFSET_FRACY * GRIDY)
+    local borderx = -pulp.PTLE_SMOOTH_OFFSET_FRACX * GRIDX
+    local bordery = -pulp.PTLE_SMOOTH_OFFSET_FRACY * GRIDY
+    if border_rectc == 0 then
+        tilemap:draw(smooth_scrollx * GRIDX, smooth_scrolly * GRIDY)
+    else
+        if viewl <= viewr and viewu <= viewd then
+            playdate.graphics.setClipRect(
+                borderx + (viewl + scrollx) * GRIDX, bordery + (viewu + scrolly) * GRIDY,
+                (viewr - viewl + 1) * GRIDX, (viewd - viewu + 1) * GRIDY
+            )
+            tilemap:draw(smooth_scrollx * GRIDX, smooth_scrolly * GRIDY)
+            playdate.graphics.clearClipRect()
+        end
+        local overflowtile = pulp:getTile(config.followOverflowTile)
+        local img = tile_img[overflowtile and overflowtile.frames[1] or 1]
+        for i = 1,border_rectc,4 do
+            img:drawTiled(
+                borderx + border_rects[i] * GRIDX, bordery + border_rects[i + 1] * GRIDY,
+                border_rects[i + 2] * GRIDX, border_rects[i + 3] * GRIDY
+            )
+        end
+    end
     
     -- update player frame
     local player = pulp.player
@@ -1213,7 +1676,7 @@ function playdate.update()
     
     local playerScript = pulp:getPlayerScript()
     if playerScript then
-        (playerScript.draw or playerScript.any)(player, event_persist:new(), "draw")
+        (playerScript.draw or playerScript.any)(player, event_persist:reuse("draw"), "draw")
     end
     
     if not pulp.hideplayer and player.tile then
@@ -1245,9 +1708,117 @@ function playdate.update()
         playdate.drawFPS()
     end
     
+    prewarmSound()
+    
+    if alloc_start then
+        pulp.frame_alloc = floor((collectgarbage("count") - alloc_start) * 1024)
+        collectgarbage("restart")
+        if pulp.frame_alloc > 0 then
+            print("frame " .. pulp.frame .. " allocated " .. pulp.frame_alloc .. " bytes")
+        end
+    end
+    
     pulp.frame += 1
 end
 
+-- sound sequences are built the first time each sound is played, and only the
+-- pulp.soundcache most recently played are kept (if it's set). the sounds in
+-- pulp.prewarmsounds are built in the background when the game starts, one a frame.
+local cached_sounds = {} -- (least recently played first)
+local prewarm_sounds = {}
+
+local function build_sequence(sound)
+    local sequence = playdate.sound.sequence.new() 
+    
+    local steps_per_second = 4 * sound.bpm / 60
+    local final = __FIREFOX_SOUND_COMPAT and (1 + ceil((sound.attack + sound.decay) * steps_per_second)) or 1 
+    local max_polyphony = 3
+    for j=1,final do 
+        local any_notes = false
+        local track = playdate.sound.track.new()
+        
+        local scale_factor = 1
+        if __FIREFOX_SOUND_COMPAT and j < final then
+            local max_time = j / steps_per_second
+            local destime = (sound.attack + sound.decay)
+            scale_factor = min(max_time/destime, 1)
+        end
+        
+        local inst = playdate.sound.instrument.new()
+        for i = 1,max_polyphony do
+            local synth = playdate.sound.synth.new(wavetypes[sound.type])
+            synth:setAttack(sound.attack * scale_factor)
+            synth:setDecay(sound.decay * scale_factor)
+            -- it doesn't really make sense that sustain is scaled by scale_factor, but firefox does this.
+            synth:setSustain(sound.sustain * scale_factor)
+            synth:setRelease(sound.release)
+            
+            synth:setVolume(sound.volume * SOUNDSCALE[sound.type])
+            
+            inst:addVoice(synth)
+        end
+        track:setInstrument(inst)
+        local max_polyphony = min(3, 1 + ceil(sound.bpm * SPF * (sound.decay or 0.1)))
+        -- (sound.events are {step, midi note, length, ...}, from the transpiler)
+        local events = sound.events
+        for i=1,#events,3 do
+            local length = events[i + 2]
+            if length == j or (length >= j and j == final) then
+                track:addNote(events[i], events[i + 1], length)
+                any_notes = true
+            end
+        end
+    
+        if any_notes then
+            sequence:addTrack(track)
+        end
+    end
+
+    sequence:setTempo(steps_per_second)
+    return sequence
+end
+
+function pulp:getSequence(sound)
+    if not pulp.soundcache then
+        sound.sequence = sound.sequence or build_sequence(sound)
+        return sound.sequence
+    end
+    if sound.sequence then
+        for i, cached in ipairs(cached_sounds) do
+            if cached == sound then
+                table.remove(cached_sounds, i)
+                break
+            end
+        end
+    else
+        sound.sequence = build_sequence(sound)
+    end
+    cached_sounds[#cached_sounds + 1] = sound
+    local i = 1
+    while #cached_sounds > pulp.soundcache and i < #cached_sounds do
+        local evict = cached_sounds[i]
+        if evict.sequence:isPlaying() then
+            i += 1
+        else
+            evict.sequence = nil
+            table.remove(cached_sounds, i)
+        end
+    end
+    return sound.sequence
+end
+
+-- (called each frame)
+function prewarmSound()
+    local sid = prewarm_sounds[#prewarm_sounds]
+    if sid and (not pulp.soundcache or #cached_sounds < pulp.soundcache) then
+        prewarm_sounds[#prewarm_sounds] = nil
+        local sound = pulp:getSound(sid)
+        if sound and sound.events and not sound.sequence then
+            pulp:getSequence(sound)
+        end
+    end
+end
+
 function pulp:loadSounds()
     -- we outsource music to pulp-audio
     __pulp_audio.init(pulp.songs)
@@ -1266,59 +1837,14 @@ function pulp:loadSounds()
             sound.sustain = sound.sustain or 0.5
             sound.release = sound.release or 0.1
             sound.volume = sound.volume or 1
-            local sequence = playdate.sound.sequence.new() 
-            
-            local steps_per_second = 4 * sound.bpm / 60
-            local final = __FIREFOX_SOUND_COMPAT and (1 + ceil((sound.attack + sound.decay) * steps_per_second)) or 1 
-            local max_polyphony = 3
-            for j=1,final do 
-                local any_notes = false
-                local track = playdate.sound.track.new()
-                
-                local scale_factor = 1
-                if __FIREFOX_SOUND_COMPAT and j < final then
-                    local max_time = j / steps_per_second
-                    local destime = (sound.attack + sound.decay)
-                    scale_factor = min(max_time/destime, 1)
-                end
-                
-                local inst = playdate.sound.instrument.new()
-                for i = 1,max_polyphony do
-                    local synth = playdate.sound.synth.new(wavetypes[sound.type])
-                    synth:setAttack(sound.attack * scale_factor)
-                    synth:setDecay(sound.decay * scale_factor)
-                    -- it doesn't really make sense that sustain is scaled by scale_factor, but firefox does this.
-                    synth:setSustain(sound.sustain * scale_factor)
-                    synth:setRelease(sound.release)
-                    
-                    synth:setVolume(sound.volume * SOUNDSCALE[sound.type])
-                    
-                    inst:addVoice(synth)
-                end
-                track:setInstrument(inst)
-                local max_polyphony = min(3, 1 + ceil(sound.bpm * SPF * (sound.decay or 0.1)))
-                for i=1,#sound.notes,3 do
-                    local octave = sound.notes[i+1] + 1
-                    local pitch = sound.notes[i] + 12 * octave - 1
-                    local length = sound.notes[i + 2]
-                    local step = floor((i+2)/3)
-                    if length ~= 0 then
-                        if length == j or (length >= j and j == final) then
-                            track:addNote(step, pitch, length)
-                            any_notes = true
-                        end
-                    end
-                end
-            
-                if any_notes then
-                    sequence:addTrack(track)
-                end
-            end
-
-            sequence:setTempo(steps_per_second)
-            sound.sequence = sequence
         end
     end
+    
+    -- (in reverse, since they're taken from the end)
+    prewarm_sounds = {}
+    for i = #(pulp.prewarmsounds or EMPTY), 1, -1 do
+        prewarm_sounds[#prewarm_sounds + 1] = pulp.prewarmsounds[i]
+    end
 end
 
 function pulp:load()
@@ -1330,6 +1856,7 @@ function pulp:load()
     assert(pulp.player.script)
     pulp.tile_fps_lookup = {}
     pulp:loadSounds()
+    pulp:loadLabels()
     for _, tile in pairs(pulp.tiles) do
         pulp.tiles_by_name[tile.name] = tile
         if tile.fps > 0 then
@@ -1346,15 +1873,18 @@ function pulp:load()
     end
     for i, room in pairs(pulp.rooms) do
         room.type = ACTOR_TYPE_ROOM
-        room.tiles_init = copytable(room.tiles)
         pulp.rooms_by_name[room.name] = room
         room.__tostring = function(...)
             return "0"
         end
     end
     for _, script in pairs(pulp.scripts) do
-        -- ensure 'any' exists
-        script.any = script.any or EMPTY.any
+        -- ensure 'any' exists (a lazy script's own 'any' is left to pulp:loadScript,
+        -- so that looking it up doesn't load the script)
+        local lazy = lazy_scripts[script]
+        if not (lazy and lazy.events.any) then
+            script.any = script.any or EMPTY.any
+        end
     end
 end
 
@@ -1375,6 +1905,12 @@ function pulp:exitRoom()
     end
 end
 
+-- the tiles of the current room whose scripts handle each event, built the first
+-- time the event is emitted in the room, as {tilei, script, tilei, script...} in
+-- order of y, then x. these are kept up to date by __fn_swap; while an emit is going
+-- through a list, the list is copied before it changes instead (see retarget_tile).
+local emit_tiles = {} -- evname -> list
+
 function pulp:enterRoom(rid)
     disabled_exit_x = pulp.player.x
     disabled_exit_y = pulp.player.y
@@ -1392,8 +1928,11 @@ function pulp:enterRoom(rid)
     pulp.roomQueued = nil
     local room = pulp.rooms[room_idx]
     assert(room, "no room for index " .. tostring(room_idx))
+    pulp:loadRoom(room)
     event_persist.room = room
     __exits = room.exits
+    emit_tiles = {}
+    redraw_tiles = true
     
     -- set tiles
     for y = 0,TILESH-1 do
@@ -1482,9 +2021,7 @@ function pulp:start()
     pulp.listen = true
     
     -- reset rooms to have their starting tiles
-    for _, room in pairs(pulp.rooms) do
-        room.tiles = copytable(room.tiles_init)
-    end
+    pulp:resetRooms()
     
     if pulp.roomQueuedX and pulp.roomQueuedY then
         pulp.player.x = pulp.roomQueuedX
@@ -1495,51 +2032,85 @@ function pulp:start()
     pulp.frame = 0
 end
 
+local function emit_list(evname)
+    local list = emit_tiles[evname]
+    if not list then
+        list = {busy = 0}
+        for y = 0,TILESH-1 do
+            for x = 0,TILESW-1 do
+                local tilei = roomtiles[y][x]
+                local script = tilei.script
+                if script and handles_event(script, evname) then
+                    list[#list + 1] = tilei
+                    list[#list + 1] = script
+                end
+            end
+        end
+        emit_tiles[evname] = list
+    end
+    return list
+end
+
+-- (called when a tile of the current room changes from script `prev`)
+local function retarget_tile(tilei, prev)
+    local script = tilei.script
+    local pos = tilei.y * TILESW + tilei.x
+    for evname, list in pairs(emit_tiles) do
+        local was = prev and handles_event(prev, evname)
+        local is = script and handles_event(script, evname)
+        if was or is then
+            if list.busy > 0 then
+                list = table.move(list, 1, #list, 1, {busy = 0})
+                emit_tiles[evname] = list
+            end
+            -- (where the tile is or would be in the list)
+            local i = 1
+            while list[i] and list[i] ~= tilei and list[i].y * TILESW + list[i].x < pos do
+                i += 2
+            end
+            if was and is then
+                list[i + 1] = script
+            elseif was then
+                table.remove(list, i)
+                table.remove(list, i)
+            else
+                table.insert(list, i, script)
+                table.insert(list, i, tilei)
+            end
+        end
+    end
+end
+
 function pulp:emit(evname, event)
-    
-    local tasks = {}
-    
     assert(event ~= pulp.player)
     
-    tasks[#tasks+1] = function()
-        ;(pulp.gameScript[evname] or pulp.gameScript.any)(pulp.game, event, evname)
-    end
-    
+    -- (the handlers are those at the time of the emit, even if they change during it)
+    local gameScript = pulp.gameScript
     local roomScript = pulp:getCurrentRoom().script
+    local list = emit_list(evname)
+    local playerScript = pulp:getPlayerScript()
+    local player = pulp.player
+    list.busy += 1
+    
+    ;(gameScript[evname] or gameScript.any)(pulp.game, event, evname)
+    
     if roomScript then
         assert(roomScript.any);
-        tasks[#tasks+1] = function()
-            assert(roomScript.any);
-            (roomScript[evname] or roomScript.any)(pulp:getCurrentRoom(), event, evname)
-        end
+        (roomScript[evname] or roomScript.any)(pulp:getCurrentRoom(), event, evname)
     end
     
     -- tiles
-    for y = 0,TILESH-1 do
-        for x = 0,TILESW-1 do
-            local tileInstance = pulp:getTileAt(x, y)
-            local script = tileInstance.script
-            if script then
-                assert(script.any)
-                tasks[#tasks+1] = function()
-                    ;(script[evname] or script.any)(tileInstance, event, evname)
-                end
-            end
-        end
+    for i = 1,#list,2 do
+        local script = list[i + 1]
+        ;(script[evname] or script.any)(list[i], event, evname)
     end
     
     -- player
-    local playerScript = pulp:getPlayerScript()
-    local player = pulp.player
     if playerScript then
-        tasks[#tasks+1] = function()
-            ;(playerScript[evname] or playerScript.any)(player, event, evname)
-        end
+        (playerScript[evname] or playerScript.any)(player, event, evname)
     end
     
-    for i = 1,#tasks do
-        tasks[i]()
-    end
+    list.busy -= 1
 end
 
 function pulp:forTiles(tid, cb)
@@ -1585,6 +2156,9 @@ function pulp.__fn_stop()
 end
 
 function pulp.__fn_once(actor, event, evname, block, song)
+    if block then
+        keep_event(event)
+    end
     __pulp_audio.playSong(
         pulp:getSongName(song),
         true,
@@ -1607,14 +2181,18 @@ end
 
 function pulp.__fn_sound(sid)
     local sound = pulp:getSound(sid)
-    if sound and sound.sequence then
-        sound.sequence:stop()
-        sound.sequence:goToStep(1)
-        sound.sequence:play()
+    if sound and sound.name and sound.events then
+        local sequence = pulp:getSequence(sound)
+        sequence:stop()
+        sequence:goToStep(1)
+        sequence:play()
     end
 end
 
 function pulp.__fn_play(actor, event, evname, block, id)
+    if block then
+        keep_event(event)
+    end
     pulp.__fn_swap(actor, id)
     actor.play = true
     actor.frame = 0
@@ -1623,6 +2201,12 @@ function pulp.__fn_play(actor, event, evname, block, id)
     actor.play_block = block
     -- this is probably redundant but paranoia ok
     actor.play_actor = actor
+    mark_tile(actor)
+end
+
+function pulp.__fn_frame(actor, frame)
+    actor.frame = frame
+    mark_tile(actor)
 end
 
 local font_lookup_character <const> = {}
@@ -1630,25 +2214,21 @@ for i=1,#alphabet do
     font_lookup_character[string_byte(substr(alphabet, i, i))] = i
 end
 
-function pulp.__fn_label(x, y, len, lines, text)
-    assert(type(text) == "string")
+local NEWLINE <const> = string_byte("\n")
+
+-- (draw_label is declared above drawMessage, which also uses it)
+function draw_label(x, y, len, lines, text)
     local startx = x
     local endy = nil
     local xinc = pulp.halfwidth and (1 / 2) or 1
-    local srcrect = HALFWIDTH_SRCRECT
     if lines then
         endy = y + lines
     end
-    if len then
-        len = min(len, #text)
-    else
-        len = #text
-    end
     local i = 1
     while i <= len do
-        local chr = string_byte(substr(text, i, i))
+        local chr = string_byte(text, i)
         assert(chr)
-        if chr == string_byte("\n") then
+        if chr == NEWLINE then
             x = startx
             y += 1
             if endy and y > endy then
@@ -1667,7 +2247,7 @@ function pulp.__fn_label(x, y, len, lines, text)
             for k=numbytes,1,-1 do
                 i += 1
                 frame *= 0x80
-                local _chr = string_byte(substr(text, j+k, j+k))
+                local _chr = string_byte(text, j+k)
                 local b = 0
                 if _chr then
                     b = _chr % 0x80
@@ -1685,6 +2265,216 @@ function pulp.__fn_label(x, y, len, lines, text)
     end
 end
 
+-- the size in pixels of what draw_label draws
+local function measure_label(len, lines, text)
+    local xinc = pulp.halfwidth and (1 / 2) or 1
+    local x = 0
+    local w = 0
+    local y = 0
+    local i = 1
+    while i <= len do
+        local chr = string_byte(text, i)
+        if chr == NEWLINE then
+            if lines and y + 1 > lines then
+                break
+            end
+            x = 0
+            y += 1
+        else
+            if chr >= 0x80 then
+                i += chr % 0x80
+            end
+            x += xinc
+            w = max(w, x)
+        end
+        i += 1
+    end
+    return ceil(w * GRIDX), (y + 1) * GRIDY
+end
+
+-- labels are drawn into an image of their own the second frame they're drawn with
+-- the same text, len and lines, and drawn from it while they're among the
+-- LABEL_CACHE_SIZE most recently drawn. until then they're only remembered in a ring
+-- of the LABEL_SEEN_SIZE last drawn, so that text which changes every frame doesn't
+-- allocate anything. (pulp.halfwidth doesn't change, so it isn't part of the key.)
+local LABEL_CACHE_SIZE <const> = 64
+local LABEL_SEEN_SIZE <const> = 16
+local label_cache = {} -- text -> len -> lines (or false) -> entry {text, len, lines, img, newer, older}
+local label_count = 0
+local label_newest = nil -- (entries are linked from the most to the least recently drawn)
+local label_oldest = nil
+local label_tables = {} -- (emptied label_cache tables, for reuse)
+local label_seen_text = {}
+local label_seen_len = {}
+local label_seen_lines = {}
+local label_seen_frame = {}
+local label_seen_next = 1
+
+local function unlink_label(entry)
+    if entry.newer then
+        entry.newer.older = entry.older
+    else
+        label_newest = entry.older
+    end
+    if entry.older then
+        entry.older.newer = entry.newer
+    else
+        label_oldest = entry.newer
+    end
+end
+
+local function link_label(entry)
+    entry.newer = nil
+    entry.older = label_newest
+    if label_newest then
+        label_newest.newer = entry
+    else
+        label_oldest = entry
+    end
+    label_newest = entry
+end
+
+local function label_table()
+    local n = #label_tables
+    local t = label_tables[n]
+    if t then
+        label_tables[n] = nil
+        return t
+    end
+    return {}
+end
+
+local function cached_label(len, lines, text)
+    local bylen = label_cache[text]
+    local bylines = bylen and bylen[len]
+    local entry = bylines and bylines[lines or false]
+    if entry then
+        if entry ~= label_newest then
+            unlink_label(entry)
+            link_label(entry)
+        end
+        return entry.img
+    end
+    
+    -- not cached until it's drawn again on another frame
+    local frame = pulp.frame
+    local seen = nil
+    for i = 1,LABEL_SEEN_SIZE do
+        if label_seen_text[i] == text and label_seen_len[i] == len and label_seen_lines[i] == lines then
+            seen = i
+            break
+        end
+    end
+    if not seen then
+        seen = label_seen_next
+        label_seen_next = seen % LABEL_SEEN_SIZE + 1
+        label_seen_text[seen] = text
+        label_seen_len[seen] = len
+        label_seen_lines[seen] = lines
+        label_seen_frame[seen] = frame
+        return nil
+    elseif label_seen_frame[seen] == frame then
+        return nil
+    end
+    label_seen_text[seen] = nil
+    
+    -- the least recently drawn is evicted, and its entry (and image, if it's the
+    -- same size) reused
+    local img = nil
+    if label_count >= LABEL_CACHE_SIZE then
+        entry = label_oldest
+        unlink_label(entry)
+        local oldlen = label_cache[entry.text]
+        local oldlines = oldlen[entry.len]
+        oldlines[entry.lines or false] = nil
+        if next(oldlines) == nil then
+            oldlen[entry.len] = nil
+            label_tables[#label_tables + 1] = oldlines
+            if next(oldlen) == nil then
+                label_cache[entry.text] = nil
+                label_tables[#label_tables + 1] = oldlen
+            end
+        end
+        img = entry.img
+        bylen = label_cache[text]
+        bylines = bylen and bylen[len]
+    else
+        label_count += 1
+        entry = {}
+    end
+    
+    local w, h = measure_label(len, lines, text)
+    if w > 0 then
+        local imgw, imgh = nil, nil
+        if img then
+            imgw, imgh = img:getSize()
+        end
+        if imgw == w and imgh == h then
+            img:clear(playdate.graphics.kColorClear)
+        else
+            img = playdate.graphics.image.new(w, h)
+        end
+        playdate.graphics.pushContext(img)
+        draw_label(0, 0, len, lines, text)
+        playdate.graphics.popContext()
+    else
+        img = nil
+    end
+    entry.text = text
+    entry.len = len
+    entry.lines = lines
+    entry.img = img
+    link_label(entry)
+    if not bylen then
+        bylen = label_table()
+        label_cache[text] = bylen
+    end
+    if not bylines then
+        bylines = label_table()
+        bylen[len] = bylines
+    end
+    bylines[lines or false] = entry
+    return img
+end
+
+function pulp.__fn_label(x, y, len, lines, text)
+    assert(type(text) == "string")
+    if len then
+        len = min(len, #text)
+    else
+        len = #text
+    end
+    local img = cached_label(len, lines, text)
+    if img then
+        img:draw(x * GRIDX, y * GRIDY)
+    else
+        draw_label(x, y, len, lines, text)
+    end
+end
+
+-- labels whose text is known at build time are drawn by the transpiler into the
+-- labels image; pulp.prelabels has where each text is in it, as {y, w, h}.
+local label_img = nil
+local label_rects = {} -- text -> rect in label_img
+
+function pulp:loadLabels()
+    if pulp.prelabels then
+        label_img = playdate.graphics.image.new("labels")
+        for text, rect in pairs(pulp.prelabels) do
+            label_rects[text] = playdate.geometry.rect.new(0, rect[1], rect[2], rect[3])
+        end
+    end
+end
+
+function pulp.__fn_prelabel(x, y, text)
+    local rect = label_rects[text]
+    if rect then
+        label_img:draw(x * GRIDX, y * GRIDY, nil, rect)
+    else
+        pulp.__fn_label(x, y, nil, nil, text)
+    end
+end
+
 function pulp.__fn_draw(x, y, tid)
     local tile = pulp:getTile(tid)
     if tile and tile.frames then
@@ -1736,18 +2526,14 @@ function pulp.__fn_toss(name)
 end
 
 function pulp.__fn_wait(actor, event, evname, block, duration)
-    pulp.timers[#pulp.timers+1] = {
-        duration = duration,
-        block = block,
-        event = event,
-        evname = evname,
-        actor = actor,
-    }
+    keep_event(event)
+    push_timer(new_timer(block, event, evname, actor), duration)
 end
 
 function pulp.__fn_say(x,y,w,h, actor, event, evname, block,text)
     assert(not block or type(block) == "function", "say 'then' block is not a function")
     assert(type(text) == "string", "say text must be a string")
+    keep_event(event)
     x = min(x or 3, TILESW - 1) + 1
     y = min(y or 3, TILESH - 1) + 1
     if w == 0 then w = nil end
@@ -1772,7 +2558,7 @@ function pulp.__fn_say(x,y,w,h, actor, event, evname, block,text)
         textSpeed = config.textSpeed,
         textidx = 0,
         clear = pulp.frame == 0,
-        text = paginate(text or "", w * (pulp.halfwidth and 2 or 1), h),
+        text = getPages(text or "", w * (pulp.halfwidth and 2 or 1), h),
         options_width = 0, -- text width of largest option
         optselect = 1,
         firstopt = 1,
@@ -1794,6 +2580,7 @@ function pulp.__fn_menu(x,y,w,h, actor, event, evname, block)
     x = x or 2
     y = y or 3
     assert(type(block) == "function")
+    keep_event(event)
         
     print("menu")
     
@@ -1826,6 +2613,7 @@ function pulp.__fn_option(actor, event, evname, block, text)
     if not message then return end
     if message.dismiss or message.showoptions then return end
     assert(type(text) == "string")
+    keep_event(event)
     message.options = message.options or {}
     local optwidth = #text
     if pulp.halfwidth then
@@ -1927,11 +2715,7 @@ function pulp.__fn_crop(x, y, w, h)
     cropr = min(TILESW, cropl + (w or prevw)) - 1
     cropu = max(0, y or cropu)
     cropd = min(TILESH, cropu + (h or prevh)) - 1
-    
-    iscropped = false
-    if cropl ~= 0 or cropr ~= TILESW - 1 or cropu ~= 0 or cropd ~= TILESH - 1 then
-        iscropped = true
-    end
+    view_changed = true
 end
 
 function pulp.__fn_goto(x, y, room)
@@ -2003,7 +2787,11 @@ function pulp.__fn_swap(actor, newid)
             actor.tile = newtile
             actor.id = actor.tile.id
             if not actor.is_player then
+                local prev = actor.script
                 actor.script = actor.tile.script or EMPTY
+                if actor.script ~= prev and roomtiles[actor.y] and roomtiles[actor.y][actor.x] == actor then
+                    retarget_tile(actor, prev)
+                end
             end
             actor.play = false
             actor.frames = newtile.frames
@@ -2013,6 +2801,7 @@ function pulp.__fn_swap(actor, newid)
             actor.fps = actor.tile.fps
             actor.fps_lookup_idx = actor.tile.fps_lookup_idx
             actor.frame = 0
+            mark_tile(actor)
         else
             print("cannot swap to tile " .. newid)
             assert(false)
@@ -1,11 +1,18 @@
+import argparse
+import contextlib
+import hashlib
 import json
 import os
 import shutil
-from pulpscript import transpile_event, PulpScriptContext, istoken, tile_ids, escape_string, is_id
-
-if not os.path.exists("./pulplua.py"):
-    print("Error: must be run in the pulp-to-lua repository directory.")
-    exit(1)
+import struct
+import time
+import traceback
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from pulpscript import transpile_event, PulpScriptContext, CodeWriter, istoken, escape_string, is_id, \
+    sanitize_varname, resolve_vars
+from eventcache import EventCache, dumps
+from pulpstream import iter_sections, DeferredSection, SpoolWriter, SectionIndex
 
 try:
     from PIL import Image, ImageDraw
@@ -18,51 +25,601 @@ except:
     print("  python3 -m pip install Pillow")
     exit(1)
 
-def main(args):
-    global evobjid
-    evobjid = 1
-
-    if len(args) >= 2:
-        file = args[1]
-    else:
-        print("usage: python3 " + args[0] + " pulp.json [out/]")
-        exit(1)
+# optional; only used to speed up image generation.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# pulp pixel values are 0 (white), 1 (black), and in tiles with transparency,
+# 2 (transparent white) and 3 (transparent black).
+# PIXEL_BLANK pads out frames with fewer than 64 pixels, and is left unset as by Image.new.
+PIXEL_BLANK = 4
+def pixel_lut(values):
+    return bytes(values + [0] * (256 - len(values)))
+LUT_1BIT = pixel_lut([1, 0]) # (for rawmode "1;8": nonzero is white)
+LUT_LA_LUMINANCE = pixel_lut([0xff, 0, 0xff, 0])
+LUT_LA_ALPHA = pixel_lut([0xff, 0xff, 0, 0])
+
+# builds an 8-pixel-wide image table from a list of 64-pixel frames, all at once.
+def image_from_frames(frames, hasalpha=False):
+    mode = "LA" if hasalpha else "1"
+    size = (8, 8 * len(frames))
+    if len(frames) == 0:
+        return Image.new(mode, size)
+    allowed = [0, 1, 2, 3, PIXEL_BLANK] if hasalpha else [0, 1, PIXEL_BLANK]
+    
+    flat = []
+    for data in frames:
+        if len(data) != 64:
+            data = (list(data) + [PIXEL_BLANK] * 64)[:64]
+        flat += data
+    try:
+        pixels = bytes(flat)
+    except (ValueError, TypeError):
+        assert False, f"pixel is {next(p for p in flat if p not in allowed)}"
+    
+    if numpy is not None:
+        pixels = numpy.frombuffer(pixels, dtype=numpy.uint8)
+        bad = pixels[numpy.isin(pixels, allowed, invert=True)]
+        assert len(bad) == 0, f"pixel is {bad[0]}"
+        if hasalpha:
+            luminance = numpy.frombuffer(LUT_LA_LUMINANCE, dtype=numpy.uint8)[pixels]
+            alpha = numpy.frombuffer(LUT_LA_ALPHA, dtype=numpy.uint8)[pixels]
+            return Image.frombytes(mode, size, numpy.stack([luminance, alpha], axis=-1).tobytes())
+        raw = numpy.frombuffer(LUT_1BIT, dtype=numpy.uint8)[pixels].tobytes()
+        return Image.frombytes(mode, size, raw, "raw", "1;8")
+    
+    # (deleting every allowed value leaves only the bad ones)
+    bad = pixels.translate(None, bytes(allowed))
+    assert len(bad) == 0, f"pixel is {bad[0]}"
+    if hasalpha:
+        raw = bytearray(2 * len(pixels))
+        raw[0::2] = pixels.translate(LUT_LA_LUMINANCE)
+        raw[1::2] = pixels.translate(LUT_LA_ALPHA)
+        return Image.frombytes(mode, size, bytes(raw))
+    return Image.frombytes(mode, size, pixels.translate(LUT_1BIT), "raw", "1;8")
+
+# the characters of the font image table, in order (as alphabet in pulp.lua; where a
+# character appears twice, the later one is used)
+FONT_ALPHABET = " !\"#$%&'()*+,-./0123" \
+    "456789:;<=>?@ABCDEFG" \
+    "HIJKLMNOPQRSTUVWXYZ[" \
+    "\\]^_`abcdefghijklmno" \
+    "pqrstuvwxyz<|>~"
+FONT_INDEX = {c: i for i, c in enumerate(FONT_ALPHABET)}
+
+# draws the text of each label known at build time (see build_label in pulpscript.py)
+# as pulp.__fn_label would, one under the other in a single image. returns the image,
+# and {text: (y, width, height)} for each text which draws anything.
+def render_labels(texts, fontimage, halfwidth):
+    advance = 4 if halfwidth else 8
+    placed = dict()
+    width = 0
+    height = 0
+    for text in texts:
+        rows = text.split("\n")
+        w = advance * max(len(row) for row in rows)
+        if w > 0:
+            placed[text] = (height, w, 8 * len(rows))
+            width = max(width, w)
+            height += 8 * len(rows)
+    image = Image.new("LA", (max(width, 1), max(height, 1)))
+    glyphs = dict()
+    for text, (top, w, h) in placed.items():
+        for y, row in enumerate(text.split("\n")):
+            for x, c in enumerate(row):
+                glyph = glyphs.get(c)
+                if glyph is None:
+                    i = FONT_INDEX.get(c, 0)
+                    glyph = glyphs[c] = fontimage.crop((0, 8 * i, advance, 8 * i + 8)).convert("L").convert("LA")
+                image.paste(glyph, (x * advance, top + y * 8))
+    return image, placed
+
+# the pages of a say or ask, word-wrapped to w by h characters, exactly as paginate
+# in pulp.lua does it (for text without embedded tiles).
+LUA_SPACE = " \t\n\v\f\r" # (lua's %s)
+def paginate(text, w, h):
+    x = 0
+    y = 0
+    pages = [""]
+    # (1-based indices into text, as in pulp.lua)
+    startidx = 1
+    wordidx = 1
+    wordx = 0
+    hook_word = True
+    hook_line = True
+    for i in range(1, len(text) + 1):
+        char = text[i - 1]
+        if char == "\f":
+            pages[-1] += text[startidx - 1:i - 1].rstrip(LUA_SPACE)
+            pages.append("")
+            x = 0
+            y = 0
+            startidx = wordidx = i
+            wordx = 0
+            hook_line = hook_word = True
+        elif char == "\n":
+            pages[-1] += text[startidx - 1:i - 1].rstrip(LUA_SPACE) + "\n"
+            x = 0
+            y += 1
+            startidx = wordidx = i
+            wordx = 0
+            hook_line = hook_word = True
+        else:
+            if x >= w:
+                cut_point = i
+                if wordidx > startidx:
+                    cut_point = wordidx
+                    x -= wordx - 1
+                else:
+                    x = 0
+                pages[-1] += text[startidx - 1:cut_point - 1].rstrip(LUA_SPACE) + "\n"
+                startidx = wordidx = cut_point
+                wordx = 0
+                y += 1
+                if y >= h:
+                    y = 0
+                    pages.append("")
+            else:
+                x += 1
+            if hook_line:
+                startidx = i
+            if hook_word:
+                wordidx = i
+                wordx = x
+            if char not in " \t":
+                hook_line = hook_word = False
+            else:
+                hook_word = True
+    pages[-1] += text[startidx - 1:].rstrip(LUA_SPACE)
+    if pages[-1] == "":
+        pages.pop()
+    return pages or [""]
+
+# the w and h which pulp.__fn_say paginates text to, for the w and h given to say or ask
+def dialog_size(w, h, halfwidth):
+    if w == 0:
+        w = None
+    if w is not None and halfwidth:
+        w = -(-w // 2)
+    w = max(17 if w is None else w, 1)
+    h = max(4 if not h else h, 1)
+    return w * (2 if halfwidth else 1), h
+
+# deduplicates pulp["frames"], mapping each frame to a slot in the tile image table.
+# frames are keyed by their exact pixel content, so two different frames can never
+# be merged into one slot.
+class FrameIndex:
+    def __init__(self, frames):
+        self.slot_by_key = dict()
+        self.unique = [] # pixel data of each slot
+        self.slots = [] # slot of each frame
+        for frame in frames:
+            if frame: #some of these are false? why..?
+                key = self.key(frame["data"])
+                slot = self.slot_by_key.get(key)
+                if slot is None:
+                    slot = len(self.unique)
+                    self.slot_by_key[key] = slot
+                    self.unique.append(frame["data"])
+                self.slots.append(slot)
+            else:
+                # TODO: what does 'false' actually mean..?
+                self.slots.append(0)
+    
+    @staticmethod
+    def key(data):
+        try:
+            return bytes(data)
+        except (ValueError, TypeError):
+            # (not a valid pixel; this is reported when the image is generated)
+            return tuple(data)
+            
+    def slot(self, frameidx):
+        return self.slots[frameidx]
+
+# packs a room's tiles into a string for string.unpack (see unpack_tiles in pulp.lua),
+# as one value per tile, or as (count, tile id) runs if that's shorter.
+# returns the string as a lua literal, the format of each tile id, and whether it's run-length encoded.
+def pack_tiles(tiles):
+    top = max(tiles, default=0)
+    format, pyformat = ("B", "<B") if top < 0x100 else ("<I2", "<H") if top < 0x10000 else ("<I4", "<I")
+    runs = []
+    for tile in tiles:
+        if runs and runs[-1][1] == tile and runs[-1][0] < 0xff:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, tile])
+    plain = b"".join(struct.pack(pyformat, tile) for tile in tiles)
+    rle = b"".join(struct.pack("<B", count) + struct.pack(pyformat, tile) for count, tile in runs)
+    data = min(plain, rle, key=len)
+    # (printable characters as they are; anything else as a decimal escape,
+    # padded to three digits only where a digit follows it)
+    literal = []
+    for byte in reversed(data):
+        if 0x20 <= byte < 0x7f and byte not in b"\\\"":
+            literal.append(chr(byte))
+        elif literal and literal[-1][0].isdigit():
+            literal.append(f"\\{byte:03}")
+        else:
+            literal.append(f"\\{byte}")
+    return "\"" + "".join(reversed(literal)) + "\"", format, data is rle
+
+# the midi note number of a pulp note (1 to 12, from C) in an octave.
+def midi_note(note, octave):
+    return note + 12 * (octave + 1) - 1
+
+# the note-ons of one voice of a song, from its (note, octave, hold) for each tick:
+# [tick, midi note, hold] for each tick from 0 which starts a note, flattened.
+# (notes outside C0 to B8 aren't played)
+def song_events(track, ticks):
+    events = []
+    for tick in range(min(ticks, len(track) // 3)):
+        note, octave, hold = track[tick * 3:tick * 3 + 3]
+        if note > 0 and 12 <= midi_note(note, octave) < 120:
+            events += [tick, midi_note(note, octave), hold]
+    return events
+
+# likewise for a sound: [step, midi note, length] for each step from 1 whose length
+# is nonzero (see pulp:loadSounds).
+def sound_events(notes):
+    events = []
+    for i in range(0, len(notes) - 2, 3):
+        note, octave, length = notes[i:i + 3]
+        if length != 0:
+            events += [i // 3 + 1, midi_note(note, octave), length]
+    return events
+
+# transpiles every event of one script in a context of its own, so that scripts
+# can be transpiled independently of each other (see --jobs).
+# returns the lua code along with the context side effects, which the caller
+# merges back in script order, and [(event, seconds, lua bytes, things folding eliminated)]
+# (see --profile).
+def transpile_script_events(name, evobjid, data, tile_ids, cache=None):
+    ctx = PulpScriptContext(tile_ids)
+    saved = ctx.begin_effects()
+    out = CodeWriter()
+    stats = []
+    evnames = set()
+    for key in data:
+        if not key.startswith("__"):
+            assert data[key][0] == "block"
+            evnames.add(key)
+    for key in data:
+        if not key.startswith("__"):
+            ctx.blocks = data["__blocks"]
+            out.write("\n")
+            start = time.perf_counter()
+            eliminated = sum(ctx.eliminated.values())
+            evout = CodeWriter()
+            (cache.transpile_event if cache else transpile_event)(
+                name, key, ctx, data[key][1], evobjid, data["__comments"], evnames, evout
+            )
+            lua = evout.getvalue()
+            out.write(lua)
+            stats.append((key, time.perf_counter() - start, len(lua), sum(ctx.eliminated.values()) - eliminated))
+    return out.getvalue(), ctx.end_effects(saved), stats
+
+# state of each --jobs worker process
+worker_tile_ids = None
+worker_cache = None
+
+def init_worker(tile_ids, cacheopts):
+    global worker_tile_ids, worker_cache
+    worker_tile_ids = tile_ids
+    if cacheopts:
+        worker_cache = EventCache(cacheopts[0], cacheopts[1], tile_ids)
+
+def worker_transpile_script_events(job):
+    if not worker_cache:
+        return transpile_script_events(*job, worker_tile_ids) + (0, 0)
+    hits = worker_cache.hits
+    misses = worker_cache.misses
+    result = transpile_script_events(*job, worker_tile_ids, worker_cache)
+    return result + (worker_cache.hits - hits, worker_cache.misses - misses)
+
+# locals for the runtime, at the top of main.lua and of each module (see --split)
+RUNTIME_LOCALS = """local __sin <const> = math.sin
+local __cos <const> = math.cos
+local __tan <const> = math.tan
+local __floor <const> = math.floor
+local __ceil <const> = math.ceil
+local __round <const> = function(x) return __floor(x + 0.5) end
+local __random <const> = math.random
+local __tau <const> = math.pi * 2
+local __tostring <const> = tostring
+local __roomtiles <const> = __pulp.roomtiles
+local __print <const> = print
+local __getTime <const> = playdate.getTime
+local __getSecondsSinceEpoch <const> = playdate.getSecondsSinceEpoch
+local __fillrect <const> = playdate.graphics.fillRect
+local __setcolour <const> = playdate.graphics.setColor
+local __kColorBlack <const> = playdate.graphics.kColorBlack
+local __kColorWhite <const> = playdate.graphics.kColorWhite
+local __fillcolours <const> = {
+    black = __kColorBlack,
+    white = __kColorWhite
+}
+local __pix8scale = __pulp.pix8scale
+"""
+
+# the runtime, copied alongside main.lua
+RUNTIME_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNTIME_FILES = ["pulp.lua", "pulp-audio.lua"]
+
+LAUNCHER_PATH = "launcher/"
+
+# wall time spent in each phase of a build, e.g. with phase("rooms"): ...
+# with allocations=True, also the memory each phase allocated (phases mustn't nest).
+class PhaseTimer:
+    def __init__(self, allocations=False):
+        self.times = dict() # phase -> seconds
+        self.allocations = dict() if allocations else None # phase -> [bytes retained, peak bytes]
+    
+    @contextlib.contextmanager
+    def __call__(self, name):
+        if self.allocations is not None:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0) + time.perf_counter() - start
+            if self.allocations is not None:
+                current, peak = tracemalloc.get_traced_memory()
+                allocations = self.allocations.setdefault(name, [0, 0])
+                allocations[0] += current - before
+                allocations[1] = max(allocations[1], peak - before)
+
+# where a build spent its time, memory and output (see --profile).
+class BuildProfile:
+    def __init__(self, phases, allocations, scripts, sizes, eliminated):
+        self.phases = phases # phase -> seconds
+        self.allocations = allocations # phase -> [bytes retained, peak bytes]
+        self.scripts = scripts # [(script name, [(event, seconds, lua bytes, eliminated)])]
+        self.sizes = sizes # part of main.lua -> bytes
+        self.eliminated = eliminated # what folding removed: kind -> count
+    
+    def report(self, top=10):
+        out = CodeWriter()
+        out.write(f"{'phase':<12}{'time (ms)':>12}{'retained (KB)':>16}{'peak (KB)':>12}\n")
+        for name, seconds in sorted(self.phases.items(), key=lambda item: -item[1]):
+            retained, peak = self.allocations.get(name, (0, 0))
+            out.write(f"{name:<12}{seconds * 1000:>12.1f}{retained / 1024:>16.1f}{peak / 1024:>12.1f}\n")
         
-    outpath = "out"
-    if len(args) >= 3:
-        outpath = args[2]
+        scripts = [(name, sum(event[1] for event in events), sum(event[2] for event in events), len(events),
+            sum(event[3] for event in events)) for name, events in self.scripts]
+        out.write(f"\nhottest scripts ({len(scripts)} in all):\n")
+        out.write(f"{'time (ms)':>12}{'lua bytes':>12}{'events':>8}{'folded':>8}  script\n")
+        for name, seconds, size, count, eliminated in sorted(scripts, key=lambda script: -script[1])[:top]:
+            out.write(f"{seconds * 1000:>12.2f}{size:>12}{count:>8}{eliminated:>8}  {name}\n")
+        
+        events = [(f"{name}.{event}", seconds, size, eliminated)
+            for name, events in self.scripts for event, seconds, size, eliminated in events]
+        out.write(f"\nhottest events ({len(events)} in all):\n")
+        out.write(f"{'time (ms)':>12}{'lua bytes':>12}{'folded':>8}  event\n")
+        for name, seconds, size, eliminated in sorted(events, key=lambda event: -event[1])[:top]:
+            out.write(f"{seconds * 1000:>12.2f}{size:>12}{eliminated:>8}  {name}\n")
+        
+        if self.eliminated:
+            out.write(f"\nfolding: {format_eliminated(self.eliminated)}\n")
+            folded = sorted((event for event in events if event[3]), key=lambda event: -event[3])
+            for name, seconds, size, eliminated in folded[:top]:
+                out.write(f"{eliminated:>12}  {name}\n")
+        
+        total = sum(self.sizes.values())
+        out.write(f"\nmain.lua ({total / 1024:.1f} KB):\n")
+        for name, size in sorted(self.sizes.items(), key=lambda item: -item[1]):
+            out.write(f"{name:<12}{size / 1024:>12.1f} KB{size * 100 / max(total, 1):>8.1f}%\n")
+        return out.getvalue()
+
+# e.g. "folded 2 condition(s), removed 1 branch(es)"
+ELIMINATED = [
+    ("conditions", "folded {} condition(s)"),
+    ("expressions", "folded {} expression(s)"),
+    ("branches", "removed {} branch(es)"),
+    ("statements", "removed {} unreachable statement(s)"),
+    ("blocks", "removed {} empty block(s)"),
+]
 
-    with open(file) as f:
-        pulp = json.load(f)
+def format_eliminated(eliminated):
+    return ", ".join(text.format(eliminated[kind]) for kind, text in ELIMINATED if eliminated.get(kind))
+
+# everything transpile() produces, in memory. save() writes it to an output directory.
+class BuildArtifacts:
+    def __init__(self, main_lua_parts, images, pdxinfo, errors, phases, modules, profile=None):
+        self.main_lua_parts = main_lua_parts # writers, each holding one part of main.lua
+        self.modules = modules # path in the output directory -> writer (see --split)
+        self.images = images # path in the output directory -> PIL image
+        self.pdxinfo = pdxinfo
+        self.errors = errors
+        self.phases = phases # phase -> seconds (see PhaseTimer)
+        self.profile = profile # BuildProfile, if built with profile=True
+    
+    @property
+    def main_lua(self):
+        return "".join(part.getvalue() for part in self.main_lua_parts)
+    
+    @property
+    def launcher_card(self):
+        return self.images[os.path.join(LAUNCHER_PATH, "card.png")]
+    
+    def write_main_lua(self, f):
+        for part in self.main_lua_parts:
+            part.writeto(f)
+    
+    # `written`, if given, maps each file to what was last saved to it (and is updated);
+    # files which would not change are skipped. returns the number of files written.
+    def save(self, outpath, written=None):
+        files = 0
+        def unchanged(path, contents):
+            nonlocal files
+            path = os.path.join(outpath, path)
+            if written is not None:
+                if written.get(path) == contents and os.path.exists(path):
+                    return True
+                written[path] = contents
+            files += 1
+            return False
+        
+        if not os.path.isdir(outpath):
+            os.mkdir(outpath)
+        if not unchanged("main.lua", self.main_lua if written is not None else None):
+            with open(os.path.join(outpath, "main.lua"), "w") as f:
+                self.write_main_lua(f)
+        for path, module in self.modules.items():
+            if not unchanged(path, module.getvalue()):
+                os.makedirs(os.path.dirname(os.path.join(outpath, path)), exist_ok=True)
+                with open(os.path.join(outpath, path), "w") as f:
+                    module.writeto(f)
+        for runtime_file in RUNTIME_FILES:
+            if not unchanged(runtime_file, os.stat(os.path.join(RUNTIME_DIR, runtime_file)).st_mtime_ns):
+                shutil.copy(os.path.join(RUNTIME_DIR, runtime_file), outpath)
+        
+        # create path for launcher assets
+        if not os.path.isdir(os.path.join(outpath, LAUNCHER_PATH)):
+            os.mkdir(os.path.join(outpath, LAUNCHER_PATH))
+        for path, image in self.images.items():
+            if not unchanged(path, (image.mode, image.size, image.tobytes())):
+                image.save(os.path.join(outpath, path), "PNG")
+        
+        if not unchanged("pdxinfo", self.pdxinfo):
+            with open(os.path.join(outpath, "pdxinfo"), "w") as f:
+                f.write(self.pdxinfo)
+        if written is None:
+            print(f"files written to {outpath}")
+        return files
 
+# the sections of pulp.json which are handled as they are read (see build()).
+# when not streaming, sections are handled in this order.
+SECTIONS = ["font", "frames", "tiles", "rooms", "scripts", "sounds", "songs"]
+
+# entries of pulp.json, for build(): (key, load, defer, digest) where load() returns
+# the value of the entry, and defer(), if given, returns a replacement for load which
+# does not keep the entry in memory (called if the entry must wait for others).
+# digest, if given, identifies the entry's contents (see memo in build()).
+def project_entries(project):
+    for key in [key for key in project if key not in SECTIONS] + [key for key in SECTIONS if key in project]:
+        yield key, (lambda value=project[key]: value), None, None
+
+def stream_entries(f):
+    for key, text, value in iter_sections(f):
+        yield key, (lambda value=value: value), (lambda text=text: DeferredSection(text).load), None
+
+# transpiles a pulp project (the parsed contents of pulp.json) to lua.
+# the project is not modified, and nothing is written to disk except for the
+# event cache, if one is given. with profile=True, artifacts.profile is set.
+def transpile(project, cache=None, cache_size=64, jobs=1, profile=False, split=False):
+    return build(project_entries(project), cache, cache_size, jobs, profile=profile, split=split)
+
+# as transpile(), but reads pulp.json from a file. with stream=True, the file is
+# read one section at a time and main.lua is spooled to temporary files.
+def transpile_file(path, cache=None, cache_size=64, jobs=1, stream=False, profile=False, split=False):
+    with open(path) as f:
+        if stream:
+            return build(stream_entries(f), cache, cache_size, jobs, spool=True, profile=profile, split=split)
+        return transpile(json.load(f), cache, cache_size, jobs, profile, split)
+
+# rebuilds outpath whenever pulp.json changes, until interrupted (see --watch).
+# each rebuild reuses the results of every stage whose inputs haven't changed,
+# and only writes the files whose contents have.
+def watch(path, outpath, cache=None, cache_size=64, jobs=1, interval=0.1, profile=False, split=False):
+    index = SectionIndex()
+    memo = dict()
+    written = dict()
+    stamp = None
+    print(f"watching {path} for changes...")
+    while True:
+        try:
+            stat = os.stat(path)
+            newstamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            newstamp = None
+        if newstamp is not None and newstamp != stamp:
+            stamp = newstamp
+            start = time.perf_counter()
+            try:
+                with open(path) as f:
+                    text = f.read()
+                entries = [(key, load, None, digest) for key, load, digest in index.update(text)]
+                artifacts = build(entries, cache, cache_size, jobs, memo=memo, profile=profile, split=split)
+                for error in artifacts.errors:
+                    print("--" + str(error))
+                files = artifacts.save(outpath, written)
+                print(f"rebuilt in {(time.perf_counter() - start) * 1000:.0f} ms ({files} file(s) updated)")
+                if profile:
+                    print(artifacts.profile.report())
+            except Exception:
+                # (e.g. the file was read while it was being saved)
+                traceback.print_exc()
+                print("build failed; waiting for changes...")
+        time.sleep(interval)
+
+# `memo`, if given, holds the results of each stage from the previous build; see memoized().
+# with profile=True, the memory allocated by each phase is traced too (see BuildProfile).
+# with split=True, rooms and the scripts of rooms and rarely placed tiles are put in
+# modules of their own, which the runtime loads when they're needed (see --split).
+def build(entries, cache_path=None, cache_size=64, processes=1, spool=False, memo=None, profile=False, split=False):
+    tracing = profile and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        return build_traced(entries, cache_path, cache_size, processes, spool, memo, profile, split)
+    finally:
+        if tracing:
+            tracemalloc.stop()
+
+def build_traced(entries, cache_path, cache_size, processes, spool, memo, profile, split):
     scripttypes = ["global", "room", "tile"]
     tiletypes = ["world", "player", "sprite", "item", "exit"]
 
-    playerid = pulp["player"]["id"]
-    startroom = pulp["player"]["room"]
-    halfwidth = pulp["font"]["type"] != 1
-
     ROOMW = 25
     ROOMH = 15
 
+    # the small top-level entries of pulp.json (name, player, card...).
+    # the large sections (frames, tiles, rooms...) are handled as they are read and
+    # then discarded, keeping only what later sections need (see `sections` below).
+    pulp = dict()
+
     ctx = PulpScriptContext()
+    phase = PhaseTimer(allocations=profile)
     
-    ctx.ext_pdxinfo["name"] = pulp["name"]
-    ctx.ext_pdxinfo["author"] = pulp["author"]
-    ctx.ext_pdxinfo["description"] = pulp["intro"]
-    ctx.ext_pdxinfo["bundleID"] = "game.pulp." + \
-            pulp["author"].replace(" ","").replace(".", "") + "." + \
-            pulp["name"].replace(" ","").replace(".", "")
-    ctx.ext_pdxinfo["version"] = str(pulp["version"])
-    ctx.ext_pdxinfo["imagePath"] = "launcher/"
-    ctx.ext_pdxinfo["launchSoundPath"] = "launcher_path/"
-    ctx.ext_pdxinfo["contentWarning"] = ""
-    ctx.ext_pdxinfo["contentWarning2"] = ""
+    # (applied once all scripts are transpiled; a [PDXINFO] comment overrides these)
+    def pdxinfo_defaults():
+        return {
+            "name": pulp["name"],
+            "author": pulp["author"],
+            "description": pulp["intro"],
+            "bundleID": "game.pulp." + \
+                pulp["author"].replace(" ","").replace(".", "") + "." + \
+                pulp["name"].replace(" ","").replace(".", ""),
+            "version": str(pulp["version"]),
+            "imagePath": "launcher/",
+            "launchSoundPath": "launcher_path/",
+            "contentWarning": "",
+            "contentWarning2": "",
+        }
     
     ctx.ext_ptl["legacySound"] = False
     ctx.ext_ptl["showFPS"] = False
+    ctx.ext_ptl["showAllocations"] = False
+    ctx.ext_ptl["roomCache"] = False
+    ctx.ext_ptl["soundCache"] = False
+    ctx.ext_ptl["prewarmSounds"] = True
+    
+    # the value of a [PTL] option which is a number of things, or None if it's unset.
+    def ptl_count(key):
+        value = ctx.ext_ptl[key]
+        if value and not str(value).isdigit():
+            ctx.errors += [f"[PTL] {key} must be a number, not {value}"]
+            return None
+        return value or None
 
     def startcode():
+        playerid = pulp["player"]["id"]
+        startroom = pulp["player"]["room"]
         code = f"""-- tweak sound engine to sound as it sounded on firefox prior to 1.10.0.
 -- set this to true to make the sfx sound as it did prior to 1.10.0.
 -- set this to false to make the sfx sound as it does on pdx export.
@@ -88,6 +645,7 @@ math.randomseed(playdate.getSecondsSinceEpoch())
             + f"  PTLE_SMOOTH_OFFSET_X = 0,\n" \
             + f"  PTLE_SMOOTH_OFFSET_Y = 0,\n" \
             + f"  PTLE_SHOW_FPS = false,\n" \
+            + f"  PTLE_SHOW_ALLOC = false,\n" \
             + f"  PTLE_CONFIRM_DAS = -1,\n" \
             + f"  PTLE_CANCEL_DAS = -1,\n" \
             + f"  PTLE_V_DAS = -1,\n" \
@@ -95,103 +653,117 @@ math.randomseed(playdate.getSecondsSinceEpoch())
         + "}\n"
         code += "local __pulp <const> = ___pulp\n"
         code += "import \"pulp\"\n"
-        code += "local __sin <const> = math.sin\n"
-        code += "local __cos <const> = math.cos\n"
-        code += "local __tan <const> = math.tan\n"
-        code += "local __floor <const> = math.floor\n"
-        code += "local __ceil <const> = math.ceil\n"
-        code += "local __round <const> = function(x) return __floor(x + 0.5) end\n"
-        code += "local __random <const> = math.random\n"
-        code += "local __tau <const> = math.pi * 2\n"
-        code += "local __tostring <const> = tostring\n"
-        code += "local __roomtiles <const> = __pulp.roomtiles\n"
-        code += "local __print <const> = print\n"
-        code += "local __getTime <const> = playdate.getTime\n"
-        code += "local __getSecondsSinceEpoch <const> = playdate.getSecondsSinceEpoch\n"
-        code += """local __fillrect <const> = playdate.graphics.fillRect
-    local __setcolour <const> = playdate.graphics.setColor
-    local __fillcolours <const> = {
-        black = playdate.graphics.kColorBlack,
-        white = playdate.graphics.kColorWhite
-    }
-    local __pix8scale = __pulp.pix8scale
-    local __script <const> = {}
-    """
+        code += RUNTIME_LOCALS
+        code += "local __script <const> = {}\n"
         return code
         
     def endcode():
         code = ""
         if ctx.ext_ptl["showFPS"]:
             code += "\n__pulp.PTLE_SHOW_FPS = true"
+        if ctx.ext_ptl["showAllocations"]:
+            code += "\n__pulp.PTLE_SHOW_ALLOC = true"
         if ctx.ext_ptl["legacySound"]:
             code += "\n__FIREFOX_SOUND_COMPAT = true"
+        if split and ptl_count("roomCache"):
+            code += f"\n__pulp.roomcache = {ptl_count('roomCache')}"
+        if ptl_count("soundCache"):
+            code += f"\n__pulp.soundcache = {ptl_count('soundCache')}"
+        if prelabels:
+            labels = ", ".join(f"[\"{escape_string(text)}\"] = {{{y}, {w}, {h}}}" for text, (y, w, h) in prelabels.items())
+            code += f"\n__pulp.prelabels = {{{labels}}}"
+        if ctx.dialog:
+            # w -> h -> text -> pages
+            prepaginated = dict()
+            for text, w, h in sorted(ctx.dialog, key=str):
+                w, h = dialog_size(w, h, halfwidth)
+                prepaginated.setdefault(w, dict()).setdefault(h, dict())[text] = paginate(text, w, h)
+            code += "\n__pulp.prepaginated = {"
+            for w, byh in sorted(prepaginated.items()):
+                code += f"\n  [{w}] = {{"
+                for h, bytext in sorted(byh.items()):
+                    code += f"\n    [{h}] = {{"
+                    for text, pages in bytext.items():
+                        pages = ", ".join(f"\"{escape_string(page)}\"" for page in pages)
+                        code += f"\n      [\"{escape_string(text)}\"] = {{{pages}}},"
+                    code += "\n    },"
+                code += "\n  },"
+            code += "\n}"
+        if ctx.ext_ptl["prewarmSounds"] and prewarm_sounds:
+            sounds = ", ".join(f"\"{escape_string(sid)}\"" if type(sid) == str else str(sid) for sid in prewarm_sounds)
+            code += f"\n__pulp.prewarmsounds = {{{sounds}}}"
         code += "\n__pulp:load()\n"
         code += "__pulp:start()\n"
         return code
         
-    def write_data_to_image(img, y, data, hasalpha=False):
-        i = 0
-        for p in data:
-            assert p == 0 or p == 1 or (hasalpha and (p == 2 or p == 3)), f"pixel is {p}"
-            if i % 8 < img.width:
-                img.putpixel(
-                    (i % 8, y + i // 8),
-                    (0xff * (1 - p%2), 0 if p >= 2 else 0xff) if hasalpha else (1 - (p%2))
-                )
-            i += 1
-        
-    # images (font, borders)
-    borderimage = Image.new("1", (8, 8 * len(pulp["font"]["pipe"])))
-    fontimage = Image.new("1", (8, 8 * len(pulp["font"]["chars"])))
-
-    y = 0
-    for data in pulp["font"]["pipe"]:
-        write_data_to_image(borderimage, y, data)
-        y += 8
+    # with --watch, each stage's result is kept in `memo` between builds, and reused
+    # as long as the pulp.json entries it depends on (`keys`) are unchanged.
+    # a stage's keys are the section itself and the entries it depends on, by default.
+    digests = dict() # entry -> digest of its contents, if known
+    
+    def memo_get(stage, keys=None):
+        if keys is None:
+            keys = [stage] + sections[stage][1]
+        inputs = [digests.get(key) for key in keys]
+        if memo is None or None in inputs:
+            return None, None
+        entry = memo.get(stage)
+        if entry is not None and entry[0] == inputs:
+            return inputs, entry[1]
+        return inputs, None
+    
+    def memo_put(stage, inputs, value):
+        if inputs is not None:
+            memo[stage] = (inputs, value)
+    
+    def memoized(stage, compute, keys=None):
+        inputs, value = memo_get(stage, keys)
+        if value is None:
+            value = compute()
+            memo_put(stage, inputs, value)
+        return value
 
-    y = 0
-    for data in pulp["font"]["chars"]:
-        write_data_to_image(fontimage, y, data)
-        y += 8
-        
+    # images (font, borders)
+    def read_font(load):
+        nonlocal halfwidth, borderimage, fontimage
+        def compute():
+            font = load()
+            return font["type"] != 1, image_from_frames(font["pipe"]), image_from_frames(font["chars"])
+        halfwidth, borderimage, fontimage = memoized("font", compute)
+    
     # images (tiles)
-    uniqueimagehashmap = dict()
-    uniqueimagelist = []
-    tileimages = []
-    for frame in pulp["frames"]:
-        if frame: #some of these are false? why..?
-            h = hash(tuple(frame["data"]))
-            if h not in uniqueimagehashmap:
-                uniqueimagehashmap[h] = len(uniqueimagelist)
-                tileimages.append(len(uniqueimagelist))
-                uniqueimagelist.append(frame["data"])
-            else:
-                tileimages.append(uniqueimagehashmap[h])
-        else:
-            # TODO: what does 'false' actually mean..?
-            tileimages.append(0)
-
-    hasalpha = False
-    for data in uniqueimagelist:
-        if 2 in data or 3 in data:
-            hasalpha = True
-            break
-    frame_img = Image.new("LA" if hasalpha else "1", (8, 8 * len(uniqueimagelist)))
-    y = 0
-    print("writing image data...")
-    for data in uniqueimagelist:
-        write_data_to_image(frame_img, y, data, hasalpha)
-        y += 8
-    print("done.")
+    def read_frames(load):
+        nonlocal frameindex, tileimages, hasalpha
+        def compute():
+            frameindex = FrameIndex(load())
+            hasalpha = False
+            for data in frameindex.unique:
+                if 2 in data or 3 in data:
+                    hasalpha = True
+                    break
+            return frameindex, hasalpha
+        frameindex, hasalpha = memoized("frames", compute)
+        tileimages = frameindex.slots
+    
+    # (doesn't depend on scripts, so with --jobs this runs while they transpile)
+    def render_tile_images():
+        def compute():
+            print("writing image data...")
+            frame_img = image_from_frames(frameindex.unique, hasalpha)
+            print("done.")
+            return frame_img
+        with phase("images"):
+            return memoized("tile images", compute, ["frames"])
+        
     # scripts
 
     def getScriptNameBase(type, id):
         if type == 0 and id == 0:
             return "game"
-        elif type == 1 and id < len(pulp["rooms"]):
-            return pulp["rooms"][id]["name"]
-        elif type == 2 and id < len(pulp["tiles"]):
-            return pulp["tiles"][id]["name"]
+        elif type == 1 and id < len(roomnames):
+            return roomnames[id]
+        elif type == 2 and id < len(tilenames):
+            return tilenames[id]
         
         ctx.errors += [f"unknown script, type {type}, id {id}"]
         return f"__UNKNOWN_SCRIPT_{type}_{id}"
@@ -207,319 +779,593 @@ math.randomseed(playdate.getSecondsSinceEpoch())
         return s
 
     class Script:
-        def __init__(self, id, type) -> None:
-            global evobjid
+        def __init__(self, id, type, index) -> None:
             self.id = id
             self.type = type
-            self.code = ""
             self.name = getScriptName(type, id)
-            self.evobjid = f"__script[{evobjid}]"
-            evobjid += 1
-            
-            self.code += f"\n----------------- {self.name} ----------------------------\n\n"
-            self.code += f"__pulp:newScript(\"{self.name}\")\n"
-            self.code += f"{self.evobjid} = __pulp:getScript(\"{self.name}\")\n"
-            self.code += f"__pulp:associateScript(\"{self.name}\", \"{scripttypes[self.type]}\", {self.id})"
+            self.evobjid = f"__script[{index}]"
+            self.module = f"scripts/{index}" # (if split)
             
-            self.code += "\n"
+        # `evnames` are the events the script defines, if they're known (see pulp:emit).
+        # with lazy=True, they're in the script's module, loaded when one is first used.
+        def writeHeader(self, out, evnames, lazy=False):
+            out.write(f"\n----------------- {self.name} ----------------------------\n\n")
+            evlist = "{" + ", ".join(f"\"{escape_string(evname)}\"" for evname in evnames) + "}" if evnames is not None else None
+            if lazy:
+                out.write(f"__pulp:newLazyScript(\"{self.name}\", \"{self.module}\", {evlist})\n")
+            elif evlist:
+                out.write(f"__pulp:newScript(\"{self.name}\", {evlist})\n")
+            else:
+                out.write(f"__pulp:newScript(\"{self.name}\")\n")
+            out.write(f"{self.evobjid} = __pulp:getScript(\"{self.name}\")\n")
+            out.write(f"__pulp:associateScript(\"{self.name}\", \"{scripttypes[self.type]}\", {self.id})")
             
-            self.evnames = set()
-        
-        def addEvent(self, key, blocks, blockidx, commentsblockidx):
-            ctx.blocks = blocks
-            self.code += "\n" + transpile_event(self.name, key, ctx, blockidx, self.evobjid, commentsblockidx, self.evnames)
+            out.write("\n")
         
-        def markHasEvent(self, evname):
-            self.evnames.add(evname)
 
-    code = startcode()
+    # each section of main.lua is written to its own writer as soon as it can be
+    # (to a temporary file when streaming), and they are put together at the end.
+    # the variable declarations which must precede everything else are only known
+    # once all scripts are transpiled, so they go into `varout`.
+    SectionWriter = SpoolWriter if spool else CodeWriter
+    varout = CodeWriter()
+    headout = CodeWriter()
+    tilesout = None # (see read_tiles, etc.)
+    roomsout = None
+    soundsout = None
+    songsout = None
+    scriptsout = SectionWriter()
+    out = CodeWriter()
 
     # tiles
-    tile_id = 0
-
-    code += "\n__pulp.tiles = {}\n"
-    for tile in pulp["tiles"]:
-        if tile:
-            if type(tile) == bool or tile is None:
-                print("WARNING: peculiar entry in tiles table. Expected JSON object.")
-                continue
-            tile_ids[tile['name']] = tile['id']
-            code += f"__pulp.tiles[{tile['id']}] = " + "{\n"
-            code += f"    id = {tile['id']},\n"
-            code += f"    fps = {tile['fps']},\n"
-            code += f"    name = \"{tile['name']}\",\n"
-            code += f"    type = {tile['type']},\n"
-            code += f"    btype = {tile['btype']},\n" # behaviour type?
-            code += f"    solid = {tile['solid']},\n".lower()
-            if "says" in tile:
-                code += f"    says = \"{escape_string(tile['says'])}\","
-            code += "    frames = {"
-            for frame in tile["frames"]:
-                code += f"{tileimages[frame]+1},"
-            code += " }\n"
-            code += "  }\n"
+    def write_tiles(out, tiles, tile_ids):
+        out.write("\n__pulp.tiles = {}\n")
+        for tile in tiles:
+            if tile:
+                if type(tile) == bool or tile is None:
+                    print("WARNING: peculiar entry in tiles table. Expected JSON object.")
+                    continue
+                tile_ids[tile['name']] = tile['id']
+                out.write(f"__pulp.tiles[{tile['id']}] = " + "{\n")
+                out.write(f"    id = {tile['id']},\n")
+                out.write(f"    fps = {tile['fps']},\n")
+                out.write(f"    name = \"{tile['name']}\",\n")
+                out.write(f"    type = {tile['type']},\n")
+                out.write(f"    btype = {tile['btype']},\n") # behaviour type?
+                out.write(f"    solid = {tile['solid']},\n".lower())
+                # (static tiles never change frame unless they're played; see active_tiles in pulp.lua)
+                out.write(f"    static = {str(tile['fps'] == 0 or len(tile['frames']) <= 1).lower()},\n")
+                if "says" in tile:
+                    out.write(f"    says = \"{escape_string(tile['says'])}\",")
+                out.write("    frames = {")
+                out.write("".join(f"{tileimages[frame]+1}," for frame in tile["frames"]))
+                out.write(" }\n")
+                out.write("  }\n")
 
     def clamp(x, a, b):
         return min(max(x, a), b)
 
     # rooms
-    code += "\n__pulp.rooms = {}\n"
-    j = -1
-    for room in pulp["rooms"]:
-        j += 1
-        if type(room) == bool or room is None:
-            print(f"WARNING: peculiar entry in room table at index {j}. Expected JSON object.")
-            continue
-        code += f"__pulp.rooms[{room['id']}] = " + "{\n"
-        code += f"  id = {room['id']},\n"
-        code += f"  name = \"{room['name']}\",\n"
-        code += f"  song = {room['song']},\n"
-        code += "  tiles = {"
-        i = 0
-        for tile in room["tiles"]:
-            if i % 25 == 0:
-                code += "\n    "
-            code += f"{tile:4},"
-            i += 1
-        code += " },\n"
-        code += "  exits = {\n"
+    # with `modules`, each room's tiles and exits go in a module of their own (see --split).
+    def write_rooms(out, rooms, modules=None):
+        out.write("\n__pulp.rooms = {}\n")
+        j = -1
+        for room in rooms:
+            j += 1
+            if type(room) == bool or room is None:
+                print(f"WARNING: peculiar entry in room table at index {j}. Expected JSON object.")
+                continue
+            out.write(f"__pulp.rooms[{room['id']}] = " + "{\n")
+            out.write(f"  id = {room['id']},\n")
+            out.write(f"  name = \"{room['name']}\",\n")
+            out.write(f"  song = {room['song']},\n")
+            if modules is None:
+                write_room_data(out, room)
+            else:
+                path = f"rooms/{room['id']}"
+                out.write(f"  module = \"{path}\",\n")
+                module = modules[path + ".lua"] = CodeWriter()
+                module.write(f"-- {room['name']}\n")
+                module.write("return {\n")
+                write_room_data(module, room)
+                module.write("}\n")
+            out.write("}\n")
+    
+    def write_room_data(out, room):
+        tiledata, tileformat, tilerle = pack_tiles(room["tiles"])
+        out.write(f"  tiledata = {tiledata},\n")
+        out.write(f"  tileformat = \"{tileformat}\",\n")
+        out.write(f"  tilerle = {str(tilerle).lower()},\n")
+        out.write("  exits = {\n")
         for exit in room["exits"]:
-            code += "    {\n"
-            code += f"      x = {clamp(exit['x'], 0, ROOMW)},\n"
-            code += f"      y = {clamp(exit['y'], 0, ROOMH)},\n"
-            #code += f"      id = {exit['id']},\n"
+            out.write("    {\n")
+            out.write(f"      x = {clamp(exit['x'], 0, ROOMW)},\n")
+            out.write(f"      y = {clamp(exit['y'], 0, ROOMH)},\n")
+            #out.write(f"      id = {exit['id']},\n")
             if "tx" in exit:
-                code += f"      tx = {exit['tx']},\n"
+                out.write(f"      tx = {exit['tx']},\n")
             if "ty" in exit:
-                code += f"      ty = {exit['ty']},\n"
+                out.write(f"      ty = {exit['ty']},\n")
             if "edge" in exit:
-                code += f"      edge = {exit['edge']},\n"
+                out.write(f"      edge = {exit['edge']},\n")
             if "fin" in exit:
-                code += f"      fin = [[{exit['fin']}]],\n"
+                out.write(f"      fin = [[{exit['fin']}]],\n")
             if "room" in exit:
-                code += f"      room = {exit['room']},\n"
-            code += "    nil},\n"
-        code += "  nil},\n"
-        code += "}\n"
+                out.write(f"      room = {exit['room']},\n")
+            out.write("    nil},\n")
+        out.write("  nil},\n")
         
     # sounds
-    j = -1
-    code += "\n__pulp.sounds = {}\n"
-    for sound in pulp["sounds"]:
-        j += 1
-        if type(sound) != dict or sound is None:
-            print(f"WARNING: peculiar entry in sounds table at index {j}. Expected JSON object.")
-            code += f"__pulp.sounds[{j}] = " + "{}\n"
-            continue
-        code += f"__pulp.sounds[{sound['id']}] = " + "{\n"
-        code += f"  bpm = {sound['bpm']},\n"
-        code += f"  name = \"{sound['name']}\",\n"
-        code += f"  type = {sound['type']},\n"
-        if 'notes' in sound:
-            code += "  notes = {"
-            for note in sound['notes']:
-                code += f"{note}, "
-            code += "},\n"
-        if 'ticks' in sound:
-            code += f"  ticks = {sound['ticks']},\n"
-        if 'envelope' in sound:
-            if 'decay' in sound['envelope']:
-                code += f"  decay = {sound['envelope']['decay']},\n"
-            if 'attack' in sound['envelope']:
-                code += f"  attack = {sound['envelope']['attack']},\n"
-            if 'release' in sound['envelope']:
-                code += f"  release = {sound['envelope']['release']},\n"
-            if 'volume' in sound['envelope']:
-                code += f"  volume = {sound['envelope']['volume']},\n"
-            if 'sustain' in sound['envelope']:
-                code += f"  sustain = {sound['envelope']['sustain']},\n"
-        code += "}\n"
-
-    #songs    
-    code += "\n__pulp.songs = {}\n"
-    j = -1
-    for song in pulp["songs"]:
-        j += 1
-        if type(song) == bool or song is None:
-            print(f"WARNING: peculiar entry in songs table at index {j}. Expected JSON object.")
-            continue
-        code += f"__pulp.songs[#__pulp.songs + 1] = " + "{\n"
-        code += f"  bpm = {song['bpm']},\n"
-        code += f"  id = {song['id']},\n"
-        code += f"  name = \"{song['name']}\",\n"
-        code += f"  ticks = {song['ticks']},\n"
-        code += "  notes = {\n"
-        for track in song["notes"]:
-            code += "    {"
-            i = 0
-            for note in track:
-                code += f"{note}, "
-                if i % 100 == 99:
-                    code += "\n"
-                i += 1
-            code += "},\n"
-        code += "  },\n"
-        if 'voices' in song:
-            code += "  voices = {\n"
-            for voice in song['voices']:
-                if voice:
-                    code += "    {\n"
-                    if 'attack' in voice:
-                        code += f"       attack = {voice['attack']},\n"
-                    if 'decay' in voice:
-                        code += f"       decay = {voice['decay']},\n"
-                    if 'volume' in voice:
-                        code += f"       volume = {voice['volume']},\n"
-                    if 'release' in voice:
-                        code += f"       {voice['release']},\n"
-                    if 'sustain' in voice:
-                        code += f"       {voice['sustain']},\n"
-                    code += "    },\n"
-                else:
-                    code += "    {},\n"
-            code += "  },\n"
-        if "loopFrom" in song:
-            code += f"  loopFrom = {song['loopFrom']}\n,"
-        code += "}\n"
+    def write_sounds(out, sounds):
+        j = -1
+        out.write("\n__pulp.sounds = {}\n")
+        for sound in sounds:
+            j += 1
+            if type(sound) != dict or sound is None:
+                print(f"WARNING: peculiar entry in sounds table at index {j}. Expected JSON object.")
+                out.write(f"__pulp.sounds[{j}] = " + "{}\n")
+                continue
+            out.write(f"__pulp.sounds[{sound['id']}] = " + "{\n")
+            out.write(f"  bpm = {sound['bpm']},\n")
+            out.write(f"  name = \"{sound['name']}\",\n")
+            out.write(f"  type = {sound['type']},\n")
+            if 'notes' in sound:
+                out.write("  events = {")
+                out.write("".join(f"{value}, " for value in sound_events(sound['notes'])))
+                out.write("},\n")
+            if 'ticks' in sound:
+                out.write(f"  ticks = {sound['ticks']},\n")
+            if 'envelope' in sound:
+                if 'decay' in sound['envelope']:
+                    out.write(f"  decay = {sound['envelope']['decay']},\n")
+                if 'attack' in sound['envelope']:
+                    out.write(f"  attack = {sound['envelope']['attack']},\n")
+                if 'release' in sound['envelope']:
+                    out.write(f"  release = {sound['envelope']['release']},\n")
+                if 'volume' in sound['envelope']:
+                    out.write(f"  volume = {sound['envelope']['volume']},\n")
+                if 'sustain' in sound['envelope']:
+                    out.write(f"  sustain = {sound['envelope']['sustain']},\n")
+            out.write("}\n")
+
+    #songs
+    def write_songs(out, songs):
+        out.write("\n__pulp.songs = {}\n")
+        j = -1
+        for song in songs:
+            j += 1
+            if type(song) == bool or song is None:
+                print(f"WARNING: peculiar entry in songs table at index {j}. Expected JSON object.")
+                continue
+            out.write(f"__pulp.songs[#__pulp.songs + 1] = " + "{\n")
+            out.write(f"  bpm = {song['bpm']},\n")
+            out.write(f"  id = {song['id']},\n")
+            out.write(f"  name = \"{song['name']}\",\n")
+            out.write(f"  ticks = {song['ticks']},\n")
+            out.write("  events = {\n")
+            for track in song["notes"]:
+                out.write("    {")
+                events = song_events(track, song["ticks"])
+                for i in range(0, len(events), 3):
+                    out.write(f"{events[i]}, {events[i + 1]}, {events[i + 2]}, ")
+                    if i % 90 == 87:
+                        out.write("\n")
+                out.write("},\n")
+            out.write("  },\n")
+            if 'voices' in song:
+                out.write("  voices = {\n")
+                for voice in song['voices']:
+                    if voice:
+                        out.write("    {\n")
+                        if 'attack' in voice:
+                            out.write(f"       attack = {voice['attack']},\n")
+                        if 'decay' in voice:
+                            out.write(f"       decay = {voice['decay']},\n")
+                        if 'volume' in voice:
+                            out.write(f"       volume = {voice['volume']},\n")
+                        if 'release' in voice:
+                            out.write(f"       {voice['release']},\n")
+                        if 'sustain' in voice:
+                            out.write(f"       {voice['sustain']},\n")
+                        out.write("    },\n")
+                    else:
+                        out.write("    {},\n")
+                out.write("  },\n")
+            if "loopFrom" in song:
+                out.write(f"  loopFrom = {song['loopFrom']}\n,")
+            out.write("}\n")
 
     #scripts
-    for pulpscript in pulp["scripts"]:
-        if type(pulpscript) == bool:
-            print("WARNING: boolean entry in script table. Expected JSON object.")
-            continue
-        script = Script(pulpscript["id"], pulpscript["type"])
-        if "data" in pulpscript:
-            for _pass in [0, 1]:
-                for key in pulpscript["data"]:
-                    if not key.startswith("__"):
-                        assert pulpscript["data"][key][0] == "block"
-                        blockidx = pulpscript["data"][key][1]
-                        if _pass == 0:
-                            script.markHasEvent(key)
-                        elif _pass == 1:
-                            script.addEvent(key, pulpscript["data"]["__blocks"], blockidx, pulpscript["data"]["__comments"])
-        code += script.code
+    scripts = [] # (Script, has data)
+    script_stats = [] # (script name, [(event, seconds, lua bytes, eliminated)]), for --profile
+    
+    # with split, the scripts of rooms and of tiles placed in at most one room go in
+    # modules of their own -- but not the player's, nor any with [LUA] comments, which
+    # might refer to the locals in main.lua.
+    def split_script(script, effects):
+        if not split or effects["lua_names"]:
+            return False
+        if script.type == 1:
+            return True
+        return script.type == 2 and script.id != pulp["player"]["id"] and tilerooms.get(script.id, 0) <= 1
+    
+    script_modules = dict() # module path -> writer (finished once variables are written)
+    split_vars = set() # (variables used by split scripts, which can't be locals of main.lua)
+    
+    # the sounds which scripts active in the starting room play, to be built in the
+    # background as soon as the game starts (see pulp.prewarmsounds)
+    prewarm_sounds = []
+    def starts_active(script):
+        startroom = pulp["player"]["room"]
+        if script.type == 2:
+            return script.id == pulp["player"]["id"] or script.id in roomtilesets.get(startroom, ())
+        return script.type == 0 or script.id == startroom
+    
+    # `results` yields transpile_script_events() results for each script which has data.
+    def write_scripts(out, results):
+        for script, hasdata in scripts:
+            if not hasdata:
+                script.writeHeader(out, [])
+                continue
+            lua, effects, stats = next(results)
+            # (a script with [LUA] comments might define events of its own)
+            evnames = [stat[0] for stat in stats] if not effects["lua_names"] else None
+            if split_script(script, effects):
+                script.writeHeader(out, evnames, lazy=True)
+                module = script_modules[script.module + ".lua"] = CodeWriter()
+                module.write(f"{script.evobjid} = __pulp:getScript(\"{script.name}\")\n")
+                module.write(lua)
+                split_vars.update(effects["vars"])
+            else:
+                script.writeHeader(out, evnames)
+                out.write(lua)
+            if starts_active(script):
+                prewarm_sounds.extend(sid for sid in effects["sounds"] if sid not in prewarm_sounds)
+            ctx.apply_effects(effects)
+            script_stats.append((script.name, stats))
 
     # breaks mimics actually...
-    if False and len(ctx.full_mimics) > 0:
-        code += "\n-- full mimics\n"
-        code += "\n-- this loop is optional, but it can improve performance by cutting corners on mimic calls\n"
-        code += "for _=1,5 do\n"
+    def write_full_mimics(out):
+        out.write("\n-- full mimics\n")
+        out.write("\n-- this loop is optional, but it can improve performance by cutting corners on mimic calls\n")
+        out.write("for _=1,5 do\n")
         for full_mimic in ctx.full_mimics:
             evobj = full_mimic[0]
             evname = full_mimic[1]
             evtarg = full_mimic[2]
             if evname != "any":
-                code += f"__pulp:getScript(\"{evobj}\")[\"{evname}\"]" \
+                out.write(f"__pulp:getScript(\"{evobj}\")[\"{evname}\"]" \
                     + f" = __pulp:getScript(\"{evtarg}\")[\"{evname}\"] or " \
-                    + f"__pulp:getScript(\"{evtarg}\").any\n"
+                    + f"__pulp:getScript(\"{evtarg}\").any\n")
             else:
-                code += f"""
+                out.write(f"""
     for name, fn in pairs(__pulp:getScript(\"{evtarg}\")) do -- (for 'any')
         if not __pulp:getScript(\"{evobj}\")[name] and type(fn) == "function" then
             __pulp:getScript(\"{evobj}\")[name] = fn
         end
     end
-    """
-        code += "end\n"
-
-    code += "\n"
-    vars = sorted(list(ctx.vars))
-    vars.sort(key=lambda var: -ctx.var_usage.get(var, 0))
-    varcode = ""
-    LOCVARMAX = 160 # chosen rather arbitrarily. 200 is too high though; it won't compile.
-    locvars = []
-    i = 0
-    for var in vars:
-        assert not var.startswith("__"), "variables cannot start with __."
-        if "." not in var:
-            if i < LOCVARMAX and is_id(var):
+    """)
+        out.write("end\n")
+    
+    # variables
+    # the most-used variables are locals, and the rest are slots in the __VARS array,
+    # except those which [LUA] comments might use, which stay globals.
+    # returns the lua for each variable (see resolve_vars).
+    def write_vars(varout, out):
+        out.write("\n")
+        vars = sorted(list(ctx.vars))
+        vars.sort(key=lambda var: -ctx.var_usage.get(var, 0))
+        LOCVARMAX = 160 # chosen rather arbitrarily. 200 is too high though; it won't compile.
+        locvars = []
+        globalvars = []
+        slotvars = []
+        varlua = dict()
+        for var in vars:
+            assert not var.startswith("__"), "variables cannot start with __."
+            if len(locvars) < LOCVARMAX and is_id(var) and var not in split_vars:
                 # TODO: optimize local variables by usage
-                varcode += "local "
-                i += 1
+                varout.write(f"local {var} = 0\n")
                 locvars.append(var)
-            varcode += f"{var} = 0\n"
-            
-    code = varcode + "\n" + code
-
-    code += "local __LOCVARSET = {\n"
-    for var in locvars:
-        code += f"  [\"{var}\"] = function(__{var}) {var} = __{var} end,\n"
-    code += "nil}\n"
-    code += "local __LOCVARGET = {\n"
-    for var in locvars:
-        code += f"  [\"{var}\"] = function() return {var} end,\n"
-    code += "nil}\n"
-    code += "function __pulp.setvariable(varname, value)\n"
-    code += "  if varname:find(\"__\") then varname = \"__\" .. varname end -- prevent namespace conflicts with builtins\n"
-    code += "  local __varsetter = __LOCVARSET[varname]\n"
-    code += "  if __varsetter then __varsetter(value) else _G[varname] = value end\n"
-    code += "end\n"
-    code += "function __pulp.getvariable(varname)\n"
-    code += "  if varname:find(\"__\") then varname = \"__\" .. varname end -- prevent namespace conflicts with builtins\n"
-    code += "  local __vargetter = __LOCVARGET[varname]\n"
-    code += "  if __vargetter then return __vargetter() else return _G[varname] end\n"
-    code += "end\n"
-    code += "function __pulp.resetvars()\n"
-    for var in vars:
-        code += f"  {var} = 0\n"
-    code += "end\n"
+                varlua[var] = var
+            elif var in ctx.lua_names:
+                varlua[var] = sanitize_varname(var)
+                varout.write(f"{varlua[var]} = 0\n")
+                globalvars.append(var)
+            else:
+                slotvars.append(var)
+                varlua[var] = f"__VARS[{len(slotvars)}]"
+        if slotvars:
+            varout.write("local __VARS <const> = {\n")
+            for var in slotvars:
+                varout.write(f"  0, -- {var.replace(chr(10), ' ')}\n")
+            varout.write("}\n")
+            if script_modules:
+                out.write("__pulp.__VARS = __VARS -- (for modules)\n")
+        varout.write("\n")
+
+        out.write("local __LOCVARSET = {\n")
+        for var in locvars:
+            out.write(f"  [\"{var}\"] = function(__{var}) {var} = __{var} end,\n")
+        out.write("nil}\n")
+        out.write("local __LOCVARGET = {\n")
+        for var in locvars:
+            out.write(f"  [\"{var}\"] = function() return {var} end,\n")
+        out.write("nil}\n")
+        if slotvars:
+            out.write("local __VARSLOT = {\n")
+            for i, var in enumerate(slotvars):
+                out.write(f"  [\"{escape_string(var)}\"] = {i + 1},\n")
+            out.write("nil}\n")
+        out.write("function __pulp.setvariable(varname, value)\n")
+        out.write("  if varname:find(\"__\") then varname = \"__\" .. varname end -- prevent namespace conflicts with builtins\n")
+        out.write("  local __varsetter = __LOCVARSET[varname]\n")
+        if slotvars:
+            out.write("  local __varslot = __VARSLOT[varname]\n")
+            out.write("  if __varsetter then __varsetter(value) elseif __varslot then __VARS[__varslot] = value else _G[varname] = value end\n")
+        else:
+            out.write("  if __varsetter then __varsetter(value) else _G[varname] = value end\n")
+        out.write("end\n")
+        out.write("function __pulp.getvariable(varname)\n")
+        out.write("  if varname:find(\"__\") then varname = \"__\" .. varname end -- prevent namespace conflicts with builtins\n")
+        out.write("  local __vargetter = __LOCVARGET[varname]\n")
+        if slotvars:
+            out.write("  local __varslot = __VARSLOT[varname]\n")
+            out.write("  if __vargetter then return __vargetter() elseif __varslot then return __VARS[__varslot] else return _G[varname] end\n")
+        else:
+            out.write("  if __vargetter then return __vargetter() else return _G[varname] end\n")
+        out.write("end\n")
+        out.write("function __pulp.resetvars()\n")
+        for var in locvars + globalvars:
+            out.write(f"  {varlua[var]} = 0\n")
+        if slotvars:
+            out.write(f"  for __i = 1, {len(slotvars)} do __VARS[__i] = 0 end\n")
+        out.write("end\n")
+        return varlua
     
     # script tags
-    for tagname in ctx.script_tags:
-        tag = ctx.script_tags[tagname]
-        code += f"{tagname} = __pulp:getScript(\"{tag['scriptsrc']}\")[\"{tag['name']}\"]\n"
+    def write_script_tags(out):
+        for tagname in ctx.script_tags:
+            tag = ctx.script_tags[tagname]
+            out.write(f"{tagname} = __pulp:getScript(\"{tag['scriptsrc']}\")[\"{tag['name']}\"]\n")
 
-    code += endcode()
-
-    for error in list(set(ctx.errors)):
-        print("--" + str(error))
+    # section handlers; each is passed a function returning the section's value
+    # from pulp.json, which it needn't call if its result is memoized.
+    
+    halfwidth = None
+    borderimage = None
+    fontimage = None
+    frameindex = None
+    tileimages = None
+    hasalpha = None
+    
+    tile_ids = dict()
+    tilenames = [] # (for script names)
+    tilefirstframes = [] # (for the launcher card)
+    def read_tiles(load):
+        nonlocal tilesout, tile_ids, tilenames, tilefirstframes
+        def compute():
+            tiles = load()
+            out = SectionWriter()
+            ids = dict()
+            write_tiles(out, tiles, ids)
+            return out, ids, \
+                [tile["name"] if tile else None for tile in tiles], \
+                [tile["frames"][0] if tile and tile["frames"] else None for tile in tiles]
+        tilesout, tile_ids, tilenames, tilefirstframes = memoized("tiles", compute)
+    
+    roomnames = [] # (for script names)
+    cardtiles = None # (for the launcher card)
+    room_modules = dict() # module path -> writer, if split
+    roomtilesets = dict() # room id -> the ids of the tiles it starts with (see starts_active)
+    tilerooms = dict() # tile id -> number of rooms it starts in (see split_script)
+    def read_rooms(load):
+        nonlocal roomsout, roomnames, cardtiles, room_modules, roomtilesets, tilerooms
+        def compute():
+            rooms = load()
+            out = SectionWriter()
+            modules = dict() if split else None
+            write_rooms(out, rooms, modules)
+            tilesets = dict()
+            counts = dict()
+            for room in rooms:
+                if type(room) == dict:
+                    tilesets[room["id"]] = set(room["tiles"])
+                    for tid in tilesets[room["id"]]:
+                        counts[tid] = counts.get(tid, 0) + 1
+            return out, \
+                [room["name"] if type(room) == dict else None for room in rooms], \
+                rooms[pulp["card"]]["tiles"], modules or dict(), tilesets, counts
+        roomsout, roomnames, cardtiles, room_modules, roomtilesets, tilerooms = memoized("rooms", compute)
+        
+    def read_sounds(load):
+        nonlocal soundsout
+        def compute():
+            out = SectionWriter()
+            write_sounds(out, load())
+            return out
+        soundsout = memoized("sounds", compute)
+        
+    def read_songs(load):
+        nonlocal songsout
+        def compute():
+            out = SectionWriter()
+            write_songs(out, load())
+            return out
+        songsout = memoized("songs", compute)
+    
+    cacheopts = (cache_path, cache_size * 1024 * 1024) if cache_path else None
+    cache = None
+    hits = 0
+    misses = 0
+    executor = None
+    collect_scripts = None # (with --jobs, writes the scripts once everything else is done)
+    def read_scripts(load):
+        nonlocal cache, executor, collect_scripts
+        # (scripts only depend on the names and ids from the tiles and rooms sections)
+        digests["names"] = hashlib.sha1(dumps([tile_ids, tilenames, roomnames]).encode()).digest()
+        inputs, memoed = memo_get("scripts", ["scripts", "names"])
+        if memoed is not None:
+            memoscripts, errors, results = memoed
+            scripts.extend(memoscripts)
+            ctx.errors += errors
+            write_scripts(scriptsout, iter(results))
+            return
+        
+        nerrors = len(ctx.errors)
+        jobs = []
+        for pulpscript in load():
+            if type(pulpscript) == bool:
+                print("WARNING: boolean entry in script table. Expected JSON object.")
+                continue
+            script = Script(pulpscript["id"], pulpscript["type"], len(scripts) + 1)
+            data = pulpscript.get("data")
+            scripts.append((script, bool(data)))
+            if data:
+                jobs.append((script.name, script.evobjid, data))
+        errors = ctx.errors[nerrors:]
+        
+        # with --watch, scripts which are unchanged since the previous build aren't transpiled again.
+        previous = memo.get("script results", dict()) if memo is not None else dict()
+        jobkeys = [(digests["names"], hashlib.sha1(dumps(job).encode()).digest()) if memo is not None else None for job in jobs]
+        todo = [job for job, key in zip(jobs, jobkeys) if key not in previous]
+        
+        # `new_results` yields transpile_script_events() results for each job in todo.
+        def write(new_results):
+            results = (previous[key] if key in previous else next(new_results) for key in jobkeys)
+            if memo is not None:
+                results = list(results)
+                memo["script results"] = dict(zip(jobkeys, results))
+                memo_put("scripts", inputs, (list(scripts), errors, results))
+            write_scripts(scriptsout, iter(results))
+        
+        if processes > 1:
+            executor = ProcessPoolExecutor(processes, initializer=init_worker, initargs=(tile_ids, cacheopts))
+            mapped = executor.map(
+                worker_transpile_script_events, todo,
+                chunksize=max(1, len(todo) // (processes * 4))
+            )
+            def collect_scripts():
+                nonlocal hits, misses
+                with phase("scripts"):
+                    results = list(mapped)
+                    hits = sum(result[3] for result in results)
+                    misses = sum(result[4] for result in results)
+                    write(iter([result[:3] for result in results]))
+        else:
+            cache = EventCache(*cacheopts, tile_ids) if cacheopts else None
+            write(transpile_script_events(*job, tile_ids, cache) for job in todo)
+    
+    # the section handlers, the entries which must be read before each, and the
+    # phase they're timed as.
+    sections = {
+        "font": (read_font, [], "images"),
+        "frames": (read_frames, [], "images"),
+        "tiles": (read_tiles, ["frames"], "tiles"), # (tile_ids are known once tiles are read)
+        "rooms": (read_rooms, ["card"], "rooms"),
+        "scripts": (read_scripts, ["tiles", "rooms", "player"], "scripts"), # (player: see starts_active)
+        "sounds": (read_sounds, [], "audio"),
+        "songs": (read_songs, [], "audio"),
+    }
+    done = set()
+    waiting = dict() # section -> function returning its value
+    
+    # see project_entries()
+    def read_entry(key, load, defer, digest):
+        digests[key] = digest
+        if key in sections:
+            waiting[key] = load
+        else:
+            pulp[key] = load()
+            done.add(key)
+        progress = True
+        while progress:
+            progress = False
+            for section in list(waiting):
+                handler, deps, phasename = sections[section]
+                if all(dep in done for dep in deps):
+                    with phase(phasename):
+                        handler(waiting.pop(section))
+                    done.add(section)
+                    progress = True
+        if key in waiting and defer:
+            waiting[key] = defer()
+    
+    try:
+        for key, load, defer, digest in entries:
+            read_entry(key, load, defer, digest)
+        for section in sections:
+            for key in sections[section][1] + [section]:
+                if key not in done and key not in waiting:
+                    raise KeyError(key)
+        
+        frame_img = render_tile_images()
+        if collect_scripts:
+            collect_scripts()
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    
+    if cacheopts:
+        if cache:
+            hits = cache.hits
+            misses = cache.misses
+        EventCache(*cacheopts, tile_ids).prune()
+        print(f"event cache: {hits} hit(s), {misses} miss(es)")
+    if ctx.eliminated:
+        print(f"folding: {format_eliminated(ctx.eliminated)}")
+    if False and len(ctx.full_mimics) > 0:
+        write_full_mimics(out)
+    with phase("images"):
+        label_img, prelabels = render_labels(sorted(ctx.labels), fontimage, halfwidth)
+    with phase("variables"):
+        varlua = write_vars(varout, out)
+        scriptsout.transform(lambda lua: resolve_vars(lua, varlua))
+        for module in script_modules.values():
+            module.transform(lambda lua: resolve_vars(lua, varlua))
+        slots = any(lua.startswith("__VARS[") for lua in varlua.values())
+        modules = dict(room_modules)
+        for path, module in script_modules.items():
+            modules[path] = CodeWriter()
+            modules[path].write("local __pulp <const> = ___pulp\n")
+            modules[path].write(RUNTIME_LOCALS)
+            if slots:
+                modules[path].write("local __VARS <const> = __pulp.__VARS\n")
+            modules[path].write("local __script <const> = {}\n")
+            modules[path].write(module.getvalue())
+        vartables = len(out.getvalue().encode()) if profile else 0
+        write_script_tags(out)
+    out.write(endcode())
+    headout.write(startcode())
+    ctx.ext_pdxinfo = {**pdxinfo_defaults(), **ctx.ext_pdxinfo}
 
-    # output
-    if not os.path.isdir(outpath):
-        os.mkdir(outpath)
-    with open(os.path.join(outpath, "main.lua"), "w") as f:
-        f.write(code)
-    shutil.copy("pulp.lua", outpath)
-    shutil.copy("pulp-audio.lua", outpath)
-    frame_img.save(os.path.join(outpath, "tiles-table-8-8.png"))
-    borderimage.save(os.path.join(outpath, "pipe-table-8-8.png"))
-    fontimage.save(os.path.join(outpath, "font-table-8-8.png"))
-    print(f"files written to {outpath}")
-
-    # create path for launcher assets
-    launcher_path = "launcher/"
-    if not os.path.isdir(os.path.join(outpath,launcher_path)):
-        os.mkdir(os.path.join(outpath, launcher_path))
-
-    # create pdxinfo file
-    with open(os.path.join(outpath, "pdxinfo"), "w") as f:
-        f.write("name=" + ctx.ext_pdxinfo["name"] + str('\n'))
-        f.write("author=" + ctx.ext_pdxinfo["author"] + str('\n'))
-        f.write("description=" + ctx.ext_pdxinfo["description"] + str('\n'))
-        f.write("bundleID=" + ctx.ext_pdxinfo["bundleID"] + \
-            str('\n'))
-        f.write("version=" + str(ctx.ext_pdxinfo["version"]) + str('\n'))
-        f.write("imagePath=" + ctx.ext_pdxinfo["imagePath"] + "\n")
-        f.write("launchSoundPath=" + ctx.ext_pdxinfo["launchSoundPath"] + "\n")
-        if len(ctx.ext_pdxinfo["contentWarning"]) > 0:
-            f.write("contentWarning=" + ctx.ext_pdxinfo["contentWarning"] + "\n")
-        if len(ctx.ext_pdxinfo["contentWarning2"]) > 0:
-            f.write("contentWarning2=" + ctx.ext_pdxinfo["contentWarning2"] + "\n")
-    print(f"pdxinfo saved to {outpath}")
+    # pdxinfo file
+    pdxinfo = CodeWriter()
+    pdxinfo.write("name=" + ctx.ext_pdxinfo["name"] + str('\n'))
+    pdxinfo.write("author=" + ctx.ext_pdxinfo["author"] + str('\n'))
+    pdxinfo.write("description=" + ctx.ext_pdxinfo["description"] + str('\n'))
+    pdxinfo.write("bundleID=" + ctx.ext_pdxinfo["bundleID"] + \
+        str('\n'))
+    pdxinfo.write("version=" + str(ctx.ext_pdxinfo["version"]) + str('\n'))
+    pdxinfo.write("imagePath=" + ctx.ext_pdxinfo["imagePath"] + "\n")
+    pdxinfo.write("launchSoundPath=" + ctx.ext_pdxinfo["launchSoundPath"] + "\n")
+    if len(ctx.ext_pdxinfo["contentWarning"]) > 0:
+        pdxinfo.write("contentWarning=" + ctx.ext_pdxinfo["contentWarning"] + "\n")
+    if len(ctx.ext_pdxinfo["contentWarning2"]) > 0:
+        pdxinfo.write("contentWarning2=" + ctx.ext_pdxinfo["contentWarning2"] + "\n")
 
     # generates launcher card from Pulpscript JSON and tilesheet
-    def generate_launcher_card(pulp_json, tilesheet):
+    def generate_launcher_card(tilesheet):
         print("Generating launcher card...")
         
         # initialize launcher image
         launcher_image = Image.new("LA", (200, 120)) # create image sized to pulp resolution
         
         # locate launcher card info in pulp json can be found in the n-th element of the "rooms" array, where n is the value specified in the "card" key	 
-        print(f"launcher card room name: {pulp_json['rooms'][pulp_json['card']]['name']}")
-        launcher_card_tiles = pulp_json["rooms"][pulp_json["card"]]["tiles"]
+        print(f"launcher card room name: {roomnames[pulp['card']]}")
+        launcher_card_tiles = cardtiles
         
         # populate launcher card image with tiles
+        tile_crops = dict()
         tile_counter = 0
         for y in range(15):
             for x in range(25):
@@ -527,14 +1373,15 @@ math.randomseed(playdate.getSecondsSinceEpoch())
                 tile_num = launcher_card_tiles[tile_counter]
             
                 # get first frame of specified tile
-                frame_number = pulp_json["tiles"][tile_num]["frames"][0]
+                frame_number = tilefirstframes[tile_num]
                 
                 # get the number of the unique image list (necessary since the code is removing duplicate tiles from the tiles list)
-                h = hash(tuple( pulp_json["frames"][frame_number]["data"] ))
-                image_map_number = uniqueimagehashmap[h]      
+                image_map_number = frameindex.slot(frame_number)
                 
                 # get tile from tilesheet
-                tile = tilesheet.crop((0, image_map_number * 8, 8, image_map_number * 8 + 8)) # (left, upper, right, lower)
+                if image_map_number not in tile_crops:
+                    tile_crops[image_map_number] = tilesheet.crop((0, image_map_number * 8, 8, image_map_number * 8 + 8)) # (left, upper, right, lower)
+                tile = tile_crops[image_map_number]
                 
                 # add tile to launcher card image at (x,y)
                 launcher_image.paste(im=tile, box=(x*8, y*8))
@@ -557,15 +1404,83 @@ math.randomseed(playdate.getSecondsSinceEpoch())
         cropped_corners.rounded_rectangle([0, 0, 349, 154], radius=8, fill=255, outline=0, width=0)
         cropped_card.putalpha(alpha_boarder)
         
-        # save launcher image to  file
-        launcher_card_path = os.path.join(outpath, launcher_path, "card.png")    
-        cropped_card.save( launcher_card_path, "PNG" )
-        print(f"launcher card saved to {launcher_card_path}")
+        return cropped_card
+
+    with phase("images"):
+        launcher_card = memoized("launcher card",
+            lambda: generate_launcher_card(frame_img), ["card", "rooms", "tiles", "frames"])
+
+    return BuildArtifacts(
+        [varout, headout, tilesout, roomsout, soundsout, songsout, scriptsout, out],
+        {
+            "tiles-table-8-8.png": frame_img,
+            "pipe-table-8-8.png": borderimage,
+            "font-table-8-8.png": fontimage,
+            **({"labels.png": label_img} if prelabels else {}),
+            os.path.join(LAUNCHER_PATH, "card.png"): launcher_card,
+        },
+        pdxinfo.getvalue(),
+        list(set(ctx.errors)),
+        phase.times,
+        modules,
+        BuildProfile(phase.times, phase.allocations, script_stats, {
+            "variables": len(varout.getvalue().encode()) + vartables,
+            "header": len(headout.getvalue().encode()),
+            "tiles": len(tilesout.getvalue().encode()),
+            "rooms": len(roomsout.getvalue().encode()),
+            "sounds": len(soundsout.getvalue().encode()),
+            "songs": len(songsout.getvalue().encode()),
+            "scripts": len(scriptsout.getvalue().encode()),
+            "footer": len(out.getvalue().encode()) - vartables,
+        }, ctx.eliminated) if profile else None
+    )
 
+def main(args):
+    parser = argparse.ArgumentParser(prog="python3 " + args[0])
+    parser.add_argument("file", metavar="pulp.json")
+    parser.add_argument("outpath", metavar="out/", nargs="?", default="out")
+    parser.add_argument("--cache", metavar="DIR", default=None,
+        help="reuse transpiled events from previous builds, stored in DIR")
+    parser.add_argument("--cache-size", metavar="MB", type=int, default=64,
+        help="maximum size of the event cache (default: 64)")
+    parser.add_argument("--jobs", "-j", metavar="N", type=int, default=1,
+        help="transpile scripts in N worker processes (default: 1)")
+    parser.add_argument("--stream", action="store_true",
+        help="read pulp.json one section at a time, to reduce memory use on large projects")
+    parser.add_argument("--watch", action="store_true",
+        help="keep running, and rebuild whenever pulp.json changes")
+    parser.add_argument("--profile", action="store_true",
+        help="report the time and memory of each phase, the slowest scripts and events, and the size of each part of main.lua")
+    parser.add_argument("--profile-dump", metavar="FILE", default=None,
+        help="write cProfile statistics for the build to FILE (see python3 -m pstats)")
+    parser.add_argument("--split", action="store_true",
+        help="put rooms, and the scripts of rooms and rarely placed tiles, in modules loaded when they're first needed")
+    opts = parser.parse_args(args[1:])
+
+    if opts.watch:
+        try:
+            watch(opts.file, opts.outpath, opts.cache, opts.cache_size, opts.jobs, profile=opts.profile, split=opts.split)
+        except KeyboardInterrupt:
+            pass
+        return
 
-    # generate launcher card
-    generate_launcher_card(pulp, frame_img)
+    profiler = None
+    if opts.profile_dump:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    artifacts = transpile_file(opts.file, opts.cache, opts.cache_size, opts.jobs, opts.stream, opts.profile, opts.split)
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(opts.profile_dump)
+        print(f"cProfile statistics written to {opts.profile_dump}")
+    
+    for error in artifacts.errors:
+        print("--" + str(error))
 
+    artifacts.save(opts.outpath)
+    if opts.profile:
+        print(artifacts.profile.report())
     print("build complete")
 
 if __name__ == '__main__':
@@ -5,9 +5,13 @@
 import re
 
 RELASSIGN = True # allow relative assignment in lua, e.g. `x += 1`
+FOLD = True # fold constant conditions and expressions, and drop code which can never run
+PIX8SCALE = 1 # (pulp.pix8scale, which is 1 since tiles-table-8-8.png always has 8x8 tiles)
+
+IDENTIFIER = re.compile(r'^[a-zA-Z_]\w*$')
 
 def is_id(varname):
-    return re.match(r'^[a-zA-Z_]\w*$', varname) is not None
+    return IDENTIFIER.match(varname) is not None
 
 def sanitize_varname(varname):
     if is_id(varname):
@@ -15,12 +19,73 @@ def sanitize_varname(varname):
     varname = varname.replace('"', '\\"')
     return f"_G[\"{varname}\"]"
 
-class PulpScriptContext:
+# variables are referred to as VARREF + name + VARREF in the lua for events, since
+# where each is stored (a local, a slot in __VARS, or a global) is only decided
+# once every script has been transpiled; resolve_vars() then puts in the lua for each.
+# each function also starts with VARREF + "*" + indent + the variables it uses + VARREF,
+# which becomes a local alias of __VARS if any of them are in it.
+VARREF = "\0"
+VARSEP = "\1"
+VARSLOT = "__VARS["
+
+def resolve_vars(lua, varlua):
+    if VARREF not in lua:
+        return lua
+    parts = lua.split(VARREF)
+    for i in range(1, len(parts), 2):
+        name = parts[i]
+        if name[0] != "*":
+            parts[i] = varlua[name]
+        else:
+            names = name[1:].split(VARSEP)
+            slots = any(varlua[name].startswith(VARSLOT) for name in names[1:])
+            parts[i] = names[0] + "local __VARS <const> = __VARS\n" if slots else ""
+    return "".join(parts)
+
+# accumulates generated lua code as a list of chunks rather than one growing
+# string, so that emitting n pieces of code costs O(n) instead of O(n^2).
+class CodeWriter:
     def __init__(self):
+        self.chunks = []
+        
+    def write(self, s):
+        self.chunks.append(s)
+    
+    # reserves a chunk to be filled in later with fill() (e.g. funccache lines,
+    # which are only known after the rest of the function has been transpiled)
+    def reserve(self):
+        self.chunks.append("")
+        return len(self.chunks) - 1
+    
+    def fill(self, slot, s):
+        self.chunks[slot] = s
+        
+    def extend(self, other):
+        self.chunks += other.chunks
+        
+    # replaces the code with f(code), chunk by chunk.
+    def transform(self, f):
+        self.chunks = [f(chunk) for chunk in self.chunks]
+        
+    def writeto(self, f):
+        f.writelines(self.chunks)
+        
+    def getvalue(self):
+        return "".join(self.chunks)
+
+class PulpScriptContext:
+    def __init__(self, tile_ids=None):
         self.indent = 1
+        
+        # tile name -> id, for replacing name literals with ids
+        self.tile_ids = tile_ids if tile_ids is not None else dict()
         self.errors = []
         self.vars = set()
         self.var_usage = {}
+        self.lua_names = set() # (names used by [LUA] comments)
+        self.sounds = set() # (the sounds played by name or id, for prewarming)
+        self.labels = set() # (the text of labels drawn at build time; see build_label)
+        self.dialog = set() # (text, w, h) of say and ask, for paginating at build time
         self.full_mimics = []
         
         # cache these at the start of each function
@@ -35,6 +100,18 @@ class PulpScriptContext:
         # manual script target optimization
         self.script_tags = dict()
         
+        # the blocks of the script being transpiled, and their nodes (see block_nodes)
+        self.blocks = None
+        self.nodes = dict()
+        self.dead = dict() # block index -> nodes removed by fold_block
+        self.folds = dict() # block index -> {kind: count} of what folding removed from it
+        self.folding = dict() # (the counts for the block being built)
+        self.nodes_source = None # (blocks, comments) the nodes were built from
+        self.raw_lua = False # (if the script has [LUA] comments, no code is removed)
+        
+        # what folding removed from the blocks transpiled: kind -> count
+        self.eliminated = dict()
+        
     def push_funccache(self):
         self.funccache.append(set())
         
@@ -49,6 +126,65 @@ class PulpScriptContext:
         }
         return san_name
     
+    # everything that transpiling an event can add to the context.
+    # begin_effects() swaps these out for empty containers, so that end_effects()
+    # can report what a single event added (e.g. to be stored by eventcache.py)
+    # before merging it back in with apply_effects().
+    def begin_effects(self):
+        saved = (self.vars, self.var_usage, self.lua_names, self.sounds, self.labels, self.dialog,
+            self.errors, self.full_mimics, self.script_tags, self.ext_pdxinfo, self.ext_ptl, self.eliminated)
+        self.eliminated = dict()
+        self.lua_names = set()
+        self.sounds = set()
+        self.labels = set()
+        self.dialog = set()
+        self.vars = set()
+        self.var_usage = {}
+        self.errors = []
+        self.full_mimics = []
+        self.script_tags = dict()
+        self.ext_pdxinfo = dict()
+        self.ext_ptl = dict()
+        return saved
+
+    def end_effects(self, saved):
+        effects = {
+            "vars": sorted(list(self.vars)),
+            "var_usage": self.var_usage,
+            "lua_names": sorted(list(self.lua_names)),
+            "sounds": sorted(list(self.sounds), key=str),
+            "labels": sorted(list(self.labels)),
+            "dialog": [list(dialog) for dialog in sorted(self.dialog, key=str)],
+            "errors": self.errors,
+            "full_mimics": [list(full_mimic) for full_mimic in self.full_mimics],
+            "script_tags": [[name, tag] for name, tag in self.script_tags.items()],
+            "ext_pdxinfo": self.ext_pdxinfo,
+            "ext_ptl": self.ext_ptl,
+            "eliminated": self.eliminated,
+        }
+        self.vars, self.var_usage, self.lua_names, self.sounds, self.labels, self.dialog, \
+            self.errors, self.full_mimics, self.script_tags, self.ext_pdxinfo, self.ext_ptl, self.eliminated = saved
+        self.apply_effects(effects)
+        return effects
+
+    def apply_effects(self, effects):
+        self.vars.update(effects["vars"])
+        for var, count in effects["var_usage"].items():
+            self.var_usage[var] = self.var_usage.get(var, 0) + count
+        self.lua_names.update(effects["lua_names"])
+        self.sounds.update(effects["sounds"])
+        self.labels.update(effects["labels"])
+        self.dialog.update(tuple(dialog) for dialog in effects["dialog"])
+        self.errors += effects["errors"]
+        self.full_mimics += [tuple(full_mimic) for full_mimic in effects["full_mimics"]]
+        for name, tag in effects["script_tags"]:
+            if name not in self.script_tags:
+                self.script_tags[name] = tag
+        self.ext_pdxinfo.update(effects["ext_pdxinfo"])
+        self.ext_ptl.update(effects["ext_ptl"])
+        for kind, count in effects["eliminated"].items():
+            self.eliminated[kind] = self.eliminated.get(kind, 0) + count
+
     def pop_funccache(self):
         self.funccache = self.funccache[:-1]
     
@@ -79,10 +215,9 @@ class PulpScriptContext:
             # starts with two underscores.
             varname = "__" + varname
         
-        varname = sanitize_varname(varname)
-        
         self.vars.add(varname)
-        return varname
+        self.get_funccache().add(VARREF + varname)
+        return VARREF + varname + VARREF
         
         
     # get-indent.
@@ -109,7 +244,7 @@ compdict = {
     "neq": "~=",
 }
 
-funclist = [
+funclist = {
     "goto",
     "shake",
     "fin",
@@ -143,10 +278,10 @@ funclist = [
     "window",
     "crop",
     "play",
-]
+}
 
 # functions which can be used in expressions
-exfuncs = [
+exfuncs = {
     "type",
     "id",
     "solid",
@@ -164,16 +299,23 @@ exfuncs = [
     "radians",
     "lpad", # args: (string, width, [padsymbol])
     "rpad", # args: (string, width, [padsymbol])
-]
+}
+
+FILLRECT = "__fillrect({0}, {1}, {2}, {3})" if PIX8SCALE == 1 else \
+    "__fillrect({0} * __pix8scale, {1} * __pix8scale, {2} * __pix8scale, {3} * __pix8scale)"
+
+# pulp colour -> lua constant (see startcode in pulplua.py)
+fillcolours = {
+    "black": "__kColorBlack",
+    "white": "__kColorWhite",
+}
 
 inlinefuncs = {
-    "__fn_frame": "{0}.frame = {1}",
     "__fn_inc": "{0} += 1",
     "__fn_dec": "{0} -= 1",
     "__fn_log": "__print({0})",
-    # OPTIMIZE: we can hardcode in __pix8scale to improve performance. __pix8scale is usually 1!
-    # OPTIMIZE: we can probably perform the color decision at compile-time in most cases
-    "__fn_fill": "__setcolour(__fillcolours[{4}]); __fillrect({0} * __pix8scale, {1} * __pix8scale, {2} * __pix8scale, {3} * __pix8scale)",
+    # (literal colours are looked up at build time; see build_fill)
+    "__fn_fill": "__setcolour(__fillcolours[{4}]); " + FILLRECT,
     "__ex_frame": "({0}.frame or 0)",
     "__ex_invert": "(__pulp.invert and 1 or 0)",
     "__ex_degrees": "({0} * 360 / __tau)",
@@ -218,6 +360,7 @@ staticfuncs = {
 # adds backslashes
 def escape_string(s):
     return s.replace("\\","\\\\") \
+        .replace("\0", "\\0") \
         .replace("\n", "\\n") \
         .replace("\f", "\\f") \
         .replace("\"", "\\\"")
@@ -236,379 +379,831 @@ def istoken(s):
         return False
     return True
 
-tile_ids = dict() # populated in pulplua.py
-
-def optimize_name_ref(cmd, idx):
-    if len(cmd) > idx:
-        if type(cmd[idx]) == str and cmd[idx] in tile_ids:
-            cmd[idx] = [
-                "optimized-id",
-                tile_ids[cmd[idx]],
-                cmd[idx]
-            ]
-            return True
-    return False
-    
-def remap_special_varname(varname, ctx):
-    # these require special caching behaviour per-function
-    # note that they cannot be set (op_set), so we don't need to consider them there.
-    if varname == "event.px":
-        ctx.get_funccache().add("local __event_px = __pulp.player.x")
-        return "__event_px"
-    elif varname == "event.py":
-        ctx.get_funccache().add("local __event_py = __pulp.player.y")
-        return "__event_py"
-    elif varname == "event.x":
-        ctx.get_funccache().add("local __event_x = __actor.x or __pulp.player.x")
-        return "__event_x"
-    elif varname == "event.y":
-        ctx.get_funccache().add("local __event_y = __actor.y or __pulp.player.y")
-        return "__event_y"
-    elif varname == "event.dx":
-        ctx.get_funccache().add("local __event_dx = event.dx or 0")
-        return "__event_dx"
-    elif varname == "event.dy":
-        ctx.get_funccache().add("local __event_dy = event.dy or 0")
-        return "__event_dy"
-    elif varname == "event.tile":
-        ctx.get_funccache().add("local __event_tile = __actor.name or 0")
-        return "__event_tile"
-    elif varname == "event.room":
-        return "event.room.name"
-    elif varname == "event.player":
-        return "__pulp.player.name"
-    elif varname == "datetime.year":
-        return "__getTime().year"
-    elif varname == "datetime.year99":
-        return "--[[(year99)]] (__getTime().year % 100)"
-    elif varname == "datetime.month":
-        return "__getTime().month"
-    elif varname == "datetime.day":
-        return "__getTime().day"
-    elif varname == "datetime.weekday":
-        return "(__getTime().weekday - 1)"
-    elif varname == "datetime.day":
-        return "__getTime().day"
-    elif varname == "datetime.hour":
-        return "__getTime().hour"
-    elif varname == "datetime.hour12":
-        return "--[[(hour12)]] ((__getTime().hour % 12) + 1)"
-    elif varname == "datetime.minute":
-        return "__getTime().minute"
-    elif varname == "datetime.second":
-        return "__getTime().second"
-    elif varname == "datetime.millisecond": #note: pulp-to-lua extension
-        return "__getTime().millisecond --[[(PTL-only?)]]"
-    elif varname == "datetime.ampm":
-        return "--[[(ampm)]] (__getTime().hour < 12 and \"am\" or \"pm\")"
-    elif varname == "datetime.AMPM": #note: pulp-to-lua extension
-        return "--[[(AMPM)]] (__getTime().hour < 12 and \"AM\" or \"PM\")  --[[(PTL-only?)]]"
-    elif varname == "datetime.timestamp":
-        return "__getSecondsSinceEpoch()"
-    elif varname == "__PTLE_SMOOTH_MOVEMENT_SPEED":
-        return "__pulp.PTLE_SMOOTH_MOVEMENT_SPEED"
-    elif varname == "__PTLE_SMOOTH_OFFSET_X":
-        return "__pulp.PTLE_SMOOTH_OFFSET_X"
-    elif varname == "__PTLE_SMOOTH_OFFSET_Y":
-        return "__pulp.PTLE_SMOOTH_OFFSET_Y"
-    elif varname == "__PTLE_CONFIRM_DAS":
-        return "__pulp.PTLE_CONFIRM_DAS"
-    elif varname == "__PTLE_CANCEL_DAS":
-        return "__pulp.PTLE_CANCEL_DAS"
-    elif varname == "__PTLE_V_DAS":
-        return "__pulp.PTLE_V_DAS"
-    elif varname == "__PTLE_H_DAS":
-        return "__pulp.PTLE_H_DAS"
-    
-    return varname
+# PulpScript IR.
+#
+# each block of commands in pulp.json is converted once into these nodes (see
+# block_nodes), resolving everything that is known at build time: literals are
+# rendered to lua, tile names to ids, comment tags to the commands they apply to.
+# the nodes are then lowered to lua by the functions in `lowerers`, looked up by
+# node type. nothing here modifies the blocks from pulp.json.
 
-def ex_get(expression, ctx):
-    return remap_special_varname(ctx.pingvar(expression[1]), ctx)
-    
-    
-def ex_format(expression, ctx):
-    s = ""
-    first = True
-    for component in expression[1:]:
-        if not first:
-            s += " .. "
-        first = False
-        if type(component) is str:
-            s += decode_rvalue(component, ctx)
-        else:
-            s += "__tostring(" + decode_rvalue(component, ctx) + ")"
-            
-    return s
+# expressions
 
-def ex_embed(expression, ctx):
-    return f"__pulp.__ex_embed({decode_rvalue(expression[1], ctx)})"
+class Literal:
+    __slots__ = ["lua", "value"]
+    def __init__(self, lua, value=None):
+        self.lua = lua
+        self.value = value # (the python value, if it can be folded)
 
-def ex_subroutine(expression, ctx):
-    s = "function(__actor, event, evname)\n"
-    ctx.indent += 2
-    s += transpile_commands(ctx.blocks[expression[1]], ctx, True)
-    ctx.indent -= 2
-    return s + ctx.gi() + "  end"
-    
-def ex_name(expression, ctx):
-    if type(expression[1]) == list and expression[1][0] == "xy":
-        x = decode_rvalue(expression[1][1], ctx)
-        y = decode_rvalue(expression[1][2], ctx)
-        #return f"(((__roomtiles[{y}] or __pulp.EMPTY)[{x}] or __pulp.EMPTY).tile or __pulp.EMPTY).name or \"\""
-        return f"__roomtiles[{y}][{x}].name"
-    else:
-        return opex_func(expression, "name", "__ex_", ctx)
+# a tile name which has been replaced by its id
+class OptimizedId:
+    __slots__ = ["lua", "name"]
+    def __init__(self, id, name):
+        self.lua = f"--[[({name})]] {id}"
+        self.name = name
+
+class Get:
+    __slots__ = ["name"]
+    def __init__(self, name):
+        self.name = name
+
+class Format:
+    __slots__ = ["parts"] # [(node, whether it's converted with __tostring)]
+    def __init__(self, parts):
+        self.parts = parts
+
+class Embed:
+    __slots__ = ["value"]
+    def __init__(self, value):
+        self.value = value
+
+# name x,y
+class NameAt:
+    __slots__ = ["x", "y"]
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+# a block passed as an argument (e.g. "tell ... to" or "wait ... then")
+class Subroutine:
+    __slots__ = ["block"]
+    def __init__(self, block):
+        self.block = block
+
+# a function, used either as a command (prefix "__fn_") or in an expression (prefix "__ex_").
+# args are in the order they're passed, with the arguments in funcargs first.
+class Func:
+    __slots__ = ["op", "args", "unused", "inline", "call", "asset"]
+    def __init__(self, op, args, unused, inline, call, asset=None):
+        self.op = op
+        self.args = args
+        self.unused = unused # (arguments which aren't passed, but are still lowered)
+        self.inline = inline # (template from inlinefuncs)
+        self.call = call # (otherwise, e.g. "__pulp.__fn_say(")
+        self.asset = asset # (e.g. ("sounds", "jump"), added to ctx.sounds when lowered)
+
+class UnknownExpression:
+    __slots__ = ["code"]
+    def __init__(self, code):
+        self.code = code
+
+# commands
+
+class Done:
+    __slots__ = []
+
+class Set:
+    __slots__ = ["name", "operator", "value"]
+    def __init__(self, name, operator, value):
+        self.name = name
+        self.operator = operator
+        self.value = value
 
-def decode_rvalue(expression, ctx):
-    if type(expression) == str:
-        return '"' + escape_string(str(expression)) + '"'
-    elif type(expression) == int or type(expression) == float:
-        return str(expression)
+class Inc:
+    __slots__ = ["name", "operator"]
+    def __init__(self, name, operator):
+        self.name = name
+        self.operator = operator # "+=1" or "-=1"
+
+class Random:
+    __slots__ = ["args"]
+    def __init__(self, args):
+        self.args = args
+
+# if/while/elseif
+class Branch:
+    __slots__ = ["statement", "follow", "end", "compsym", "left", "right", "block", "followups"]
+    def __init__(self, statement, follow, end, compsym, left, right, block, followups):
+        self.statement = statement
+        self.follow = follow
+        self.end = end
+        self.compsym = compsym
+        self.left = left
+        self.right = right
+        self.block = block
+        self.followups = followups # Branch (elseif) or Else
+
+class Else:
+    __slots__ = ["block"]
+    def __init__(self, block):
+        self.block = block
+
+# a branch which is always taken (see fold_block)
+class DoBlock:
+    __slots__ = ["block"]
+    def __init__(self, block):
+        self.block = block
+
+# a while loop whose condition is always true
+class Forever:
+    __slots__ = ["block"]
+    def __init__(self, block):
+        self.block = block
+
+class Call:
+    __slots__ = ["name", "value", "tags"]
+    def __init__(self, name, value, tags):
+        self.name = name # (if the function name is a token)
+        self.value = value # (otherwise)
+        self.tags = tags
+
+class Emit:
+    __slots__ = ["value"]
+    def __init__(self, value):
+        self.value = value
+
+class Mimic:
+    __slots__ = ["target", "static"]
+    def __init__(self, target, static):
+        self.target = target
+        self.static = static # (target is a tile id)
+
+# tell x,y to
+class TellAt:
+    __slots__ = ["x", "y", "block"]
+    def __init__(self, x, y, block):
+        self.x = x
+        self.y = y
+        self.block = block
+
+# tell event.room/event.game/event.player to
+class TellEvent:
+    __slots__ = ["target", "block"]
+    def __init__(self, target, block):
+        self.target = target
+        self.block = block
+
+class Tell:
+    __slots__ = ["func"]
+    def __init__(self, func):
+        self.func = func
+
+class Comment:
+    __slots__ = ["index", "prevline"]
+    def __init__(self, index, prevline):
+        self.index = index
+        self.prevline = prevline
+
+class UnknownCommand:
+    __slots__ = ["op"]
+    def __init__(self, op):
+        self.op = op
+
+# building nodes
+
+# literal nodes can't be modified, so each string or int has one, shared by every block.
+literals = dict() # (type, value) -> Literal
+LITERALSMAX = 1 << 16
+NIL = Literal("nil")
+
+def build_literal(expression):
+    key = (type(expression), expression)
+    node = literals.get(key)
+    if node is None:
+        if len(literals) >= LITERALSMAX:
+            literals.clear()
+        node = literals[key] = Literal('"' + escape_string(expression) + '"' if key[0] is str else str(expression), expression)
+    return node
+
+def build_expression(expression, ctx):
+    t = type(expression)
+    if t is str or t is int:
+        return literals.get((t, expression)) or build_literal(expression)
+    elif t is float:
+        return Literal(str(expression), expression)
     elif expression is None:
-        return "nil"
-    else:
-        ex = expression[0]
-        if ex == "get":
-            return ex_get(expression, ctx)
-        elif ex == "optimized-id":
-            return f"--[[({expression[2]})]] "+str(expression[1])
-        elif ex == "format":
-            return ex_format(expression, ctx)
-        elif ex == "embed":
-            return ex_embed(expression, ctx)
-        elif ex == "name":
-            return ex_name(expression, ctx)
-        elif ex in exfuncs:
-            return opex_func(expression, ex, "__ex_", ctx)
-        elif ex == "block":
-            return ex_subroutine(expression, ctx)
+        return NIL
+    ex = expression[0]
+    builder = expression_builders.get(ex)
+    if builder:
+        return builder(expression, ctx)
+    elif ex in exfuncs:
+        return build_func(expression, ex, "__ex_", ctx)
+    return UnknownExpression(ex)
+
+# the tile name at cmd[idx] is replaced by its id, if it is one.
+def build_name_ref(cmd, idx, ctx):
+    if type(cmd[idx]) == str and cmd[idx] in ctx.tile_ids:
+        return OptimizedId(ctx.tile_ids[cmd[idx]], cmd[idx])
+    return build_expression(cmd[idx], ctx)
+
+def build_format(expression, ctx):
+    node = Format([(build_expression(component, ctx), type(component) is not str) for component in expression[1:]])
+    return fold_format(node, ctx) if FOLD and not ctx.raw_lua else node
+
+def build_name(expression, ctx):
+    if type(expression[1]) == list and expression[1][0] == "xy":
+        return NameAt(build_expression(expression[1][1], ctx), build_expression(expression[1][2], ctx))
+    return build_func(expression, "name", "__ex_", ctx)
+
+# values of funcargs which aren't given
+defaultargs = {
+    "actor": Literal("__actor"),
+    "event": Literal("event"),
+    "evname": Literal("__evname"),
+}
+
+# arguments which set funcargs rather than being passed in order
+namedargs = {
+    "xy": ["x", "y"],
+    "rect": ["x", "y", "w", "h"], # (h is optional; pulp game 'Monitor Duty' needs this guard)
+    "block": ["block"], # e.g. "then" or "to"
+}
+
+# prefix -> op -> ({funcargs name: index}, default args, inline template, call)
+funcinfo = {"__fn_": dict(), "__ex_": dict()}
+
+def get_funcinfo(prefix, op):
+    argnames = funcargs.get(op, [])
+    info = (
+        {name: i for i, name in enumerate(argnames)},
+        [defaultargs.get(name, NIL) for name in argnames],
+        inlinefuncs.get(prefix + op),
+        staticfuncs[op] + "(" if op in staticfuncs else f"__pulp.{prefix}{op}(",
+    )
+    funcinfo[prefix][op] = info
+    return info
+
+NOTHING = ()
+
+def build_func(cmd, op, prefix, ctx):
+    argindex, defaults, inline, call = funcinfo[prefix].get(op) or get_funcinfo(prefix, op)
+    args = defaults
+    mainargs = []
+    unused = NOTHING
+    for arg in cmd[1:]:
+        names = namedargs.get(arg[0]) if type(arg) == list else None
+        if names is None:
+            mainargs.append(build_expression(arg, ctx))
+            continue
+        if args is defaults:
+            args = list(defaults)
+            unused = []
+        if names[0] == "block":
+            values = [Subroutine(arg[1])]
         else:
-            ctx.errors += ["unknown expression code: " + ex]
-            return f"nil --[[unknown expression code '{ex}']]"
-
-def op_set(cmd, operator, ctx):
-    lvalue = cmd[1]
-    assert (type(lvalue) == str)
-    lvalue = ctx.pingvar(lvalue)
-    rvalue = decode_rvalue(cmd[2], ctx)
-    if operator == "" or RELASSIGN:
-        return f"{lvalue} {operator}= {rvalue}"
-    else:
-        return f"{lvalue} = {lvalue} {operator} {rvalue}"
+            values = [build_expression(value, ctx) for value in arg[1:len(names) + 1]]
+        for name, value in zip(names, values):
+            i = argindex.get(name)
+            if i is None:
+                unused.append(value)
+            else:
+                if args[i] is not defaults[i]:
+                    unused.append(args[i])
+                args[i] = value
+    return Func(op, args + mainargs, unused, inline, call)
+
+expression_builders = {
+    "get": lambda expression, ctx: Get(expression[1]),
+    "optimized-id": lambda expression, ctx: OptimizedId(expression[1], expression[2]),
+    "format": build_format,
+    "embed": lambda expression, ctx: Embed(build_expression(expression[1], ctx)),
+    "name": build_name,
+    "block": lambda expression, ctx: Subroutine(expression[1]),
+}
+
+def build_set(cmd, operator, ctx):
+    assert (type(cmd[1]) == str)
+    return Set(cmd[1], operator, build_expression(cmd[2], ctx))
+
+# fill with a literal colour sets the colour directly, and not at all if the
+# previous command in the block was a fill of the same colour (see block_nodes).
+def build_fill(cmd, ctx):
+    node = build_func(cmd, "fill", "__fn_", ctx)
+    colour = fill_colour(node)
+    if colour:
+        node.inline = f"__setcolour({colour}); " + FILLRECT
+    return node
+
+def build_sound(cmd, ctx):
+    node = build_func(cmd, "sound", "__fn_", ctx)
+    if len(cmd) > 1 and type(cmd[1]) in [str, int]:
+        node.asset = ("sounds", cmd[1])
+    return node
+
+# a label whose text, length and lines are all literals is drawn into the labels
+# image at build time (see render_labels in pulplua.py), cut to its length and lines
+# as pulp.__fn_label would cut it, and drawn from there by pulp.__fn_prelabel.
+# (text with embedded tiles, or other bytes above 0x7f, is still drawn at runtime.)
+def build_label(cmd, ctx):
+    node = build_func(cmd, "label", "__fn_", ctx)
+    if len(node.args) != 5:
+        return node
+    x, y, length, lines, text = node.args
+    if type(text) is not Literal or type(text.value) is not str or any(ord(c) >= 0x80 for c in text.value):
+        return node
+    if any(arg is not NIL and (type(arg) is not Literal or type(arg.value) is not int) for arg in [length, lines]):
+        return node
+    text = text.value
+    if length is not NIL:
+        text = text[:max(length.value, 0)]
+    if lines is not NIL:
+        text = "\n".join(text.split("\n")[:max(lines.value, 0) + 1])
+    return Func("label", [x, y, Literal('"' + escape_string(text) + '"', text)], node.unused, None, "__pulp.__fn_prelabel(", ("labels", text))
 
-def op_block(cmd, statement, follow, end, ctx):
+# say and ask with literal text (and box size, if given) are recorded, so that their
+# pages can be worked out at build time (see paginate in pulplua.py).
+def build_dialog(cmd, op, ctx):
+    node = build_func(cmd, op, "__fn_", ctx)
+    if len(node.args) >= 9:
+        w, h, text = node.args[2], node.args[3], node.args[8]
+        if type(text) is Literal and type(text.value) is str and not any(ord(c) >= 0x80 for c in text.value) \
+                and all(arg is NIL or (type(arg) is Literal and type(arg.value) is int) for arg in [w, h]):
+            node.asset = ("dialog", (text.value, None if w is NIL else w.value, None if h is NIL else h.value))
+    return node
+
+def fill_colour(node):
+    colour = node.args[4] if len(node.args) > 4 else None
+    if type(colour) is Literal and type(colour.value) is str:
+        return fillcolours.get(colour.value)
+    return None
+
+def build_random(cmd, ctx):
+    assert len(cmd) in [2, 3], "wrong number of arguments for 'random'"
+    return Random([build_expression(arg, ctx) for arg in cmd[1:]])
+
+def build_branch(cmd, statement, follow, end, ctx):
     condition = cmd[1]
     comparison = condition[0]
     assert comparison in compdict, f"unrecognized comparison operator '{comparison}'"
-    compsym = compdict[comparison]
     if istoken(condition[1]):
-        compl = condition[1]
-        compl = remap_special_varname(ctx.pingvar(compl), ctx)
+        left = Get(condition[1])
     else:
-        compl = decode_rvalue(condition[1], ctx)
-    compr = decode_rvalue(condition[2], ctx)
+        left = build_expression(condition[1], ctx)
     block = cmd[2]
     assert(block[0] == "block")
-    s = f"{statement} {compl} {compsym} {compr} {follow}\n"
-    ctx.indent += 1
-    s += transpile_commands(ctx.blocks[block[1]], ctx)
-    ctx.indent -= 1
-    
+    followups = []
     for sub in cmd[3:]:
         if sub[0] == "elseif":
-            s += ctx.gi() + op_block(sub, "elseif", "then", None, ctx)
+            followups.append(build_branch(sub, "elseif", "then", None, ctx))
         elif sub[0] == "else":
-            s += ctx.gi() + "else\n"
-            ctx.indent += 1
-            block = sub[1]
-            assert(block[0] == "block")
-            s += transpile_commands(ctx.blocks[block[1]], ctx)
-            ctx.indent -= 1
-            pass
+            assert(sub[1][0] == "block")
+            followups.append(Else(sub[1][1]))
         else:
             assert False, f"unrecognized block followup '{sub[0]}'"
-    if end:
-        s += ctx.gi() + end
-    return s
+    return Branch(statement, follow, end, compdict[comparison], left, build_expression(condition[2], ctx), block[1], followups)
+
+# (tags are filled in by block_nodes)
+def build_call(cmd, ctx):
+    if istoken(cmd[1]):
+        return Call(cmd[1], None, [])
+    return Call(None, build_expression(cmd[1], ctx), [])
+
+def build_mimic(cmd, ctx):
+    target = build_name_ref(cmd, 1, ctx)
+    return Mimic(target, type(target) == OptimizedId or type(cmd[1]) == int)
+
+def build_tell(cmd, ctx):
+    target = cmd[1]
+    if type(target) == list and target[0] == "xy":
+        # inline version of 'tell x,y to'
+        assert cmd[2][0] == "block"
+        return TellAt(build_expression(target[1], ctx), build_expression(target[2], ctx), cmd[2][1])
+    elif type(target) == list and target[0] == "get" and target[1] in ["event.room", "event.game", "event.player"]:
+        # inline version of 'tell event.X to'
+        assert cmd[2][0] == "block"
+        return TellEvent("__pulp.player" if target[1] == "event.player" else target[1], cmd[2][1])
+    if type(target) == str and target in ctx.tile_ids:
+        cmd = [cmd[0], ["optimized-id", ctx.tile_ids[target], target]] + cmd[2:]
+    return Tell(build_func(cmd, "tell", "__fn_", ctx))
+
+command_builders = {
+    "done": lambda cmd, ctx: Done(),
+    "set": lambda cmd, ctx: build_set(cmd, "", ctx),
+    "add": lambda cmd, ctx: build_set(cmd, "+", ctx),
+    "sub": lambda cmd, ctx: build_set(cmd, "-", ctx),
+    "div": lambda cmd, ctx: build_set(cmd, "/", ctx),
+    "mul": lambda cmd, ctx: build_set(cmd, "*", ctx),
+    "inc": lambda cmd, ctx: Inc(cmd[1], "+=1"),
+    "dec": lambda cmd, ctx: Inc(cmd[1], "-=1"),
+    "random": build_random,
+    "fill": build_fill,
+    "sound": build_sound,
+    "label": build_label,
+    "say": lambda cmd, ctx: build_dialog(cmd, "say", ctx),
+    "ask": lambda cmd, ctx: build_dialog(cmd, "ask", ctx),
+    "if": lambda cmd, ctx: build_branch(cmd, "if", "then", "end", ctx),
+    "while": lambda cmd, ctx: build_branch(cmd, "while", "do", "end", ctx),
+    "call": build_call,
+    "emit": lambda cmd, ctx: Emit(build_expression(cmd[1], ctx)),
+    "mimic": build_mimic,
+    "tell": build_tell,
+    "#": lambda cmd, ctx: Comment(cmd[1], False),
+    "#$": lambda cmd, ctx: Comment(cmd[1], True),
+}
+
+# tags[i] holds the "[...]" comment tags that apply to commands[i-1], i.e.
+# those found in commands[i:] before the next non-list entry.
+# computed back-to-front so that a whole block is scanned only once.
+def get_cmds_tags(ctx, commands):
+    tags = [[] for _ in range(len(commands) + 1)]
+    for i in range(len(commands) - 1, -1, -1):
+        cmd = commands[i]
+        if type(cmd) == list:
+            tags[i] = tags[i + 1]
+            if cmd[0] in ["#", "#$"]:
+                idx = cmd[1]
+                if idx < len(ctx.comments_block):
+                    comment = ctx.comments_block[idx].strip()
+                    if comment.startswith("["):
+                        tags[i] = [comment] + tags[i + 1]
+    return tags
+
+def build_command(cmd, ctx):
+    op = cmd[0]
+    builder = command_builders.get(op)
+    if builder:
+        return builder(cmd, ctx)
+    elif op in funclist:
+        return build_func(cmd, op, "__fn_", ctx)
+    return UnknownCommand(op)
+
+# the nodes of ctx.blocks[blockidx], which are built the first time they're needed.
+def block_nodes(blockidx, ctx):
+    nodes = ctx.nodes.get(blockidx)
+    if nodes is None:
+        commands = ctx.blocks[blockidx]
+        folds = ctx.folding = dict()
+        nodes = []
+        calls = [] # (index, Call)
+        for i, command in enumerate(commands):
+            if type(command) == list and command[0] != "_":
+                # (build_command, inlined)
+                builder = command_builders.get(command[0])
+                node = builder(command, ctx) if builder else build_command(command, ctx)
+                nodes.append(node)
+                if type(node) is Call:
+                    calls.append((i, node))
+        if calls:
+            tags = get_cmds_tags(ctx, commands)
+            for i, node in calls:
+                node.tags = tags[i + 1]
+        if FOLD and not ctx.raw_lua:
+            nodes = fold_block(blockidx, nodes, folds, ctx)
+        colour = None
+        for node in nodes:
+            if type(node) is Func and node.op == "fill":
+                if colour and fill_colour(node) == colour:
+                    node.inline = FILLRECT
+                colour = fill_colour(node)
+            elif type(node) is not Comment or ctx.raw_lua:
+                colour = None
+        if folds:
+            ctx.folds[blockidx] = folds
+        ctx.nodes[blockidx] = nodes
+    return nodes
+
+# folding.
+#
+# conditions which compare two literals are evaluated at build time, and code
+# which can then never run is removed: branches which aren't taken, commands
+# after `done`, and blocks left with nothing in them. what's removed from a block
+# goes in ctx.dead, where transpile_block still lowers it (discarding the lua) so
+# that its variables, errors and [PTL]/[PDXINFO] comments are seen just as before,
+# though the sounds, labels and dialog it uses aren't prepared for it.
+# scripts with [LUA] comments are left alone, since the lua could depend on anything.
+
+NUMBER = (int, float)
+
+# the value of a comparison, as lua would evaluate it, or None if it isn't known.
+def fold_condition(node):
+    if type(node.left) is not Literal or type(node.right) is not Literal:
+        return None
+    left = node.left.value
+    right = node.right.value
+    if left is None or right is None:
+        return None
+    if type(left) in NUMBER and type(right) in NUMBER:
+        return compfuncs[node.compsym](left, right)
+    if node.compsym not in ["==", "~="]:
+        # (strings compare by locale in lua, and a string with a number is an error)
+        return None
+    return (left == right) == (node.compsym == "==")
+
+compfuncs = {
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "==": lambda a, b: a == b,
+    "~=": lambda a, b: a != b,
+}
+
+# a format string of literals becomes a single literal.
+# (floats are left alone, as lua might print them differently)
+def fold_format(node, ctx):
+    s = ""
+    for part, tostring in node.parts:
+        if type(part) is not Literal or type(part.value) not in [str, int]:
+            return node
+        s += str(part.value)
+    eliminate(ctx.folding, "expressions")
+    return literals.get((str, s)) or build_literal(s)
+
+# an if/elseif/else chain without the branches which can't be taken, or None if nothing is left.
+def fold_if(node, dead, folds):
+    branches = [node]
+    otherwise = None
+    for sub in node.followups:
+        if type(sub) is Branch:
+            if sub.followups:
+                return node
+            branches.append(sub)
+        else:
+            otherwise = sub.block
+    kept = []
+    folded = False
+    for i, branch in enumerate(branches):
+        value = fold_condition(branch)
+        if value is None:
+            kept.append(branch)
+            continue
+        eliminate(folds, "conditions")
+        folded = True
+        if value:
+            # (this branch is always taken, so it's the last one)
+            for sub in branches[i + 1:]:
+                dead.append(DoBlock(sub.block))
+                eliminate(folds, "branches")
+            if otherwise is not None:
+                dead.append(DoBlock(otherwise))
+                eliminate(folds, "branches")
+            otherwise = branch.block
+            break
+        dead.append(DoBlock(branch.block))
+        eliminate(folds, "branches")
+    if not folded:
+        return node
+    if not kept:
+        return DoBlock(otherwise) if otherwise is not None else None
+    followups = kept[1:] + ([Else(otherwise)] if otherwise is not None else [])
+    first = kept[0]
+    return Branch("if", "then", "end", first.compsym, first.left, first.right, first.block, followups)
+
+def is_pure(node):
+    return type(node) in [Literal, OptimizedId, Get]
+
+def eliminate(folds, kind):
+    folds[kind] = folds.get(kind, 0) + 1
+
+def fold_block(blockidx, nodes, folds, ctx):
+    dead = []
+    live = []
+    for i, node in enumerate(nodes):
+        t = type(node)
+        if t is Branch and node.statement == "if":
+            node = fold_if(node, dead, folds)
+        elif t is Branch and node.statement == "while":
+            value = fold_condition(node)
+            if value is not None:
+                eliminate(folds, "conditions")
+                if value:
+                    node = Forever(node.block)
+                else:
+                    dead.append(DoBlock(node.block))
+                    eliminate(folds, "branches")
+                    node = None
+        if node is None:
+            continue
+        t = type(node)
+        
+        # empty blocks (which are folded first)
+        if t is Branch and node.statement == "if":
+            followups = node.followups
+            if followups and type(followups[-1]) is Else and not block_nodes(followups[-1].block, ctx):
+                dead.append(DoBlock(followups[-1].block))
+                eliminate(folds, "blocks")
+                node = Branch("if", "then", "end", node.compsym, node.left, node.right, node.block, followups[:-1])
+            if not node.followups and is_pure(node.left) and is_pure(node.right) and not block_nodes(node.block, ctx):
+                dead += [node.left, node.right, DoBlock(node.block)]
+                eliminate(folds, "blocks")
+                continue
+        elif t is DoBlock and not block_nodes(node.block, ctx):
+            dead.append(node)
+            eliminate(folds, "blocks")
+            continue
+        
+        live.append(node)
+        if t is Done:
+            # everything after `done` is unreachable, except comments.
+            for node in nodes[i + 1:]:
+                if type(node) is Comment:
+                    live.append(node)
+                else:
+                    dead.append(node)
+                    eliminate(folds, "statements")
+            break
+    if dead:
+        ctx.dead[blockidx] = dead
+    return live
 
-def op_call(cmd, ctx, tags):
-    global EVNAMECOUNTER
+# lowering nodes to lua
+
+# event.* variables which are cached in a local at the start of each function
+cached_special_vars = {
+    "event.px": ("__event_px", "local __event_px = __pulp.player.x"),
+    "event.py": ("__event_py", "local __event_py = __pulp.player.y"),
+    "event.x": ("__event_x", "local __event_x = __actor.x or __pulp.player.x"),
+    "event.y": ("__event_y", "local __event_y = __actor.y or __pulp.player.y"),
+    "event.dx": ("__event_dx", "local __event_dx = event.dx or 0"),
+    "event.dy": ("__event_dy", "local __event_dy = event.dy or 0"),
+    "event.tile": ("__event_tile", "local __event_tile = __actor.name or 0"),
+}
+
+special_vars = {
+    "event.room": "event.room.name",
+    "event.player": "__pulp.player.name",
+    "datetime.year": "__getTime().year",
+    "datetime.year99": "--[[(year99)]] (__getTime().year % 100)",
+    "datetime.month": "__getTime().month",
+    "datetime.day": "__getTime().day",
+    "datetime.weekday": "(__getTime().weekday - 1)",
+    "datetime.hour": "__getTime().hour",
+    "datetime.hour12": "--[[(hour12)]] ((__getTime().hour % 12) + 1)",
+    "datetime.minute": "__getTime().minute",
+    "datetime.second": "__getTime().second",
+    "datetime.millisecond": "__getTime().millisecond --[[(PTL-only?)]]", #note: pulp-to-lua extension
+    "datetime.ampm": "--[[(ampm)]] (__getTime().hour < 12 and \"am\" or \"pm\")",
+    "datetime.AMPM": "--[[(AMPM)]] (__getTime().hour < 12 and \"AM\" or \"PM\")  --[[(PTL-only?)]]", #note: pulp-to-lua extension
+    "datetime.timestamp": "__getSecondsSinceEpoch()",
+    "__PTLE_SMOOTH_MOVEMENT_SPEED": "__pulp.PTLE_SMOOTH_MOVEMENT_SPEED",
+    "__PTLE_SMOOTH_OFFSET_X": "__pulp.PTLE_SMOOTH_OFFSET_X",
+    "__PTLE_SMOOTH_OFFSET_Y": "__pulp.PTLE_SMOOTH_OFFSET_Y",
+    "__PTLE_CONFIRM_DAS": "__pulp.PTLE_CONFIRM_DAS",
+    "__PTLE_CANCEL_DAS": "__pulp.PTLE_CANCEL_DAS",
+    "__PTLE_V_DAS": "__pulp.PTLE_V_DAS",
+    "__PTLE_H_DAS": "__pulp.PTLE_H_DAS",
+}
+
+def remap_special_varname(varname, ctx):
+    # these require special caching behaviour per-function
+    # note that they cannot be set (op_set), so we don't need to consider them there.
+    cached = cached_special_vars.get(varname)
+    if cached:
+        ctx.get_funccache().add(cached[1])
+        return cached[0]
+    return special_vars.get(varname, varname)
+
+def lower(node, ctx):
+    return lowerers[type(node)](node, ctx)
+
+def lower_format(node, ctx):
+    return " .. ".join("__tostring(" + lower(part, ctx) + ")" if tostring else lower(part, ctx)
+        for part, tostring in node.parts)
+
+def lower_subroutine(node, ctx):
+    s = "function(__actor, event, evname)\n"
+    ctx.indent += 2
+    s += transpile_block(node.block, ctx, True)
+    ctx.indent -= 2
+    return s + ctx.gi() + "  end"
+
+def lower_func(node, ctx):
+    mainargs = [arg.lua if type(arg) == Literal else lowerers[type(arg)](arg, ctx) for arg in node.args]
+    for arg in node.unused:
+        lower(arg, ctx)
+    if node.asset:
+        kind, asset = node.asset
+        getattr(ctx, kind).add(asset)
+    if node.inline:
+        s = node.inline
+        for i in range(len(mainargs)):
+            s = s.replace("{" + str(i) + "}", mainargs[i])
+        return s
+    return node.call + ", ".join(mainargs) + ")"
+
+def lower_unknown_expression(node, ctx):
+    ctx.errors += ["unknown expression code: " + node.code]
+    return f"nil --[[unknown expression code '{node.code}']]"
+
+def lower_set(node, ctx):
+    lvalue = ctx.pingvar(node.name)
+    rvalue = lower(node.value, ctx)
+    if node.operator == "" or RELASSIGN:
+        return f"{lvalue} {node.operator}= {rvalue}"
+    else:
+        return f"{lvalue} = {lvalue} {node.operator} {rvalue}"
+
+def lower_random(node, ctx):
+    return "__random(" + ", ".join(lower(arg, ctx) for arg in node.args) + ")"
+
+def lower_branch(node, ctx):
+    parts = [f"{node.statement} {lower(node.left, ctx)} {node.compsym} {lower(node.right, ctx)} {node.follow}\n"]
+    ctx.indent += 1
+    parts.append(transpile_block(node.block, ctx))
+    ctx.indent -= 1
     
+    for sub in node.followups:
+        if type(sub) == Branch:
+            parts.append(ctx.gi() + lower_branch(sub, ctx))
+        else:
+            parts.append(ctx.gi() + "else\n")
+            ctx.indent += 1
+            parts.append(transpile_block(sub.block, ctx))
+            ctx.indent -= 1
+    if node.end:
+        parts.append(ctx.gi() + node.end)
+    return "".join(parts)
+
+def lower_enclosed(header, node, ctx):
+    s = header
+    ctx.indent += 1
+    s += transpile_block(node.block, ctx)
+    ctx.indent -= 1
+    return s + ctx.gi() + "end"
+
+def lower_call(node, ctx):
     # NOTE: it's important that we use '__self' here, as *mimic* calls do not call back virtually to the original
     # actor's script.
     # ctx.get_funccache().add(f"local __evobj = {ctx.get_evobj()}")
+    evobj = ctx.get_evobj()
     
-    if istoken(cmd[1]):
-        fnstr = f"\"{cmd[1]}\""
-        callfn = f"{ctx.get_evobj()}.{cmd[1]}"
+    if node.name is not None:
+        fnstr = f"\"{node.name}\""
+        callfn = f"{evobj}.{node.name}"
     else:
-        fnstr = decode_rvalue(cmd[1], ctx)
-        callfn = f"{ctx.get_evobj()}[{fnstr}]"
+        fnstr = lower(node.value, ctx)
+        callfn = f"{evobj}[{fnstr}]"
         
-    fnbase = f";({callfn} or {ctx.get_evobj()}.any)"
+    fnbase = f";({callfn} or {evobj}.any)"
     
-    comment = f"--[call \"{fnstr[1:-1]}\"]"
-    
-    if "[DIRECT]" in tags:
+    # (without variable references, which mustn't be cut in half)
+    fnname = fnstr[1:-1].replace(VARREF, "")
+    comment = f"--[call \"{fnname}\"]"
     
+    if "[DIRECT]" in node.tags:
         fnbase = callfn
         comment += " [DIRECT]"
-            
     
-    if ctx.get_evobj() == "__self":
+    if evobj == "__self":
         ctx.get_funccache().add(f"local __self = {ctx.root_evobj} --[this script]")
         
         # simplification if we know the name of the function
-        if istoken(cmd[1]):
-            if cmd[1] in list(ctx.self_evnames):
+        if node.name is not None:
+            if node.name in ctx.self_evnames:
                 fnbase = callfn
                 comment = ""
             else:
                 fnbase = "__self.any"
                 comment += " [doesn't exist, so any]"
                 
-    for tag in tags:
+    for tag in node.tags:
         if tag.startswith("[SCRIPT:"):
             scriptsrc = tag[len("[SCRIPT:"):-1]
-            fnbase = ctx.add_script_tag(scriptsrc, fnstr[1:-1])
+            fnbase = ctx.add_script_tag(scriptsrc, fnname)
             comment += " " + tag
     
     return f"{fnbase}(__actor, event, {fnstr}) {comment}"
-        
-def op_emit(cmd, ctx):
-    return f"__pulp:emit({decode_rvalue(cmd[1], ctx)}, event)"
-    
-def op_mimic(cmd, ctx):
-    if optimize_name_ref(cmd, 1) or type(cmd[1]) == int:
-        s = f"do -- (mimic)\n"
-        ctx.indent += 1
-        s += ctx.gi() + f"local __mimic_target__ = (__pulp.tiles[{decode_rvalue(cmd[1], ctx)}] or __pulp.EMPTY).script;\n"
-        s += ctx.gi() + "(__mimic_target__[__evname] or __mimic_target__.any)(__actor, event, __evname)\n"
-        ctx.indent -= 1
-        s += ctx.gi() + "end"
-        return s
-    else:
-        s = "do -- (mimic)\n"
-        ctx.indent += 1
-        s += ctx.gi() + f"local __mimic_target__ = __pulp:getScript({decode_rvalue(cmd[1], ctx)}) or __pulp.EMPTY;\n"
-        s += ctx.gi() + f"(__mimic_target__[__evname] or __mimic_target__.any)(__actor, event, __evname)\n"
-        ctx.indent -= 1
-        s += ctx.gi() + "end"
-        return s
-    
-def op_tell(cmd, ctx):
-    if type(cmd[1]) == list and cmd[1][0] == "xy":
-        # inline version of 'tell x,y to'
-        s = "do --[tell x,y to]\n"
-        ctx.indent += 1
-        assert cmd[2][0] == "block"
-        s += ctx.gi() + f"local __actor = __roomtiles[{decode_rvalue(cmd[1][2], ctx)}][{decode_rvalue(cmd[1][1], ctx)}]\n"
-        s += ctx.gi() + f"if __actor and __actor.tile then\n"
-        ctx.indent += 1
-        ctx.push_evobj("__actor.script")
-        assert ctx.get_evobj() != "__self"
-        s += transpile_commands(ctx.blocks[cmd[2][1]], ctx, True)
-        ctx.pop_evobj()
-        ctx.indent -= 1
-        s += ctx.gi() + f"end\n"
-        ctx.indent -= 1
-        s += ctx.gi() + "end\n"
-        return s
-    elif type(cmd[1]) == list and cmd[1][0] == "get" and cmd[1][1] in ["event.room", "event.game", "event.player"]:
-        # inline version of 'tell event.X to'
-        target = cmd[1][1]
-        if target == "event.player":
-            target = "__pulp.player"
-        s = f"do --[tell {target} to]\n"
-        ctx.indent += 1
-        assert cmd[2][0] == "block"
-        s += ctx.gi() + f"local __actor = {target}\n"
-        s += ctx.gi() + f"if __actor then\n"
-        ctx.indent += 1
-        ctx.push_evobj("__actor.script")
-        s += transpile_commands(ctx.blocks[cmd[2][1]], ctx, True)
-        ctx.pop_evobj()
-        ctx.indent -= 1
-        s += ctx.gi() + f"end\n"
-        ctx.indent -= 1
-        s += ctx.gi() + "end\n"
-        return s
-    else:
-        optimize_name_ref(cmd, 1)
-        ctx.push_evobj("__actor.script")
-        s = opex_func(cmd, "tell", "__fn_", ctx)
-        ctx.pop_evobj()
-        return s
-    
-def opex_func(cmd, op, prefix, ctx):
-    mainargs = []
-    setargs = {
-        "actor": "__actor",
-        "event": "event",
-        "evname": "__evname",
-    }
-        
-    for arg in cmd[1:]:
-        if type(arg) == list:
-            if arg[0] == "xy":
-                setargs["x"] = decode_rvalue(arg[1], ctx)
-                setargs["y"] = decode_rvalue(arg[2], ctx)
-            elif arg[0] == "rect":
-                setargs["x"] = decode_rvalue(arg[1], ctx)
-                setargs["y"] = decode_rvalue(arg[2], ctx)
-                setargs["w"] = decode_rvalue(arg[3], ctx)
-                if len(arg) > 4: # pulp game 'Monitor Duty' needs this guard
-                    setargs["h"] = decode_rvalue(arg[4], ctx)
-            elif arg[0] == "block":
-                # e.g. "then" or "to"
-                setargs["block"] = decode_rvalue(arg, ctx)
-            else:
-                mainargs.append(decode_rvalue(arg, ctx))
-        else:
-            mainargs.append(decode_rvalue(arg, ctx))
-    
-    if op in funcargs:
-        for argname in funcargs[op][::-1]:
-            if argname in setargs:
-                mainargs = [setargs[argname]] + mainargs
-            else:
-                mainargs = ["nil"] + mainargs
-    
-    if prefix + op in inlinefuncs:
-        s = inlinefuncs[prefix + op]
-        for i in range(len(mainargs)):
-            s = s.replace("{" + str(i) + "}", mainargs[i])
-        return s
-    elif op in staticfuncs:
-        s = staticfuncs[op] + "("
-    else:
-        s = f"__pulp.{prefix}{op}("
-    first = True
-    for arg in mainargs:
-        if first:
-            first = False
-        else:
-            s += ", "
-        s += arg
-    return s + ")"
 
-def op_inc(cmd, operator, ctx):
-    return cmd[1] + operator
-    
-def op_random(cmd, ctx):
-    if len(cmd) == 2:
-        return f"__random({decode_rvalue(cmd[1], ctx)})"
-    elif len(cmd) == 3:
-        return f"__random({decode_rvalue(cmd[1], ctx)}, {decode_rvalue(cmd[2], ctx)})"
+def lower_mimic(node, ctx):
+    s = "do -- (mimic)\n"
+    ctx.indent += 1
+    if node.static:
+        s += ctx.gi() + f"local __mimic_target__ = (__pulp.tiles[{lower(node.target, ctx)}] or __pulp.EMPTY).script;\n"
     else:
-        assert False, "wrong number of arguments for 'random'"
-    
-def comment(cmd, prevline, ctx):
+        s += ctx.gi() + f"local __mimic_target__ = __pulp:getScript({lower(node.target, ctx)}) or __pulp.EMPTY;\n"
+    s += ctx.gi() + "(__mimic_target__[__evname] or __mimic_target__.any)(__actor, event, __evname)\n"
+    ctx.indent -= 1
+    s += ctx.gi() + "end"
+    return s
+
+# `lookup` and `check` are the lua which finds the actor, and tests that it exists.
+def lower_tell_block(header, lookup, check, block, ctx):
+    s = header
+    ctx.indent += 1
+    s += ctx.gi() + f"local __actor = {lookup}\n"
+    s += ctx.gi() + f"if {check} then\n"
+    ctx.indent += 1
+    ctx.push_evobj("__actor.script")
+    s += transpile_block(block, ctx, True)
+    ctx.pop_evobj()
+    ctx.indent -= 1
+    s += ctx.gi() + f"end\n"
+    ctx.indent -= 1
+    s += ctx.gi() + "end\n"
+    return s
+
+def lower_tell_at(node, ctx):
+    lookup = f"__roomtiles[{lower(node.y, ctx)}][{lower(node.x, ctx)}]"
+    return lower_tell_block("do --[tell x,y to]\n", lookup, "__actor and __actor.tile", node.block, ctx)
+
+def lower_tell_event(node, ctx):
+    return lower_tell_block(f"do --[tell {node.target} to]\n", node.target, "__actor", node.block, ctx)
+
+def lower_tell(node, ctx):
+    ctx.push_evobj("__actor.script")
+    s = lower_func(node.func, ctx)
+    ctx.pop_evobj()
+    return s
+
+LUANAME = re.compile(r'[a-zA-Z_]\w*')
+
+def lower_comment(node, ctx):
     s = "--"
-    idx = cmd[1]
+    idx = node.index
     comment = "<comment missing>"
     if idx < len(ctx.comments_block):
-        comment = ctx.comments_block[idx]
+        comment = ctx.comments_block[idx].replace(VARREF, "")
     if "\n" in comment:
         s += "[["
     
@@ -618,6 +1213,8 @@ def comment(cmd, prevline, ctx):
         s = comment.strip()[len("[LUA]"):];
         if s.startswith(" "):
           s = s[1:]
+        # (variables the lua refers to are kept out of __VARS; see write_vars)
+        ctx.lua_names.update(LUANAME.findall(s))
         return s
         
     # PTL extension: PDXINFO/PTL
@@ -628,7 +1225,7 @@ def comment(cmd, prevline, ctx):
     if stripcomment.startswith("[PTL]"):
         ctx.commentconfigure("PTL", stripcomment[len("[PTL]"):].strip())
     
-    if prevline:
+    if node.prevline:
         s += "^"
     
     s += comment
@@ -637,105 +1234,96 @@ def comment(cmd, prevline, ctx):
         s += "]]"
         
     return s
-        
-def get_next_cmds_tags(ctx, cmds):
-    tags = []
-    for cmd in cmds:
-        if type(cmd) == list:
-            if cmd[0] in ["#", "#$"]:
-                idx = cmd[1]
-                if idx < len(ctx.comments_block):
-                    comment = ctx.comments_block[idx].strip()
-                    if comment.startswith("["):
-                        tags.append(comment)
-        else:
-            break
-    return tags
 
-def transpile_command(cmd, ctx, next_cmds):
-    op = cmd[0]
-    
-    tags = get_next_cmds_tags(ctx, next_cmds)
-    
-    if op == "_":
-        return "" # ctx.gi() + "\n"
-    elif op == "done":
-        return ctx.gi() + "do return end\n"
-    elif op == "set":
-        return ctx.gi() + op_set(cmd, "", ctx) + "\n"
-    elif op == "add":
-        return ctx.gi() + op_set(cmd, "+", ctx) + "\n"
-    elif op == "sub":
-        return ctx.gi() + op_set(cmd, "-", ctx) + "\n"
-    elif op == "div":
-        return ctx.gi() + op_set(cmd, "/", ctx) + "\n"
-    elif op == "mul":
-        return ctx.gi() + op_set(cmd, "*", ctx) + "\n"
-    elif op == "inc":
-        return ctx.gi() + op_inc(cmd, "+=1", ctx) + "\n"
-    elif op == "dec":
-        return ctx.gi() + op_inc(cmd, "-=1", ctx) + "\n"
-    elif op == "random":
-        return ctx.gi() + op_random(cmd, ctx) + "\n"
-    elif op == "if":
-        return ctx.gi() + op_block(cmd, "if", "then", "end", ctx) + "\n"
-    elif op == "while":
-        return ctx.gi() + op_block(cmd, "while", "do", "end", ctx) + "\n"
-    elif op == "call":
-        return ctx.gi() + op_call(cmd, ctx, tags) + "\n"
-    elif op == "emit":
-        return ctx.gi() + op_emit(cmd, ctx) + "\n"
-    elif op == "mimic":
-        return ctx.gi() + op_mimic(cmd, ctx) + "\n"
-    elif op == "tell":
-        return ctx.gi() + op_tell(cmd, ctx) + "\n"
-    elif op in funclist:
-        return ctx.gi() + opex_func(cmd, op, "__fn_", ctx) + "\n"
-    elif op in ["#", "#$"]:
-        return ctx.gi() + comment(cmd, op == "#$", ctx) + "\n"
-    else:
-        ctx.errors += ["unknown command code: " + op]
-        return ctx.gi() + f"--unknown command code '{op}'\n"
+def lower_unknown_command(node, ctx):
+    ctx.errors += ["unknown command code: " + node.op]
+    return f"--unknown command code '{node.op}'"
 
-def transpile_commands(commands, ctx, has_funccache=False):
+lowerers = {
+    Literal: lambda node, ctx: node.lua,
+    OptimizedId: lambda node, ctx: node.lua,
+    Get: lambda node, ctx: remap_special_varname(ctx.pingvar(node.name), ctx),
+    Format: lower_format,
+    Embed: lambda node, ctx: f"__pulp.__ex_embed({lower(node.value, ctx)})",
+    NameAt: lambda node, ctx: f"__roomtiles[{lower(node.y, ctx)}][{lower(node.x, ctx)}].name",
+    Subroutine: lower_subroutine,
+    Func: lower_func,
+    UnknownExpression: lower_unknown_expression,
+    Done: lambda node, ctx: "do return end",
+    Set: lower_set,
+    Inc: lambda node, ctx: ctx.pingvar(node.name) + node.operator,
+    Random: lower_random,
+    Branch: lower_branch,
+    DoBlock: lambda node, ctx: lower_enclosed("do\n", node, ctx),
+    Forever: lambda node, ctx: lower_enclosed("while true do\n", node, ctx),
+    Call: lower_call,
+    Emit: lambda node, ctx: f"__pulp:emit({lower(node.value, ctx)}, event)",
+    Mimic: lower_mimic,
+    TellAt: lower_tell_at,
+    TellEvent: lower_tell_event,
+    Tell: lower_tell,
+    Comment: lower_comment,
+    UnknownCommand: lower_unknown_command,
+}
+
+def transpile_block(blockidx, ctx, has_funccache=False):
     if has_funccache:
         ctx.push_funccache()
-    s = ""
-    for i in range(len(commands)):
-        command = commands[i]
-        if type(command) == list:
-            s += transpile_command(command, ctx, commands[i+1:])
+    gi = ctx.gi()
+    lua = "".join([gi + lowerers[type(node)](node, ctx) + "\n" for node in block_nodes(blockidx, ctx)])
+    folds = ctx.folds.get(blockidx)
+    if folds:
+        for kind, count in folds.items():
+            ctx.eliminated[kind] = ctx.eliminated.get(kind, 0) + count
+        dead = ctx.dead.get(blockidx)
+        if dead:
+            # (the lua is discarded, along with any locals it would have cached and
+            # any sounds, labels and dialog it would have prepared at build time)
+            ctx.push_funccache()
+            assets = ctx.sounds, ctx.labels, ctx.dialog
+            ctx.sounds, ctx.labels, ctx.dialog = set(), set(), set()
+            for node in dead:
+                lowerers[type(node)](node, ctx)
+            ctx.sounds, ctx.labels, ctx.dialog = assets
+            ctx.pop_funccache()
     if has_funccache:
-        for cached in sorted(list(ctx.get_funccache())):
-            s = ctx.gi() + cached + "\n" + s
+        # (funccache lines are only known once the rest of the function has been transpiled)
+        funccache = sorted(list(ctx.get_funccache()), reverse=True)
+        # (variables sort last; see resolve_vars)
+        names = [cached[1:] for cached in funccache if cached[0] == VARREF]
+        alias = VARREF + "*" + gi + "".join(VARSEP + name for name in names) + VARREF if names else ""
+        lua = "".join(gi + cached + "\n" for cached in funccache[:len(funccache) - len(names)]) + alias + lua
         ctx.pop_funccache()
-    return s
+    return lua
         
-def transpile_event(evobj, evname, ctx, blockidx, evobjname, comments_block, evnames):
+def transpile_event(evobj, evname, ctx, blockidx, evobjname, comments_block, evnames, out):
     _evobj = f"__pulp:getScript(\"{evobj}\")" # evobjname would be faster, but less clear.
     if istoken(evname):
-        s = f"{_evobj}.{evname} = function(__actor, event, __evname)\n"
+        out.write(f"{_evobj}.{evname} = function(__actor, event, __evname)\n")
     else:
-        s = f"{_evobj}[\"{evname}\"] = function(__actor, event, __evname)\n"
+        out.write(f"{_evobj}[\"{evname}\"] = function(__actor, event, __evname)\n")
     
-    block = ctx.blocks[blockidx]
+    # (nodes are shared by the events of a script, which have the same blocks and comments)
+    if ctx.nodes_source is None or ctx.nodes_source[0] is not ctx.blocks or ctx.nodes_source[1] is not comments_block:
+        ctx.nodes = dict()
+        ctx.dead = dict()
+        ctx.folds = dict()
+        ctx.nodes_source = (ctx.blocks, comments_block)
+        ctx.raw_lua = any(comment.strip().startswith("[LUA]") for comment in comments_block)
     
     ctx.self_evnames = evnames
     ctx.comments_block = comments_block
     ctx.push_evobj("__self")
     ctx.root_evobj = evobjname if evobjname else _evobj
-    cmdstr = transpile_commands(ctx.blocks[blockidx], ctx, True)
+    out.write(transpile_block(blockidx, ctx, True))
     ctx.pop_evobj()
     
-    s += cmdstr
-    s += "end\n"
+    out.write("end\n")
     
     #optimization for one-line-only mimics
-    undecorated_block = list(filter(lambda x: type(x) == list and x[0] not in ["_", "#", "#$"], block))
-    if len(undecorated_block) == 1 and undecorated_block[0][0] == "mimic":
+    undecorated_block = [node for node in block_nodes(blockidx, ctx) if type(node) != Comment]
+    if len(undecorated_block) == 1 and type(undecorated_block[0]) == Mimic:
         mimic = undecorated_block[0]
-        # TODO: if int instead of optimized-id
-        if type(mimic[1]) == list and mimic[1][0] == "optimized-id":
-            mimic[1][2]
-            ctx.full_mimics.append((evobj, evname, mimic[1][2]))
-    return s
\ No newline at end of file
+        # TODO: if int instead of a tile name
+        if type(mimic.target) == OptimizedId:
+            ctx.full_mimics.append((evobj, evname, mimic.target.name))
@@ -0,0 +1,256 @@
+# Streaming ingest of pulp.json (see --stream).
+#
+# A pulp export is one JSON object whose large entries ("frames", "rooms",
+# "songs", "scripts"...) make up almost all of the file. Rather than parsing
+# the whole tree at once, iter_sections() scans the top-level object and
+# yields the raw text of one entry at a time, so only the entry currently
+# being handled needs to be held in memory.
+
+import hashlib
+import io
+import json
+import re
+import shutil
+import tempfile
+
+CHUNKSIZE = 1 << 20
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+decoder = json.JSONDecoder()
+
+class SectionReader:
+    def __init__(self, f, chunksize=CHUNKSIZE):
+        self.f = f
+        self.chunksize = chunksize
+        self.buf = ""
+        self.pos = 0
+        self.mark = 0 # text before this is no longer needed
+        self.offset = 0 # offset of buf in the file
+        self.eof = False
+
+    # reads more of the file, dropping the text which has been consumed.
+    # returns False at the end of the file.
+    def fill(self):
+        # (reads at least as much as is buffered, so that a section which spans
+        # many chunks is only re-parsed a logarithmic number of times)
+        chunk = self.f.read(max(self.chunksize, len(self.buf) - self.mark)) if not self.eof else ""
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.mark:] + chunk
+        self.pos -= self.mark
+        self.offset += self.mark
+        self.mark = 0
+        return True
+
+    def error(self, message):
+        return ValueError(f"malformed pulp.json: {message}")
+
+    # skips whitespace and returns the next character.
+    def peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise self.error("unexpected end of file")
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise self.error(f"expected '{c}' at '{self.buf[self.pos:self.pos + 20]}'")
+        self.pos += 1
+
+    # returns the raw text and the value of the JSON value at the next non-whitespace character.
+    def read_value(self):
+        self.peek()
+        self.mark = self.pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.mark)
+                # (a number might continue past the end of the buffer)
+                if self.eof or self.buf[self.mark] in "[{\"" or \
+                        (end < len(self.buf) and self.buf[end] in ",}] \t\n\r"):
+                    break
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise self.error(str(e))
+            # (the value continues past the end of the buffer)
+            self.fill()
+        self.pos = end
+        return self.buf[self.mark:end], value
+
+    # yields (key, raw JSON text, value, start, end) for each entry of the top-level object,
+    # in file order, where start and end are the file offsets of the key and the end of the value.
+    # with resume=True, reading starts just after an entry, and stops before the entry at
+    # offset `stop`, if given.
+    def entries(self, resume=False, stop=None):
+        if not resume:
+            self.expect("{")
+        elif self.peek() == ",":
+            self.pos += 1
+        if self.peek() == "}":
+            return
+        while True:
+            if self.peek() != "\"":
+                raise self.error("expected a key")
+            start = self.offset + self.pos
+            if start == stop:
+                return
+            key = self.read_value()[1]
+            self.expect(":")
+            text, value = self.read_value()
+            self.mark = self.pos
+            yield key, text, value, start, self.offset + self.pos
+            if self.peek() == "}":
+                return
+            self.expect(",")
+
+    # yields (key, raw JSON text, value) for each entry of the top-level object, in file order.
+    def __iter__(self):
+        for key, text, value, start, end in self.entries():
+            yield key, text, value
+
+def iter_sections(f, chunksize=CHUNKSIZE):
+    return SectionReader(f, chunksize)
+
+def text_reader(text, pos=0):
+    reader = SectionReader(io.StringIO())
+    reader.buf = text
+    reader.pos = pos
+    reader.eof = True
+    return reader
+
+# length of the common prefix of a and b (compared in blocks, and then by bisection).
+BLOCK = 1 << 16
+def common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i:i + BLOCK] == b[i:i + BLOCK]:
+        i += BLOCK
+    lo, hi = i, min(i + BLOCK, n)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if a[lo:mid + 1] == b[lo:mid + 1]:
+            lo = mid + 1
+        else:
+            hi = mid
+    return min(lo, n)
+
+# length of the common suffix of a and b, up to `limit`.
+def common_suffix(a, b, limit):
+    def tail(s, i, j): # the characters from i to j before the end of s
+        return s[len(s) - j:len(s) - i]
+    i = 0
+    while i < limit and tail(a, i, min(i + BLOCK, limit)) == tail(b, i, min(i + BLOCK, limit)):
+        i = min(i + BLOCK, limit)
+    lo, hi = i, min(i + BLOCK, limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if tail(a, lo, mid) == tail(b, lo, mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+# the entries of a pulp.json which is edited over time (see --watch). update() is
+# given the file's new contents, and only parses the entries which the edit touched;
+# every other entry keeps its digest, and is parsed only if something asks for it.
+class SectionIndex:
+    def __init__(self):
+        self.text = None
+        self.entries = [] # [key, start, end, digest, value or None]
+
+    # returns [(key, load, digest)] for every entry, in file order.
+    def update(self, text):
+        old = self.text
+        # (if text can't be parsed, the next update starts from scratch)
+        self.text = None
+        if old is not None:
+            prefix = common_prefix(old, text)
+            suffix = common_suffix(old, text, min(len(old), len(text)) - prefix)
+            delta = len(text) - len(old)
+            # (the character after an entry must be unchanged too, or a number could have grown)
+            before = [entry for entry in self.entries if entry[2] < prefix]
+            after = [entry for entry in self.entries if entry[1] >= len(old) - suffix]
+            for entry in after:
+                entry[1] += delta
+                entry[2] += delta
+            stop = after[0][1] if after else None
+            reader = text_reader(text, before[-1][2] if before else 0)
+            try:
+                rescanned = self.scan(reader.entries(resume=len(before) > 0, stop=stop))
+                if stop is None or reader.pos == stop:
+                    self.entries = before + rescanned + after
+                    self.text = text
+                    return self.result()
+            except ValueError:
+                pass
+            # (the edit changed the file's structure; parse all of it)
+        self.entries = []
+        self.entries = self.scan(text_reader(text).entries())
+        self.text = text
+        return self.result()
+
+    def scan(self, entries):
+        return [[key, start, end, hashlib.sha1(text.encode()).digest(), value]
+            for key, text, value, start, end in entries]
+
+    def result(self):
+        result = []
+        for entry in self.entries:
+            key, start, end, digest, value = entry
+            if value is not None:
+                entry[4] = None
+                load = lambda value=value: value
+            else:
+                load = lambda start=start, text=self.text: self.load(text, start)
+            result.append((key, load, digest))
+        return result
+
+    @staticmethod
+    def load(text, start):
+        reader = text_reader(text, start)
+        reader.read_value() # (the key)
+        reader.expect(":")
+        return reader.read_value()[1]
+
+# holds the raw text of a section until the sections it depends on have been read.
+class DeferredSection:
+    def __init__(self, text):
+        self.file = tempfile.TemporaryFile("w+")
+        self.file.write(text)
+
+    def load(self):
+        self.file.seek(0)
+        value = json.load(self.file)
+        self.file.close()
+        return value
+
+# a CodeWriter (see pulpscript.py) backed by a temporary file rather than memory.
+class SpoolWriter:
+    def __init__(self):
+        self.file = tempfile.TemporaryFile("w+")
+
+    def write(self, s):
+        self.file.write(s)
+
+    # replaces the code with f(code), line by line.
+    def transform(self, f):
+        self.file.seek(0)
+        transformed = tempfile.TemporaryFile("w+")
+        for line in self.file:
+            transformed.write(f(line))
+        self.file.close()
+        self.file = transformed
+
+    def writeto(self, f):
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, f)
+
+    def getvalue(self):
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self):
+        self.file.close()